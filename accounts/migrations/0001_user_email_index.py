@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Индекс по email пользователя для проверки уникальности при регистрации
+    (CustomUserCreationForm.clean_email). Модель User встроенная, поэтому
+    индекс создаётся SQL-миграцией в приложении accounts.
+    """
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS accounts_user_email_idx ON auth_user (email)',
+            'DROP INDEX IF EXISTS accounts_user_email_idx',
+        ),
+    ]
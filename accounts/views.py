@@ -6,7 +6,6 @@ from .forms import CustomUserCreationForm
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm
 from .forms import UserProfileForm, CustomPasswordChangeForm
-from products.models import Category
 
 def register(request):
     if request.method == 'POST':
@@ -91,7 +90,6 @@ def edit_profile(request):
     
     context = {
         'form': form,
-        'categories': Category.objects.all(),
     }
     return render(request, 'accounts/edit_profile.html', context)
 
@@ -112,6 +110,5 @@ def change_password(request):
     
     context = {
         'form': form,
-        'categories': Category.objects.all(),
     }
     return render(request, 'accounts/change_password.html', context)
\ No newline at end of file
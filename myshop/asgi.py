@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myshop.settings')
+# Асинхронные представления каталога (products.async_views) включаются
+# явно: MYSHOP_ASYNC_VIEWS=1; по умолчанию и под ASGI работают синхронные
 
 application = get_asgi_application()
+
+# Индекс автодополнения строится при старте воркера, а не на первом запросе
+from products.autocomplete import warm_up  # noqa: E402
+
+warm_up()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,11 +46,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'products.middleware.StaticFilesMiddleware',
+    'products.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'products.middleware.CartCookieMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -67,6 +71,8 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'products.context_processors.order_count',
+                'products.context_processors.categories',
+                'products.context_processors.cart',
             ],
         },
     },
@@ -82,6 +88,72 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Запись берёт блокировку в начале транзакции (BEGIN IMMEDIATE),
+        # ожидание блокировки - busy_timeout из SQLITE_PRAGMAS
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Соединение переживает запрос и проверяется перед повторным использованием
+        'CONN_MAX_AGE': int(os.environ.get('MYSHOP_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        # Тестовая база в файле: in-memory база с общим кэшем блокирует
+        # параллельные соединения, а тесты конкурентного доступа пишут из потоков
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# PRAGMA для каждого соединения с SQLite (products/sqlite.py). Отдельной
+# базе можно задать свои через ключ 'PRAGMAS' в DATABASES
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 10000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -32000,
+    'temp_store': 'MEMORY',
+}
+
+# Реплики для чтения каталога (products/routers.py): пути к файлам через
+# запятую в MYSHOP_REPLICA_DBS. Локально реплика - копия основной базы,
+# которую обновляет manage.py sync_replica; query_only не даёт в неё писать
+DATABASE_REPLICAS = []
+for index, name in enumerate(filter(None, os.environ.get('MYSHOP_REPLICA_DBS', '').split(',')), start=1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / name.strip(),
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'CONN_HEALTH_CHECKS': True,
+        'PRAGMAS': {**SQLITE_PRAGMAS, 'query_only': 'ON'},
+        # В тестах реплика - то же соединение, что и основная база
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['products.routers.ReplicaRouter']
+
+# Представления (имена URL), которые читают модели REPLICA_MODELS с реплик
+REPLICA_VIEWS = ['home', 'product_list', 'category_products']
+REPLICA_MODELS = ['products.Product', 'products.Category', 'products.Manufacturer', 'products.FacetCount']
+
+# Сколько секунд после записи посетитель читает только с основной базы:
+# с запасом больше отставания реплики
+REPLICA_PIN_SECONDS = 10
+
+# Кэш навигации, карточек и страниц. LocMemCache живёт внутри процесса:
+# версии, которыми сбрасываются закэшированные данные, хранятся в базе
+# (products/caching.py), поэтому изменение в одном воркере или команде
+# manage.py видят все процессы. Общий бэкенд (Redis, Memcached) лишь
+# избавит воркеры от заполнения своих копий кэша; изменения
+# автодополнения без него доходят до соседних процессов перестройкой индекса
+CACHES = {
+    'default': {
+        'BACKEND': 'products.cache_backends.LocMemCache',
+        'LOCATION': 'myshop',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
 }
 
@@ -131,6 +203,35 @@ STATICFILES_FINDERS = [
     'django.contrib.staticfiles.finders.AppDirectoriesFinder',
 ]
 
+# collectstatic склеивает бандлы, даёт файлам имена с хэшем и пишет .gz/.br;
+# отдаёт их products.middleware.StaticFilesMiddleware (см. products/staticfiles.py)
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'products.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Бандлы: имя -> части по порядку. Части не должны ссылаться на другие
+# файлы относительными url(), поэтому Font Awesome подключается отдельно
+STATIC_BUNDLES = {
+    'bundles/site.css': ['vendor/bootstrap/css/bootstrap.min.css', 'css/site.css'],
+    'bundles/site.js': ['vendor/bootstrap/js/bootstrap.bundle.min.js'],
+}
+
+# Сторонние файлы, которые manage.py vendor_assets скачивает в static/vendor/.
+# Пока их нет, страницы подключают их с этих адресов
+VENDOR_ASSETS = {
+    'vendor/bootstrap/css/bootstrap.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css',
+    'vendor/bootstrap/js/bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js',
+    'vendor/fontawesome/css/all.min.css':
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css',
+}
+
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
@@ -138,3 +239,20 @@ MEDIA_ROOT = BASE_DIR / "media"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Поисковый бэкенд каталога (dotted path). По умолчанию на SQLite
+# используется индекс FTS5, на других СУБД - поиск через icontains
+PRODUCT_SEARCH_BACKEND = None
+
+# Асинхронные представления каталога и корзины (products.async_views).
+# Выключены по умолчанию, в том числе под ASGI: синхронные middleware
+# Django переключают каждый запрос между потоками, и на замерах
+# (manage.py bench_server) они медленнее синхронных представлений.
+# Имеет смысл включать только под ASGI; под WSGI каждое асинхронное
+# представление запускало бы свой цикл событий
+ASYNC_VIEWS = os.environ.get('MYSHOP_ASYNC_VIEWS') == '1'
+
+# Почта. Письма о заказах отправляет фоновый обработчик (manage.py run_tasks);
+# в разработке они выводятся в консоль
+EMAIL_BACKEND = os.environ.get('MYSHOP_EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = 'LIV-Lib <noreply@liv-lib.local>'
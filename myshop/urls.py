@@ -3,6 +3,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from products import views
+from products.storage import serve_media
 from django.contrib import admin
 
 urlpatterns = [
@@ -14,7 +15,7 @@ urlpatterns = [
 
 # АВТОМАТИЧЕСКАЯ обработка статических файлов в разработке
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
 
 # Обработчики ошибок
 handler404 = 'products.views.custom_404'
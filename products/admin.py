@@ -1,7 +1,15 @@
 # Добавить модель "Производитель" (Manufacturer) с полями: название, страна, описание. Связать с моделью Product.
 
+from datetime import date
+
 from django.contrib import admin
-from .models import Category, Product, Manufacturer
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from django.urls import path
+from django.utils import timezone
+
+from . import exports
+from .models import Category, Product, Manufacturer, Order, OrderItem, Task
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -13,11 +21,11 @@ class CategoryAdmin(admin.ModelAdmin):
 class ProductAdmin(admin.ModelAdmin):
     list_display = (
         "name", "category", "manufacturer", "price",
-        "is_available", "created_at"
+        "stock", "is_available", "created_at"
     )
     list_filter = ("category", "manufacturer", "is_available", "created_at")
     search_fields = ("name", "description")
-    list_editable = ("price", "is_available")
+    list_editable = ("price", "stock", "is_available")
     readonly_fields = ("created_at", "updated_at")
 
     fieldsets = (
@@ -25,7 +33,7 @@ class ProductAdmin(admin.ModelAdmin):
             "fields": ("name", "description", "category", "manufacturer")
         }),
         ("Цена и доступность", {
-            "fields": ("price", "is_available")
+            "fields": ("price", "stock", "is_available")
         }),
         ("Изображение", {
             "fields": ("image",)
@@ -40,4 +48,77 @@ class ProductAdmin(admin.ModelAdmin):
 class ProductAdmin(admin.ModelAdmin):
     list_display = ("name", "country", "description")
     list_filter = ("name", "country")
-    search_fields = ("name", "country", "description")
\ No newline at end of file
+    search_fields = ("name", "country", "description")
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    fields = ("product", "product_name", "manufacturer_name", "quantity", "price")
+    readonly_fields = ("product", "product_name", "manufacturer_name")
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "created_at", "status", "total_price")
+    list_filter = ("status", "created_at")
+    search_fields = ("id", "user__username", "email")
+    date_hierarchy = "created_at"
+    list_select_related = ("user",)
+    inlines = (OrderItemInline,)
+    change_list_template = "admin/products/order/change_list.html"
+
+    def get_urls(self):
+        urls = [
+            path(
+                "export/",
+                self.admin_site.admin_view(self.export_view),
+                name="products_order_export",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {
+            **(extra_context or {}),
+            "export_formats": exports.FORMATS,
+            "status_choices": Order.STATUS_CHOICES,
+        }
+        return super().changelist_view(request, extra_context)
+
+    def export_view(self, request):
+        """Потоковая выгрузка заказов за период в CSV или JSONL"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        export_format = request.GET.get("format", "csv")
+        if export_format not in exports.FORMATS:
+            export_format = "csv"
+        orders = exports.filter_orders(
+            _parse_date(request.GET.get("date_from")),
+            _parse_date(request.GET.get("date_to")),
+            [status for status in request.GET.getlist("status") if status],
+        )
+        response = StreamingHttpResponse(
+            exports.iter_export(orders, export_format),
+            content_type=exports.CONTENT_TYPES[export_format],
+        )
+        filename = f"orders-{timezone.localdate():%Y%m%d}.{export_format}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "status", "attempts", "max_attempts", "run_at", "finished_at")
+    list_filter = ("status", "name")
+    readonly_fields = ("locked_at", "created_at", "finished_at", "last_error")
+    actions = ("retry",)
+
+    @admin.action(description="Повторить выбранные задачи")
+    def retry(self, request, queryset):
+        queryset.exclude(status="running").update(
+            status="pending", attempts=0, run_at=timezone.now(), finished_at=None,
+        )
@@ -0,0 +1,108 @@
+"""
+Асинхронные версии каталога и JSON-ответов корзины для запуска под ASGI.
+
+Запросы к базе выполняются асинхронным ORM (async for, afirst, ain_bulk,
+aaggregate), а синхронными остаются только шаблоны с контекст-процессорами,
+сырой SQL поиска и транзакции корзины - они уходят в поток через
+sync_to_async. Выборки и контекст общие с products.views (products.catalog).
+
+Подключаются вместо products.views, только когда явно задан
+MYSHOP_ASYNC_VIEWS=1: под ASGI с синхронными middleware Django они
+обслуживают меньше запросов в секунду, чем синхронные представления
+под WSGI (manage.py bench_server).
+"""
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect, render
+
+from . import catalog, facets, navigation
+from .cart import get_cart
+from .page_cache import cache_anonymous_page
+from .pagination import apaginate
+
+
+async def arender(request, template_name, context=None):
+    """render() в потоке: контекст-процессоры обращаются к базе синхронно"""
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def resolve_user(request):
+    """Пользователь без синхронного чтения сессии при обращении к request.user"""
+    request.user = await request.auser()
+    return request.user
+
+
+@cache_anonymous_page
+async def home(request):
+    await resolve_user(request)
+    context = {
+        'popular_products': [product async for product in catalog.popular_products()],
+    }
+    return await arender(request, 'home.html', context)
+
+
+@cache_anonymous_page
+async def product_list(request):
+    """Список всех товаров с шаблоном"""
+    await resolve_user(request)
+    query = catalog.product_list_query(request)
+    if query.ranked:
+        page = query.ranked_page(request, await sync_to_async(query.search)())
+        query.fill_page(page, await query.lookup.ain_bulk(page.object_list))
+    else:
+        page = await apaginate(request, query.products, query.sort, query.per_page)
+
+    context = query.context(page, await sync_to_async(facets.get_facets)(query.selected))
+    return await arender(request, 'products/product_list.html', context)
+
+
+@cache_anonymous_page
+async def category_products(request, category_id):
+    """Товары категории с шаблоном"""
+    await resolve_user(request)
+    category = await sync_to_async(navigation.get_category)(category_id)
+    if category is None:
+        raise Http404("Категория не найдена")
+    page = await apaginate(request, catalog.category_products(category_id), catalog.CATEGORY_ORDERING)
+
+    context = catalog.category_context(category, page)
+    return await arender(request, 'products/category_products.html', context)
+
+
+async def add_to_cart(request, product_id):
+    """Добавление товара в корзину"""
+    await resolve_user(request)
+    added = await get_cart(request).aadd(product_id)
+    if added is None:
+        raise Http404("Товар не найден")
+    product_name, total_quantity = added
+
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({
+            'success': True,
+            'cart_total_quantity': total_quantity,
+            'message': f'Товар "{product_name}" добавлен в корзину'
+        })
+
+    messages.success(request, f'Товар "{product_name}" добавлен в корзину')
+    return redirect(request.META.get('HTTP_REFERER', 'product_list'))
+
+
+async def remove_from_cart(request, item_id):
+    """Удаление товара из корзины"""
+    await resolve_user(request)
+    cart = get_cart(request)
+    product_name = await cart.aremove(item_id)
+    if product_name is None:
+        raise Http404("Товар не найден в корзине")
+
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({
+            'success': True,
+            'cart_total_quantity': await cart.atotal_quantity(),
+            'message': 'Товар удален из корзины'
+        })
+
+    messages.success(request, f'Товар "{product_name}" удален из корзины')
+    return redirect('cart_view')
@@ -0,0 +1,296 @@
+"""
+Автодополнение для строки поиска.
+
+Названия доступных товаров и издателей держатся в памяти процесса
+в отсортированных массивах ключей, поиск по префиксу идёт через bisect
+и не обращается к базе. Индекс строится при старте воркера (или при
+первом запросе).
+
+Изменения из сигналов применяются после фиксации транзакции: процесс
+правит свой индекс, берёт очередной номер из общего счётчика
+(products/counters.py), кладёт изменение в кэш под этим номером и только
+потом поднимает опубликованную версию. Другие процессы раз в
+SYNC_INTERVAL секунд применяют пропущенные изменения по номерам.
+Изменение, номер которого уже выдан, а запись ещё не видна, ждут до
+следующей сверки; если изменений слишком много или какое-то не появилось
+за CHANGE_WAIT секунд (вытеснено из кэша), индекс перестраивается в
+фоновом потоке, а запросы до конца перестройки обслуживает прежний индекс.
+"""
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+
+from . import counters
+
+logger = logging.getLogger(__name__)
+
+# Общие счётчики: последний выданный номер изменения и последний опубликованный
+SEQUENCE_COUNTER = 'autocomplete:sequence'
+VERSION_COUNTER = 'autocomplete:version'
+
+CHANGE_KEY = 'autocomplete:change:%s'
+
+CHANGE_TIMEOUT = 60 * 60
+
+# Сколько чужих изменений применять по одному; при большем отставании
+# дешевле перестроить индекс
+MAX_CHANGES = 1000
+
+# Как часто сверять версию индекса с общим счётчиком, секунд
+SYNC_INTERVAL = 5
+
+# Сколько ждать изменение, номер которого уже опубликован, прежде чем
+# счесть его потерянным и перестроить индекс, секунд
+CHANGE_WAIT = 3 * SYNC_INTERVAL
+
+# Сколько слов названия индексировать: "Песнь Сорокопута" находится
+# и по "пес", и по "сорок"
+MAX_WORDS = 4
+
+# Ключи обрезаются до этой длины: подсказки нужны по началу ввода,
+# а короткие ключи заметно экономят память на большом каталоге
+KEY_LENGTH = 24
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+
+
+def normalize(text):
+    return ' '.join((text or '').casefold().split())
+
+
+def word_keys(name):
+    """Ключи индекса: название целиком и его окончания, начиная с каждого слова"""
+    words = normalize(name).split(' ')
+    return list(dict.fromkeys(
+        ' '.join(words[i:])[:KEY_LENGTH] for i in range(min(len(words), MAX_WORDS)) if words[i]
+    ))
+
+
+class PrefixIndex:
+    """Отсортированный массив ключей с поиском по префиксу"""
+
+    def __init__(self):
+        self.keys = []
+        self.ids = array('q')
+        self.names = {}
+
+    def load(self, rows):
+        """Строит индекс из пар (id, название) за один проход сортировки"""
+        entries = []
+        names = {}
+        for pk, name in rows:
+            names[pk] = name
+            entries.extend((key, pk) for key in word_keys(name))
+        entries.sort()
+        self.keys = [key for key, _pk in entries]
+        self.ids = array('q', (pk for _key, pk in entries))
+        self.names = names
+
+    def add(self, pk, name):
+        self.remove(pk)
+        self.names[pk] = name
+        for key in word_keys(name):
+            position = bisect_left(self.keys, key)
+            self.keys.insert(position, key)
+            self.ids.insert(position, pk)
+
+    def remove(self, pk):
+        name = self.names.pop(pk, None)
+        if name is None:
+            return
+        for key in word_keys(name):
+            position = bisect_left(self.keys, key)
+            while position < len(self.keys) and self.keys[position] == key:
+                if self.ids[position] == pk:
+                    del self.keys[position]
+                    del self.ids[position]
+                    break
+                position += 1
+
+    def search(self, prefix, limit):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        key_prefix = prefix[:KEY_LENGTH]
+        results = []
+        seen = set()
+        position = bisect_left(self.keys, key_prefix)
+        keys, ids = self.keys, self.ids
+        while position < len(keys) and len(results) < limit and keys[position].startswith(key_prefix):
+            pk = ids[position]
+            if pk not in seen:
+                seen.add(pk)
+                name = self.names[pk]
+                # Длинный ввод дополнительно сверяем с полным названием
+                if prefix == key_prefix or prefix in normalize(name):
+                    results.append({'id': pk, 'name': name})
+            position += 1
+        return results
+
+    def __len__(self):
+        return len(self.names)
+
+
+class Autocomplete:
+    """Индексы товаров и издателей текущего процесса"""
+
+    def __init__(self):
+        self.products = PrefixIndex()
+        self.manufacturers = PrefixIndex()
+        self.version = None
+        self.checked_at = 0
+        # Номер изменения, которого не оказалось в кэше, и с какого момента
+        self.missing = None
+        self.missing_since = 0
+        self.lock = threading.RLock()
+        # Одновременно идёт не больше одного построения
+        self.build_lock = threading.Lock()
+        self.rebuilding = False
+
+    def build(self):
+        with self.build_lock:
+            self._build()
+
+    def _build(self):
+        from .models import Manufacturer, Product
+
+        products = PrefixIndex()
+        manufacturers = PrefixIndex()
+        # Версия берётся до чтения базы: изменения, опубликованные во время
+        # построения, применятся при следующей сверке
+        version = published_version()
+        products.load(
+            Product.objects.filter(is_available=True).values_list('id', 'name').iterator(chunk_size=5000)
+        )
+        manufacturers.load(Manufacturer.objects.values_list('id', 'name').iterator(chunk_size=5000))
+        with self.lock:
+            self.products, self.manufacturers = products, manufacturers
+            self.version = version
+            self.checked_at = time.monotonic()
+
+    def ensure_fresh(self):
+        """Строит индекс при первом обращении и применяет изменения других процессов"""
+        if self.version is None:
+            with self.build_lock:
+                if self.version is None:
+                    self._build()
+            return
+        now = time.monotonic()
+        if now - self.checked_at < SYNC_INTERVAL:
+            return
+        self.checked_at = now
+        if not self.apply_changes(published_version()):
+            self.schedule_rebuild()
+
+    def apply_changes(self, version):
+        """Применяет опубликованные изменения до version; False, если нужна перестройка"""
+        with self.lock:
+            if version <= self.version:
+                return True
+            if version - self.version > MAX_CHANGES:
+                return False
+            numbers = range(self.version + 1, version + 1)
+            changes = cache.get_many([CHANGE_KEY % number for number in numbers])
+            for number in numbers:
+                change = changes.get(CHANGE_KEY % number)
+                if change is None:
+                    return self._wait_for(number)
+                self._apply(*change)
+                self.version = number
+            return True
+
+    def _wait_for(self, number):
+        """
+        Изменения number ещё нет в кэше: номер выдан, а запись не дошла.
+        True - подождать до следующей сверки, False - ждём слишком долго.
+        """
+        now = time.monotonic()
+        if self.missing != number:
+            self.missing, self.missing_since = number, now
+            return True
+        return now - self.missing_since < CHANGE_WAIT
+
+    def schedule_rebuild(self):
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Не удалось перестроить индекс автодополнения')
+        finally:
+            self.rebuilding = False
+            connection.close()
+
+    def search(self, prefix, limit=DEFAULT_LIMIT):
+        self.ensure_fresh()
+        with self.lock:
+            return {
+                'products': self.products.search(prefix, limit),
+                'manufacturers': self.manufacturers.search(prefix, limit),
+            }
+
+    def _apply(self, attr, pk, name):
+        # Изменения идемпотентны: повторное применение ничего не портит
+        index = getattr(self, attr)
+        if name is None:
+            index.remove(pk)
+        else:
+            index.add(pk, name)
+
+    def _changed(self, attr, pk, name):
+        # Откаченное сохранение не должно попасть в индекс
+        transaction.on_commit(lambda: self.publish(attr, pk, name))
+
+    def publish(self, attr, pk, name):
+        """Применяет изменение к своему индексу и передаёт его другим процессам"""
+        # Сначала запись изменения, потом версия: увидевший версию процесс
+        # находит изменение в кэше, а не перестраивает индекс
+        version = counters.advance(SEQUENCE_COUNTER)
+        cache.set(CHANGE_KEY % version, (attr, pk, name), CHANGE_TIMEOUT)
+        counters.raise_to({VERSION_COUNTER: version})
+        with self.lock:
+            if self.version is None:
+                # Индекс ещё не строился - подхватит изменение при построении
+                return
+            self._apply(attr, pk, name)
+            if self.version == version - 1:
+                self.version = version
+
+    def product_changed(self, product):
+        self._changed('products', product.pk, product.name if product.is_available else None)
+
+    def product_removed(self, product_id):
+        self._changed('products', product_id, None)
+
+    def manufacturer_changed(self, manufacturer):
+        self._changed('manufacturers', manufacturer.pk, manufacturer.name)
+
+    def manufacturer_removed(self, manufacturer_id):
+        self._changed('manufacturers', manufacturer_id, None)
+
+
+def published_version():
+    """Номер последнего опубликованного изменения"""
+    return counters.get_many([VERSION_COUNTER])[VERSION_COUNTER]
+
+
+autocomplete = Autocomplete()
+
+
+def warm_up():
+    """Строит индекс при старте воркера; без базы отложит построение до первого запроса"""
+    try:
+        autocomplete.build()
+    except DatabaseError:
+        pass
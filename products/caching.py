@@ -0,0 +1,74 @@
+"""
+Версии закэшированных данных.
+
+Вместо удаления отдельных ключей при изменении данных увеличивается
+номер версии пространства имён; ключи со старой версией просто
+перестают читаться и вытесняются кэшем сами.
+
+Версии хранятся в общей таблице счётчиков (products/counters.py), а не
+в кэше: кэш по умолчанию живёт внутри процесса, и сброс, сделанный одним
+воркером или командой manage.py, иначе не дошёл бы до остальных. Процесс
+перечитывает версию не чаще раза в VERSION_CHECK_SECONDS, свой сброс
+видит сразу.
+"""
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+
+from . import counters
+
+VERSION_KEY = 'version:%s'
+
+VERSION_CHECK_SECONDS = 1
+
+# {пространство имён: (версия, когда прочитана)}
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def _initial_version():
+    # Версия - время в мс: если строку счётчика удалят, новая версия
+    # всё равно будет больше всех прежних и старые ключи не оживут
+    return int(time.time() * 1000)
+
+
+def _remember(namespace, version):
+    with _versions_lock:
+        _versions[namespace] = (version, time.monotonic())
+    return version
+
+
+def _known_version(namespace):
+    """Версия, прочитанная этим процессом меньше VERSION_CHECK_SECONDS назад, или None"""
+    version, checked_at = _versions.get(namespace, (None, None))
+    if version is None or time.monotonic() - checked_at >= VERSION_CHECK_SECONDS:
+        return None
+    return version
+
+
+def read_version(namespace):
+    """Версия из общей таблицы; при первом обращении заводит счётчик"""
+    key = VERSION_KEY % namespace
+    version = counters.get_many([key])[key]
+    if not version:
+        counters.raise_to({key: _initial_version()})
+        version = counters.get_many([key])[key]
+    return _remember(namespace, version)
+
+
+def get_version(namespace):
+    """Текущая версия пространства имён"""
+    version = _known_version(namespace)
+    return read_version(namespace) if version is None else version
+
+
+async def aget_version(namespace):
+    """Асинхронный вариант get_version: в поток только при перечитывании"""
+    version = _known_version(namespace)
+    return await sync_to_async(read_version)(namespace) if version is None else version
+
+
+def bump_version(namespace):
+    """Делает недействительными все ключи пространства имён во всех процессах"""
+    return _remember(namespace, counters.advance(VERSION_KEY % namespace, _initial_version()))
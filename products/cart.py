@@ -0,0 +1,410 @@
+"""
+Корзина покупателя.
+
+Корзина вошедшего пользователя хранится в базе (Cart/CartItem), корзина
+анонимного посетителя - в подписанной cookie, поэтому сборка корзины
+без входа не пишет в базу. Обе реализуют один интерфейс; get_cart()
+выбирает нужную и создаёт её один раз на запрос, так что шапка сайта,
+страница корзины, оформление заказа и AJAX-ответы берут количество,
+сумму и позиции из одного объекта. Для шапки базовой корзине хватает
+одного агрегирующего запроса, cookie-корзине - ни одного.
+
+Изменения базовой корзины выполняются атомарными запросами: добавление
+товара - один INSERT ... ON CONFLICT DO UPDATE, который прибавляет
+количество в самой базе, поэтому двойной клик или параллельные запросы
+не теряют увеличений. При входе cookie-корзина переносится в базу
+одним таким же запросом на все позиции (см. merge_cookie_cart).
+"""
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.core import signing
+from django.db import connection, transaction
+from django.db.models import DecimalField, F, Sum
+from django.utils import timezone
+
+from . import routers
+from .models import Cart, CartItem, Product
+
+COOKIE_NAME = 'cart'
+COOKIE_SALT = 'products.cart'
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+
+# Cookie ограничена ~4 КБ, столько позиций в неё гарантированно помещается
+COOKIE_MAX_ITEMS = 100
+MAX_QUANTITY = 999
+
+# SET для ON CONFLICT: сумма количеств, но не больше MAX_QUANTITY (параметры - два раза MAX_QUANTITY)
+CLAMPED_QUANTITY = (
+    'quantity = CASE WHEN quantity + excluded.quantity > %s THEN %s ELSE quantity + excluded.quantity END'
+)
+
+
+class BaseCart:
+    """Количество, сумма и позиции корзины; изменения - в наследниках"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Сбрасывает загруженные данные после изменения корзины"""
+        self._items = None
+        self._totals = None
+
+    def load_items(self):
+        raise NotImplementedError
+
+    def load_totals(self):
+        raise NotImplementedError
+
+    @property
+    def items(self):
+        """Позиции корзины с товарами и категориями"""
+        if self._items is None:
+            self._items = self.load_items()
+            self._totals = self.summarize(self._items)
+        return self._items
+
+    @staticmethod
+    def summarize(items):
+        return (
+            sum(item.quantity for item in items),
+            sum((item.product.price * item.quantity for item in items), Decimal('0')),
+        )
+
+    def _load_totals(self):
+        if self._totals is None:
+            self._totals = self.load_totals()
+        return self._totals
+
+    @property
+    def total_quantity(self):
+        return self._load_totals()[0]
+
+    async def atotal_quantity(self):
+        """Асинхронный вариант total_quantity"""
+        if self._totals is None:
+            self._totals = await self.aload_totals()
+        return self._totals[0]
+
+    async def aload_totals(self):
+        return await sync_to_async(self.load_totals)()
+
+    # Изменения базовой корзины идут в транзакциях и через сырой SQL,
+    # которые в Django есть только в синхронном виде
+    async def aadd(self, product_id, quantity=1):
+        return await sync_to_async(self.add)(product_id, quantity)
+
+    async def aremove(self, item_id):
+        return await sync_to_async(self.remove)(item_id)
+
+    @property
+    def total_price(self):
+        return self._load_totals()[1]
+
+    def __bool__(self):
+        return self.total_quantity > 0
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class DatabaseCart(BaseCart):
+    """Корзина вошедшего пользователя в таблицах Cart/CartItem"""
+
+    def __init__(self, user):
+        self.user = user
+        super().__init__()
+
+    def _queryset(self):
+        return CartItem.objects.filter(cart__user=self.user)
+
+    def load_items(self):
+        """Один запрос с JOIN товаров и категорий"""
+        return list(self._queryset().select_related('product', 'product__category'))
+
+    def _totals_expressions(self):
+        return {
+            'total_quantity': Sum('quantity'),
+            'total_price': Sum(
+                F('quantity') * F('product__price'),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        }
+
+    def load_totals(self):
+        totals = self._queryset().aggregate(**self._totals_expressions())
+        return totals['total_quantity'] or 0, totals['total_price'] or Decimal('0')
+
+    async def aload_totals(self):
+        totals = await self._queryset().aaggregate(**self._totals_expressions())
+        return totals['total_quantity'] or 0, totals['total_price'] or Decimal('0')
+
+    def add(self, product_id, quantity=1):
+        """(название товара, новое количество в корзине) или None"""
+        self.reset()
+        return add_item(self.user, product_id, quantity)
+
+    def set_quantity(self, item_id, quantity):
+        self.reset()
+        return bool(set_item_quantity(self.user, item_id, quantity))
+
+    def remove(self, item_id):
+        self.reset()
+        return remove_item(self.user, item_id)
+
+    def update_many(self, changes):
+        """
+        Применяет {id позиции: количество} одной транзакцией: bulk_update
+        для новых количеств и один DELETE для нулевых. Возвращает id
+        позиций, которых нет в корзине.
+        """
+        self.reset()
+        with transaction.atomic():
+            items = list(self._queryset().filter(id__in=list(changes)).select_for_update(of=('self',)))
+            changed = []
+            for item in items:
+                if changes[item.pk] > 0 and changes[item.pk] != item.quantity:
+                    item.quantity = changes[item.pk]
+                    changed.append(item)
+            if changed:
+                CartItem.objects.bulk_update(changed, ['quantity'])
+            removed = [item.pk for item in items if changes[item.pk] <= 0]
+            if removed:
+                CartItem.objects.filter(id__in=removed).delete()
+        found = {item.pk for item in items}
+        return [item_id for item_id in changes if item_id not in found]
+
+    def clear(self):
+        self.reset()
+        self._queryset().delete()
+
+
+class CookieCart(BaseCart):
+    """
+    Корзина анонимного посетителя: {id товара: количество} в подписанной
+    cookie. Позицией корзины служит сам товар, поэтому item_id - это id
+    товара. Cookie записывает CartCookieMiddleware, если корзина изменилась.
+    """
+
+    def __init__(self, request):
+        self.quantities = self._read(request)
+        self.modified = False
+        super().__init__()
+
+    @staticmethod
+    def _read(request):
+        value = request.COOKIES.get(COOKIE_NAME)
+        if not value:
+            return {}
+        try:
+            data = signing.loads(value, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE)
+            return {
+                int(product_id): min(int(quantity), MAX_QUANTITY)
+                for product_id, quantity in data.items() if int(quantity) > 0
+            }
+        except (signing.BadSignature, AttributeError, TypeError, ValueError):
+            return {}
+
+    def dumps(self):
+        return signing.dumps(
+            {str(pk): quantity for pk, quantity in self.quantities.items()},
+            salt=COOKIE_SALT, compress=True,
+        )
+
+    def _changed(self):
+        self.modified = True
+        self.reset()
+
+    def load_items(self):
+        """Товары корзины одним запросом; удалённые из каталога пропадают"""
+        products = Product.objects.select_related('category').in_bulk(list(self.quantities))
+        return [
+            CartItem(id=pk, product=products[pk], quantity=quantity)
+            for pk, quantity in self.quantities.items() if pk in products
+        ]
+
+    def load_totals(self):
+        # Количество известно без базы (см. total_quantity), сумме нужны цены товаров
+        return self.summarize(self.items) if self.quantities else (0, Decimal('0'))
+
+    @property
+    def total_quantity(self):
+        if self._totals is None:
+            return sum(self.quantities.values())
+        return self._totals[0]
+
+    def _available_name(self, product_id):
+        return Product.objects.filter(pk=product_id, is_available=True).values_list('name', flat=True)
+
+    def add(self, product_id, quantity=1):
+        return self._add(product_id, quantity, self._available_name(product_id).first())
+
+    async def aadd(self, product_id, quantity=1):
+        return self._add(product_id, quantity, await self._available_name(product_id).afirst())
+
+    def _add(self, product_id, quantity, name):
+        if name is None:
+            return None
+        if product_id not in self.quantities and len(self.quantities) >= COOKIE_MAX_ITEMS:
+            return None
+        self.quantities[product_id] = min(self.quantities.get(product_id, 0) + quantity, MAX_QUANTITY)
+        self._changed()
+        return name, sum(self.quantities.values())
+
+    def set_quantity(self, item_id, quantity):
+        if item_id not in self.quantities:
+            return False
+        if quantity > 0:
+            self.quantities[item_id] = min(quantity, MAX_QUANTITY)
+        else:
+            del self.quantities[item_id]
+        self._changed()
+        return True
+
+    def remove(self, item_id):
+        if item_id not in self.quantities:
+            return None
+        del self.quantities[item_id]
+        self._changed()
+        return Product.objects.filter(pk=item_id).values_list('name', flat=True).first() or ''
+
+    async def aremove(self, item_id):
+        if item_id not in self.quantities:
+            return None
+        del self.quantities[item_id]
+        self._changed()
+        return await Product.objects.filter(pk=item_id).values_list('name', flat=True).afirst() or ''
+
+    async def atotal_quantity(self):
+        return self.total_quantity
+
+    def update_many(self, changes):
+        missing = [item_id for item_id in changes if item_id not in self.quantities]
+        for item_id, quantity in changes.items():
+            if item_id in self.quantities:
+                if quantity > 0:
+                    self.quantities[item_id] = min(quantity, MAX_QUANTITY)
+                else:
+                    del self.quantities[item_id]
+        if len(missing) < len(changes):
+            self._changed()
+        return missing
+
+    def clear(self):
+        if self.quantities:
+            self.quantities = {}
+            self._changed()
+
+
+def get_cart(request):
+    """Корзина текущего запроса, создаётся один раз"""
+    cart = getattr(request, '_cart', None)
+    if cart is None:
+        if request.user.is_authenticated:
+            cart = DatabaseCart(request.user)
+        else:
+            cart = request._cookie_cart = CookieCart(request)
+        request._cart = cart
+    return cart
+
+
+def merge_cookie_cart(request, user):
+    """
+    Переносит cookie-корзину в базовую корзину пользователя одним upsert;
+    количества одинаковых товаров складываются, недоступные товары
+    пропускаются. Cookie удалит CartCookieMiddleware.
+    """
+    cookie_cart = getattr(request, '_cookie_cart', None) or CookieCart(request)
+    request._cookie_cart = cookie_cart
+    request._cart = None
+    if not cookie_cart.quantities:
+        return 0
+    rows = list(cookie_cart.quantities.items())
+    values = ', '.join(['(%s, %s)'] * len(rows))
+    sql = f"""
+        INSERT INTO {CartItem._meta.db_table} (cart_id, product_id, quantity, added_at)
+        SELECT %s, product.id, incoming.column2, %s
+        FROM (VALUES {values}) AS incoming
+        JOIN {Product._meta.db_table} AS product ON product.id = incoming.column1
+        WHERE product.is_available
+        ON CONFLICT (cart_id, product_id) DO UPDATE SET {CLAMPED_QUANTITY}
+    """
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with transaction.atomic():
+        cart, _created = Cart.objects.get_or_create(user=user)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql,
+                [cart.pk, now] + [value for row in rows for value in row] + [MAX_QUANTITY, MAX_QUANTITY],
+            )
+            merged = cursor.rowcount
+    cookie_cart.clear()
+    return merged
+
+
+def _upsert_item(user_id, product_id, quantity):
+    """Добавляет товар в существующую корзину; None, если корзины нет или товар недоступен"""
+    sql = f"""
+        INSERT INTO {CartItem._meta.db_table} (cart_id, product_id, quantity, added_at)
+        SELECT cart.id, product.id, %s, %s
+        FROM {Cart._meta.db_table} AS cart, {Product._meta.db_table} AS product
+        WHERE cart.user_id = %s AND product.id = %s AND product.is_available
+        ON CONFLICT (cart_id, product_id) DO UPDATE SET {CLAMPED_QUANTITY}
+        RETURNING cart_id
+    """
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    routers.mark_write()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql, [min(quantity, MAX_QUANTITY), now, user_id, product_id, MAX_QUANTITY, MAX_QUANTITY],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def add_item(user, product_id, quantity=1):
+    """
+    Увеличивает количество товара в корзине одним атомарным запросом.
+    Возвращает (название товара, новое количество в корзине) или None,
+    если товар не найден или недоступен.
+    """
+    with transaction.atomic():
+        cart_id = _upsert_item(user.pk, product_id, quantity)
+        if cart_id is None:
+            # Корзины ещё нет (или её только что создал параллельный запрос,
+            # например второй клик) - создаём и повторяем
+            Cart.objects.get_or_create(user=user)
+            cart_id = _upsert_item(user.pk, product_id, quantity)
+            if cart_id is None:
+                return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT name, (SELECT SUM(quantity) FROM {CartItem._meta.db_table} WHERE cart_id = %s) "
+                f"FROM {Product._meta.db_table} WHERE id = %s",
+                [cart_id, product_id],
+            )
+            name, total_quantity = cursor.fetchone()
+    return name, total_quantity
+
+
+def set_item_quantity(user, item_id, quantity):
+    """Задаёт количество позиции одним UPDATE, при quantity <= 0 удаляет её. Возвращает число строк"""
+    items = CartItem.objects.filter(id=item_id, cart__user=user)
+    if quantity > 0:
+        return items.update(quantity=min(quantity, MAX_QUANTITY))
+    deleted, _rows = items.delete()
+    return deleted
+
+
+def remove_item(user, item_id):
+    """Удаляет позицию корзины, возвращает название товара или None"""
+    with transaction.atomic():
+        items = CartItem.objects.filter(id=item_id, cart__user=user)
+        name = items.values_list('product__name', flat=True).first()
+        if name is None or not items.delete()[0]:
+            return None
+    return name
@@ -0,0 +1,105 @@
+"""
+Выборки страниц каталога, общие для синхронных (products.views)
+и асинхронных (products.async_views) представлений.
+
+Здесь разбираются параметры запроса и строятся queryset'ы и контекст
+шаблонов; представления только выполняют запросы - обычным или
+асинхронным ORM.
+"""
+from dataclasses import dataclass
+
+from django.db.models import QuerySet
+
+from . import facets
+from .models import Product
+from .pagination import get_page_size, paginate_sequence
+from .search import get_search_backend
+
+# Допустимые варианты сортировки каталога
+SORT_OPTIONS = ['name', 'price', '-price', '-created_at']
+
+POPULAR_COUNT = 4
+CATEGORY_ORDERING = '-created_at'
+
+
+def popular_products():
+    return Product.objects.filter(is_available=True)[:POPULAR_COUNT]
+
+
+def category_products(category_id):
+    return Product.objects.filter(category_id=category_id, is_available=True)
+
+
+def category_context(category, page):
+    return {
+        'category': category,
+        'products': page.object_list,
+        'page': page,
+    }
+
+
+@dataclass
+class ProductListQuery:
+    """Разобранные параметры списка товаров"""
+    selected: dict
+    products: QuerySet
+    search_query: str
+    # None - товары по релевантности поиска
+    sort: str | None
+    per_page: int
+
+    @property
+    def ranked(self):
+        return self.sort is None
+
+    def search(self):
+        """id найденных товаров по релевантности с учётом фасетов"""
+        return get_search_backend().search(self.search_query, queryset=self.products)
+
+    def ranked_page(self, request, ranked_ids):
+        """Страница id из результатов поиска; товары подставляет fill_page()"""
+        return paginate_sequence(
+            ranked_ids, self.per_page,
+            request.GET.get('after'), request.GET.get('before'),
+        )
+
+    @property
+    def lookup(self):
+        """queryset для in_bulk() товаров страницы поиска"""
+        return self.products.order_by()
+
+    @staticmethod
+    def fill_page(page, found):
+        """Заменяет id на странице товарами из in_bulk(), сохраняя порядок"""
+        page.object_list = [found[pk] for pk in page.object_list if pk in found]
+        return page
+
+    def context(self, page, facet_values):
+        return {
+            'products': page.object_list,
+            'page': page,
+            'search_query': self.search_query,
+            'facets': facet_values,
+        }
+
+
+def product_list_query(request):
+    selected = facets.selected_filters(request.GET)
+    products = facets.filter_products(Product.objects.select_related('category'), selected)
+
+    # Поиск товаров
+    search_query = request.GET.get('q', '')
+    sort = request.GET.get('sort')
+    if search_query and sort not in SORT_OPTIONS:
+        # Без явной сортировки показываем самые релевантные товары.
+        # Поиск и товары страницы читаются с одной базы: реплики отстают
+        # по-разному, и id с одной могут отсутствовать на другой
+        sort = None
+        products = products.using(products.db)
+    else:
+        if search_query:
+            products = get_search_backend().filter(products, search_query)
+        # Сортировка товаров
+        if sort not in SORT_OPTIONS:
+            sort = '-created_at'
+    return ProductListQuery(selected, products, search_query, sort, get_page_size(request))
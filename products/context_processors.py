@@ -1,8 +1,23 @@
-from .models import Order
+from django.utils.functional import SimpleLazyObject
+
+from . import navigation
+from .cart import get_cart
+from .orders import get_order_count
 
 def order_count(request):
+    """Число заказов пользователя из кэша; считается только если шаблон его выводит"""
     if request.user.is_authenticated:
+        user_id = request.user.pk
         return {
-            'order_count': Order.objects.filter(user=request.user).count()
+            'order_count': SimpleLazyObject(lambda: get_order_count(user_id))
         }
-    return {'order_count': 0}
\ No newline at end of file
+    return {'order_count': 0}
+
+def categories(request):
+    """Категории для навигации; читаются из кэша только если шаблон их использует"""
+    return {'categories': SimpleLazyObject(navigation.get_categories)}
+
+
+def cart(request):
+    """Корзина запроса; запросы к базе выполняются только при обращении"""
+    return {'cart_summary': get_cart(request)}
@@ -0,0 +1,70 @@
+"""
+Счётчики, общие для всех процессов.
+
+Кэш Django по умолчанию живёт внутри процесса, поэтому то, что должны
+видеть все воркеры и команды manage.py, хранится в таблице
+SharedCounter. Прибавление - один upsert, который складывает значения в
+самой базе и не теряет одновременных увеличений. Запись идёт в обход
+ORM и роутера баз: служебный счётчик не должен закреплять посетителя
+за основной базой.
+"""
+from django.db import connection
+
+from .models import SharedCounter
+
+
+def add(deltas):
+    """Прибавляет {имя: delta} одним запросом"""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    values = ', '.join(['(%s, %s)'] * len(deltas))
+    sql = f"""
+        INSERT INTO {SharedCounter._meta.db_table} (name, value)
+        VALUES {values}
+        ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [param for item in deltas.items() for param in item])
+
+
+def advance(name, floor=1):
+    """
+    Увеличивает счётчик на единицу, но не ниже floor (нет счётчика -
+    floor), и возвращает новое значение: выдаёт номера по порядку.
+    """
+    sql = f"""
+        INSERT INTO {SharedCounter._meta.db_table} (name, value) VALUES (%s, %s)
+        ON CONFLICT (name) DO UPDATE
+        SET value = CASE WHEN value + 1 > excluded.value THEN value + 1 ELSE excluded.value END
+        RETURNING value
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [name, floor])
+        return cursor.fetchone()[0]
+
+
+def raise_to(values):
+    """Поднимает счётчики {имя: значение} до значения, меньшие не уменьшаются"""
+    sql = f"""
+        INSERT INTO {SharedCounter._meta.db_table} (name, value)
+        VALUES {', '.join(['(%s, %s)'] * len(values))}
+        ON CONFLICT (name) DO UPDATE
+        SET value = CASE WHEN excluded.value > value THEN excluded.value ELSE value END
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [param for item in values.items() for param in item])
+
+
+def get_many(names):
+    """{имя: значение}; отсутствующие счётчики равны нулю"""
+    values = dict(SharedCounter.objects.filter(name__in=names).values_list('name', 'value'))
+    return {name: values.get(name, 0) for name in names}
+
+
+def reset(names):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {SharedCounter._meta.db_table} WHERE name IN ({', '.join(['%s'] * len(names))})",
+            list(names),
+        )
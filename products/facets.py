@@ -0,0 +1,261 @@
+"""
+Фасетные фильтры каталога.
+
+Число товаров для каждого значения фасета хранится в таблице FacetCount
+в разрезе доступности и поддерживается инкрементально сигналами
+(см. products/signals.py), поэтому страница каталога читает счётчики
+одним запросом без GROUP BY, а названия издателей берёт из кэша под
+версией, которую сбрасывают сигналы Manufacturer. Изменения в обход
+сигналов (QuerySet.update, загрузка фикстур) требуют
+``manage.py rebuild_facets``.
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Q
+
+from . import navigation
+from .caching import bump_version, get_version
+from .models import FacetCount, Manufacturer, Product
+
+VERSION_NAMESPACE = 'facets'
+
+CACHE_TIMEOUT = 60 * 60
+
+# Ценовые диапазоны: (ключ, нижняя граница, верхняя граница, подпись)
+PRICE_BUCKETS = [
+    ('0-500', Decimal('0'), Decimal('500'), 'до 500 руб.'),
+    ('500-1000', Decimal('500'), Decimal('1000'), '500 - 1000 руб.'),
+    ('1000-1500', Decimal('1000'), Decimal('1500'), '1000 - 1500 руб.'),
+    ('1500-2000', Decimal('1500'), Decimal('2000'), '1500 - 2000 руб.'),
+    ('2000+', Decimal('2000'), None, 'от 2000 руб.'),
+]
+
+PRICE_BUCKET_KEYS = [bucket[0] for bucket in PRICE_BUCKETS]
+
+AVAILABILITY_CHOICES = [
+    ('available', 'В наличии'),
+    ('unavailable', 'Нет в наличии'),
+    ('all', 'Все товары'),
+]
+
+
+def price_bucket(price):
+    """Ключ ценового диапазона для цены"""
+    for key, low, high, _label in PRICE_BUCKETS:
+        if price >= low and (high is None or price < high):
+            return key
+    return PRICE_BUCKETS[0][0]
+
+
+def facet_keys(category_id, manufacturer_id, country, price):
+    """Список пар (фасет, значение), к которым относится товар"""
+    return [
+        ('category', str(category_id)),
+        ('manufacturer', str(manufacturer_id)),
+        ('country', country),
+        ('price', price_bucket(Decimal(price))),
+    ]
+
+
+def stored_state(product_id):
+    """Фасеты товара в том виде, в каком он сейчас записан в базе"""
+    row = (
+        Product.objects.filter(pk=product_id)
+        .values('category_id', 'manufacturer_id', 'manufacturer__country', 'price', 'is_available')
+        .first()
+    )
+    if row is None:
+        return None
+    keys = facet_keys(row['category_id'], row['manufacturer_id'],
+                      row['manufacturer__country'], row['price'])
+    return keys, row['is_available']
+
+
+def instance_state(product):
+    keys = facet_keys(product.category_id, product.manufacturer_id,
+                      product.manufacturer.country, product.price)
+    return keys, product.is_available
+
+
+def adjust(keys, is_available, delta):
+    """Прибавляет delta к счётчикам перечисленных значений фасетов"""
+    if not keys or not delta:
+        return
+    # Один upsert на все значения: параллельные первые увеличения одного
+    # счётчика не сталкиваются на уникальном ключе
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(keys))
+    sql = f"""
+        INSERT INTO {FacetCount._meta.db_table} (facet, value, is_available, count)
+        VALUES {values}
+        ON CONFLICT (facet, value, is_available) DO UPDATE SET count = count + excluded.count
+    """
+    params = [param for facet, value in keys for param in (facet, value, is_available, delta)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def apply_change(before, after):
+    """Переносит товар из состояния before в after (любое может быть None)"""
+    if before == after:
+        return
+    if before is not None:
+        keys, is_available = before
+        if after is not None and after[1] == is_available:
+            # Доступность не менялась - трогаем только отличающиеся значения
+            adjust([key for key in keys if key not in after[0]], is_available, -1)
+            adjust([key for key in after[0] if key not in keys], is_available, 1)
+            return
+        adjust(keys, is_available, -1)
+    if after is not None:
+        adjust(*after, 1)
+
+
+def move_country(manufacturer_id, old_country, new_country):
+    """Переносит товары издателя при смене страны"""
+    rows = (
+        Product.objects.filter(manufacturer_id=manufacturer_id)
+        .values('is_available').annotate(total=Count('id'))
+    )
+    for row in rows:
+        adjust([('country', old_country)], row['is_available'], -row['total'])
+        adjust([('country', new_country)], row['is_available'], row['total'])
+
+
+def rebuild():
+    """Полностью пересчитывает таблицу счётчиков, возвращает число строк"""
+    counts = {}
+    groupings = [
+        ('category', 'category_id'),
+        ('manufacturer', 'manufacturer_id'),
+        ('country', 'manufacturer__country'),
+    ]
+    for facet, field in groupings:
+        rows = Product.objects.values(field, 'is_available').annotate(total=Count('id')).order_by()
+        for row in rows:
+            counts[(facet, str(row[field]), row['is_available'])] = row['total']
+    for key, low, high, _label in PRICE_BUCKETS:
+        condition = Q(price__gte=low) if high is None else Q(price__gte=low, price__lt=high)
+        rows = Product.objects.filter(condition).values('is_available').annotate(total=Count('id')).order_by()
+        for row in rows:
+            counts[('price', key, row['is_available'])] = row['total']
+
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create([
+            FacetCount(facet=facet, value=value, is_available=is_available, count=count)
+            for (facet, value, is_available), count in counts.items()
+        ])
+    return len(counts)
+
+
+def availability_filter(availability):
+    """Значения is_available для выбранного режима доступности"""
+    if availability == 'unavailable':
+        return [False]
+    if availability == 'all':
+        return [True, False]
+    return [True]
+
+
+def selected_filters(params):
+    """Выбранные значения фасетов из GET-параметров"""
+    availability = params.get('availability', 'available')
+    if availability not in dict(AVAILABILITY_CHOICES):
+        availability = 'available'
+    return {
+        'category': params.getlist('category'),
+        'manufacturer': params.getlist('manufacturer'),
+        'country': params.getlist('country'),
+        'price': [key for key in params.getlist('price') if key in PRICE_BUCKET_KEYS],
+        'availability': availability,
+    }
+
+
+def filter_products(queryset, selected):
+    """Применяет выбранные фасеты к queryset товаров"""
+    availability = availability_filter(selected['availability'])
+    if len(availability) == 1:
+        # Точное условие совпадает с частичными индексами каталога
+        queryset = queryset.filter(is_available=availability[0])
+    category_ids = [value for value in selected['category'] if value.isdigit()]
+    if category_ids:
+        queryset = queryset.filter(category_id__in=category_ids)
+    manufacturer_ids = [value for value in selected['manufacturer'] if value.isdigit()]
+    if manufacturer_ids:
+        queryset = queryset.filter(manufacturer_id__in=manufacturer_ids)
+    if selected['country']:
+        queryset = queryset.filter(manufacturer__country__in=selected['country'])
+    if selected['price']:
+        condition = Q()
+        for key, low, high, _label in PRICE_BUCKETS:
+            if key in selected['price']:
+                condition |= Q(price__gte=low) if high is None else Q(price__gte=low, price__lt=high)
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def get_manufacturer_names():
+    """{id: название} всех издателей из кэша"""
+    key = f'facets:manufacturers:{get_version(VERSION_NAMESPACE)}'
+    names = cache.get(key)
+    if names is None:
+        names = dict(Manufacturer.objects.values_list('id', 'name'))
+        cache.set(key, names, CACHE_TIMEOUT)
+    return names
+
+
+def invalidate():
+    bump_version(VERSION_NAMESPACE)
+
+
+def get_facets(selected):
+    """
+    Значения фасетов со счётчиками для боковой панели каталога.
+    Счётчики берутся из FacetCount одним запросом.
+    """
+    is_available = availability_filter(selected['availability'])
+    counts = {}
+    availability_counts = {True: 0, False: 0}
+    for facet, value, available, count in FacetCount.objects.filter(count__gt=0).values_list(
+            'facet', 'value', 'is_available', 'count'):
+        if facet == 'category':
+            availability_counts[available] += count
+        if available in is_available:
+            counts[(facet, value)] = counts.get((facet, value), 0) + count
+
+    def options(facet, values):
+        return [
+            {
+                'value': value,
+                'label': label,
+                'count': counts[(facet, value)],
+                'selected': value in selected[facet],
+            }
+            for value, label in values if counts.get((facet, value))
+        ]
+
+    categories = [(category['id'], category['name']) for category in navigation.get_categories()]
+    names = get_manufacturer_names()
+    manufacturers = sorted(
+        ((int(value), names[int(value)]) for facet, value in counts
+         if facet == 'manufacturer' and value.isdigit() and int(value) in names),
+        key=lambda item: item[1],
+    )
+    countries = sorted({value for facet, value in counts if facet == 'country'})
+    return {
+        'category': options('category', [(str(pk), name) for pk, name in categories]),
+        'manufacturer': options('manufacturer', [(str(pk), name) for pk, name in manufacturers]),
+        'country': options('country', [(country, country) for country in countries]),
+        'price': options('price', [(key, label) for key, _low, _high, label in PRICE_BUCKETS]),
+        'availability': [
+            {
+                'value': value,
+                'label': label,
+                'count': sum(availability_counts[flag] for flag in availability_filter(value)),
+                'selected': value == selected['availability'],
+            }
+            for value, label in AVAILABILITY_CHOICES
+        ],
+    }
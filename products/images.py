@@ -0,0 +1,163 @@
+"""
+Уменьшенные копии изображений товаров.
+
+Для каждого загруженного изображения строятся варианты фиксированной
+ширины (thumb/card/full) в JPEG и WebP без метаданных. Они лежат рядом
+в хранилище под ``derivatives/<имя оригинала>/`` вместе с manifest.json
+с размерами, по которому тег ``{% product_image %}`` собирает srcset.
+
+Генерация идёт в пуле процессов: сохранение товара в админке только
+ставит работу в пул после фиксации транзакции, а по готовности
+сбрасывается кэш карточек и страниц. Пока вариантов нет, шаблоны
+показывают оригинал. Существующие файлы обрабатывает
+``manage.py rebuild_thumbnails``.
+"""
+import json
+import logging
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Имя варианта: наибольшая ширина в пикселях. thumb - корзина (80px),
+# card - карточки каталога (до 250px), full - крупный показ; с запасом на 2x
+VARIANTS = {
+    'thumb': 160,
+    'card': 500,
+    'full': 1000,
+}
+
+FORMATS = {
+    'jpeg': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', {'quality': 80, 'method': 4}),
+}
+
+DERIVATIVES_DIR = 'derivatives'
+
+MANIFEST_CACHE_TIMEOUT = 60 * 60 * 24
+
+POOL_WORKERS = 2
+
+_pool = None
+
+
+def derivatives_dir(name):
+    return posixpath.join(DERIVATIVES_DIR, name)
+
+
+def derivative_name(name, variant, fmt):
+    return posixpath.join(derivatives_dir(name), f'{variant}.{FORMATS[fmt][0]}')
+
+
+def manifest_name(name):
+    return posixpath.join(derivatives_dir(name), 'manifest.json')
+
+
+def _save(storage, name, content):
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(content))
+
+
+def _encode(image, fmt):
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = BytesIO()
+    # exif и icc не передаются - метаданные в варианты не попадают
+    image.save(buffer, fmt.upper(), **FORMATS[fmt][1])
+    return buffer.getvalue()
+
+
+def generate(name, storage=None, force=False):
+    """
+    Строит варианты изображения name, возвращает манифест
+    {вариант: {'width', 'height', 'jpeg': байт, 'webp': байт}}.
+    Не обращается к базе, поэтому выполняется в пуле процессов.
+    """
+    storage = storage or default_storage
+    if not force and storage.exists(manifest_name(name)):
+        with storage.open(manifest_name(name)) as manifest:
+            return json.load(manifest)
+
+    with storage.open(name) as source:
+        original = Image.open(source)
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+        original.load()
+
+    manifest = {'source': storage.size(name)}
+    for variant, width in VARIANTS.items():
+        image = original.copy()
+        if image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        manifest[variant] = {'width': image.width, 'height': image.height}
+        for fmt in FORMATS:
+            content = _encode(image, fmt)
+            _save(storage, derivative_name(name, variant, fmt), content)
+            manifest[variant][fmt] = len(content)
+    _save(storage, manifest_name(name), json.dumps(manifest).encode())
+    return manifest
+
+
+def get_manifest(name):
+    """Манифест вариантов или None, если они ещё не построены"""
+    key = f'images:manifest:{name}'
+    manifest = cache.get(key)
+    if manifest is None:
+        try:
+            with default_storage.open(manifest_name(name)) as file:
+                manifest = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        cache.set(key, manifest, MANIFEST_CACHE_TIMEOUT)
+    return manifest
+
+
+def init_worker():
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, initializer=init_worker)
+    return _pool
+
+
+def _generated(future):
+    from django.db import connection
+
+    from . import page_cache
+    from .caching import bump_version
+
+    try:
+        future.result()
+    except Exception:
+        logger.exception('Не удалось построить варианты изображения')
+        return
+    # Колбэк выполняется в служебном потоке пула: соединение с базой,
+    # открытое для сброса версий, закрываем здесь же
+    try:
+        # Карточки и страницы, выведенные с оригиналом, пора перерисовать
+        bump_version('product_cards')
+        page_cache.invalidate()
+    finally:
+        connection.close()
+
+
+def schedule(name):
+    """Строит варианты в пуле процессов, не задерживая запрос"""
+    get_pool().submit(generate, name).add_done_callback(_generated)
@@ -0,0 +1,67 @@
+"""
+Складские остатки.
+
+Остаток списывается при оформлении заказа одним условным UPDATE на все
+позиции (``stock = stock - n WHERE stock >= n``) внутри транзакции
+заказа, поэтому два покупателя не могут купить последний экземпляр
+дважды. Товар, остаток которого дошёл до нуля, снимается с продажи тем
+же запросом. UPDATE обходит сигналы Product, поэтому счётчики фасетов
+переносятся здесь же, а кэши навигации, страниц и автодополнения
+сбрасываются после фиксации.
+"""
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+
+from . import facets, navigation, page_cache
+from .autocomplete import autocomplete
+from .models import Product
+
+
+class OutOfStock(Exception):
+    """Остатка не хватило: товар раскупили, пока оформлялся заказ"""
+
+
+def reserve(quantities):
+    """
+    Списывает остатки {product_id: количество} одним UPDATE. Возвращает id
+    товаров, остаток которых дошёл до нуля, или бросает OutOfStock.
+    """
+    if not quantities:
+        return []
+    amount = Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        output_field=PositiveIntegerField(),
+    )
+    updated = Product.objects.filter(pk__in=quantities, stock__gte=amount).update(
+        stock=F('stock') - amount,
+        # В SET справа старое значение stock: с продажи снимается только
+        # раскупленный товар, остальным флаг из админки не меняется
+        is_available=Case(When(stock=amount, then=Value(False)), default=F('is_available'),
+                          output_field=BooleanField()),
+        updated_at=timezone.now(),
+    )
+    if updated != len(quantities):
+        raise OutOfStock
+    # Перечитываются в той же транзакции после UPDATE: до нуля остаток
+    # мог дойти только этим списанием (количества в заказе положительны)
+    sold_out = list(Product.objects.filter(pk__in=quantities, stock=0).values_list('pk', flat=True))
+    if sold_out:
+        availability_changed(sold_out)
+    return sold_out
+
+
+def availability_changed(product_ids):
+    """Доступность товаров изменена в обход сигналов: переносит фасеты, сбрасывает кэши"""
+    products = list(Product.objects.filter(pk__in=product_ids).select_related('manufacturer'))
+    for product in products:
+        keys, is_available = facets.instance_state(product)
+        facets.apply_change((keys, not is_available), (keys, is_available))
+
+    def invalidate():
+        for product in products:
+            autocomplete.product_changed(product)
+        navigation.invalidate()
+        page_cache.invalidate()
+
+    transaction.on_commit(invalidate)
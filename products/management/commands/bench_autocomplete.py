@@ -0,0 +1,63 @@
+import random
+import statistics
+import time
+import sys
+
+from django.core.management.base import BaseCommand
+
+from products.autocomplete import DEFAULT_LIMIT, PrefixIndex
+
+WORDS = [
+    'песнь', 'сорокопута', 'безмолвное', 'чтение', 'первоклассный', 'адвокат',
+    'evil', 'prevails', 'том', 'магия', 'дракон', 'королевство', 'тень', 'звезда',
+    'город', 'ночь', 'море', 'война', 'мир', 'сердце', 'легенда', 'хроники',
+    'shadow', 'crown', 'empire', 'night', 'storm', 'whisper', 'garden', 'river',
+]
+
+
+class Command(BaseCommand):
+    help = "Замеряет память и задержку индекса автодополнения на синтетическом каталоге"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        count = options['products']
+        rows = [
+            (pk, ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).capitalize() + f' {pk}')
+            for pk in range(1, count + 1)
+        ]
+
+        started = time.perf_counter()
+        index = PrefixIndex()
+        index.load(rows)
+        build_seconds = time.perf_counter() - started
+        memory = (
+            sys.getsizeof(index.keys) + sum(sys.getsizeof(key) for key in index.keys)
+            + index.ids.itemsize * len(index.ids) + sys.getsizeof(index.names)
+            + sum(sys.getsizeof(name) for name in index.names.values())
+        )
+
+        prefixes = [rng.choice(WORDS)[:rng.randint(1, 5)] for _ in range(options['queries'])]
+        timings = []
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.search(prefix, DEFAULT_LIMIT)
+            timings.append((time.perf_counter() - started) * 1_000_000)
+        timings.sort()
+
+        started = time.perf_counter()
+        for pk in range(count + 1, count + 101):
+            index.add(pk, f'Новая книга {pk}')
+        add_us = (time.perf_counter() - started) * 1_000_000 / 100
+
+        self.stdout.write(f"Товаров: {count}, ключей: {len(index.keys)}")
+        self.stdout.write(f"Построение: {build_seconds:.2f} с, память индекса: {memory / 2**20:.1f} МиБ")
+        self.stdout.write(
+            f"Поиск (мкс): p50={statistics.median(timings):.1f} "
+            f"p99={timings[int(len(timings) * 0.99) - 1]:.1f} max={timings[-1]:.1f}"
+        )
+        self.stdout.write(f"Инкрементальное добавление: {add_us:.0f} мкс на товар")
@@ -0,0 +1,88 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+
+from products.cart import add_item, remove_item, set_item_quantity
+from products.models import Cart, CartItem, Category, Manufacturer, Product
+
+
+class Rollback(Exception):
+    pass
+
+
+def legacy_add(user, product_id):
+    """Прежний вариант: чтение, изменение и запись количества в Python"""
+    product = Product.objects.get(id=product_id, is_available=True)
+    cart, _created = Cart.objects.get_or_create(user=user)
+    item, created = CartItem.objects.get_or_create(cart=cart, product=product, defaults={'quantity': 1})
+    if not created:
+        item.quantity += 1
+        item.save()
+    return product.name, cart.items.aggregate(total=Sum('quantity'))['total']
+
+
+def statements(queries):
+    # Точки сохранения появляются только из-за внешней транзакции замера
+    return [q for q in queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+
+
+class Command(BaseCommand):
+    help = "Замеряет число запросов и задержку операций с корзиной"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=500)
+
+    def measure(self, label, func, repeat):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        queries = len(statements(context.captured_queries))
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f"{label:<28} запросов: {queries}  "
+            f"p50={statistics.median(timings):.3f} мс  p99={timings[int(len(timings) * 0.99) - 1]:.3f} мс"
+        )
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        try:
+            with transaction.atomic():
+                category = Category.objects.create(name='Benchmark category')
+                manufacturer = Manufacturer.objects.create(name='Benchmark manufacturer', country='RU')
+                product = Product.objects.create(
+                    name='Benchmark product', price=Decimal('100'),
+                    category=category, manufacturer=manufacturer,
+                )
+                user = User.objects.create_user('bench-cart-user')
+                legacy_user = User.objects.create_user('bench-cart-legacy-user')
+                add_item(user, product.pk)
+                legacy_add(legacy_user, product.pk)
+
+                self.measure('add_to_cart (прежний)', lambda: legacy_add(legacy_user, product.pk), repeat)
+                self.measure('add_to_cart (upsert)', lambda: add_item(user, product.pk), repeat)
+                item_id = CartItem.objects.get(cart__user=user).pk
+                self.measure('update_cart_item', lambda: set_item_quantity(user, item_id, 3), repeat)
+
+                cart = Cart.objects.get(user=user)
+                products = Product.objects.bulk_create(
+                    Product(name=f'Benchmark product {index}', price=Decimal('100'),
+                            category=category, manufacturer=manufacturer)
+                    for index in range(repeat + 1)
+                )
+                items = iter(CartItem.objects.bulk_create(
+                    CartItem(cart=cart, product=product) for product in products
+                ))
+                self.measure('remove_from_cart', lambda: remove_item(user, next(items).pk), repeat)
+                raise Rollback
+        except Rollback:
+            pass
@@ -0,0 +1,80 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from products.models import Cart, CartItem, Category, Manufacturer, Order, OrderItem, Product
+from products.orders import place_order
+
+
+class Rollback(Exception):
+    pass
+
+
+def legacy_checkout(user):
+    """Прежний вариант: заказ и позиции по одной вне транзакции"""
+    items = list(CartItem.objects.filter(cart__user=user).select_related('product'))
+    order = Order.objects.create(
+        user=user, total_price=sum(item.product.price * item.quantity for item in items),
+    )
+    for item in items:
+        OrderItem.objects.create(order=order, product=item.product, quantity=item.quantity, price=item.product.price)
+    CartItem.objects.filter(cart__user=user).delete()
+    return order
+
+
+def statements(queries):
+    # Точки сохранения появляются только из-за внешней транзакции замера
+    return [q for q in queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+
+
+class Command(BaseCommand):
+    help = "Замеряет время оформления заказа в зависимости от размера корзины"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50, 200])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['sizes'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, sizes, repeat):
+        category = Category.objects.create(name='Benchmark category')
+        manufacturer = Manufacturer.objects.create(name='Benchmark manufacturer', country='RU')
+        products = Product.objects.bulk_create(
+            Product(name=f'Benchmark product {index}', price=Decimal('100'),
+                    category=category, manufacturer=manufacturer)
+            for index in range(max(sizes))
+        )
+        user = User.objects.create_user('bench-checkout-user')
+        cart = Cart.objects.create(user=user)
+
+        def fill(size):
+            CartItem.objects.bulk_create(
+                CartItem(cart=cart, product=product, quantity=2) for product in products[:size]
+            )
+
+        self.stdout.write(f"{'позиций':>8} {'прежний, мс':>12} {'запросов':>9} {'bulk, мс':>10} {'запросов':>9}")
+        for size in sizes:
+            row = [f"{size:>8}"]
+            for func in (legacy_checkout, place_order):
+                timings = []
+                queries = 0
+                for _ in range(repeat):
+                    fill(size)
+                    with CaptureQueriesContext(connection) as context:
+                        started = time.perf_counter()
+                        func(user)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    queries = len(statements(context.captured_queries))
+                row.append(f"{statistics.median(timings):>12.2f} {queries:>9}")
+            self.stdout.write(' '.join(row))
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+HOST = next((host for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost').lstrip('.')
+
+
+def request_targets(options):
+    """Пути и строки запроса для нагрузки; nocache делает каждый запрос промахом кэша страниц"""
+    from products.models import Category
+
+    category = Category.objects.order_by('id').values_list('id', flat=True).first()
+    paths = ['/', '/products/', '/products/?sort=price']
+    if category is not None:
+        paths.append(f'/category/{category}/')
+    targets = []
+    for index in range(options['requests']):
+        path, _sep, query = paths[index % len(paths)].partition('?')
+        if options['bypass_cache']:
+            query = '&'.join(filter(None, [query, f'nocache={index}']))
+        targets.append((path, query))
+    return targets
+
+
+def summary(timings, elapsed, errors):
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'rps': len(timings) / elapsed,
+        'p50': statistics.median(timings),
+        'p99': timings[int(len(timings) * 0.99) - 1],
+    }
+
+
+def run_wsgi(targets, concurrency):
+    from django.core.handlers.wsgi import WSGIHandler
+
+    handler = WSGIHandler()
+
+    def call(target):
+        path, query = target
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'HTTP_HOST': HOST, 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status = []
+        started = time.perf_counter()
+        body = b''.join(handler(environ, lambda code, headers, exc_info=None: status.append(code)))
+        return (time.perf_counter() - started) * 1000, status[0].startswith('200') and bool(body)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(call, targets))
+    return summary([ms for ms, _ok in results], time.perf_counter() - started,
+                   sum(not ok for _ms, ok in results))
+
+
+def run_asgi(targets, concurrency):
+    from django.core.handlers.asgi import ASGIHandler
+
+    handler = ASGIHandler()
+
+    async def call(target, semaphore):
+        path, query = target
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': [(b'host', HOST.encode())], 'server': (HOST, 80),
+            'client': ('127.0.0.1', 50000),
+        }
+        messages = []
+        body_sent = False
+        finished = asyncio.Event()
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Django ждёт отключения клиента, пока отдаёт ответ
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                finished.set()
+
+        async with semaphore:
+            started = time.perf_counter()
+            await handler(scope, receive, send)
+            elapsed = (time.perf_counter() - started) * 1000
+        ok = messages[0].get('status') == 200 and any(m.get('body') for m in messages[1:])
+        return elapsed, ok
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(call(target, semaphore) for target in targets))
+        return summary([ms for ms, _ok in results], time.perf_counter() - started,
+                       sum(not ok for _ms, ok in results))
+
+    return asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный замер страниц каталога под WSGI (синхронные представления, пул потоков) "
+        "и под ASGI (асинхронные представления) внутри процесса, без сетевого сервера"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['both', 'wsgi', 'asgi'], default='both')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--bypass-cache', action='store_true',
+                            help="Уникальный параметр в каждом запросе, чтобы мерить рендеринг, а не кэш страниц")
+        parser.add_argument('--json', action='store_true', help="Вывести результат одного режима в JSON")
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'both':
+            self.compare(options)
+            return
+        if (options['mode'] == 'asgi') != settings.ASYNC_VIEWS:
+            raise CommandError("Режим должен совпадать с MYSHOP_ASYNC_VIEWS (запускайте через --mode both)")
+        targets = request_targets(options)
+        run = run_asgi if options['mode'] == 'asgi' else run_wsgi
+        # Прогрев: индекс автодополнения, кэш навигации, шаблоны
+        run(targets[:options['concurrency']], options['concurrency'])
+        result = run(targets, options['concurrency'])
+        if options['json']:
+            self.stdout.write(json.dumps(result))
+        else:
+            self.report(options['mode'], result)
+
+    def compare(self, options):
+        for mode in ('wsgi', 'asgi'):
+            env = dict(os.environ, MYSHOP_ASYNC_VIEWS='1' if mode == 'asgi' else '0')
+            command = [
+                sys.executable, sys.argv[0], 'bench_server', '--mode', mode, '--json',
+                '--requests', str(options['requests']), '--concurrency', str(options['concurrency']),
+            ]
+            if options['bypass_cache']:
+                command.append('--bypass-cache')
+            if options.get('settings'):
+                command.append(f"--settings={options['settings']}")
+            output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+            self.report(mode, json.loads(output.strip().splitlines()[-1]))
+
+    def report(self, mode, result):
+        self.stdout.write(
+            f"{mode.upper():<5} запросов: {result['requests']}  ошибок: {result['errors']}  "
+            f"{result['rps']:.0f} запр/с  p50={result['p50']:.1f} мс  p99={result['p99']:.1f} мс"
+        )
@@ -0,0 +1,229 @@
+import random
+import statistics
+import sys
+import threading
+import time
+from decimal import Decimal
+from io import BytesIO
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from products.models import Category, Manufacturer, Order, Product, Task
+from products.tasks import send_order_confirmation
+
+PREFIX = 'bench-sqlite'
+
+HOST = next((host for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost').lstrip('.')
+
+# Настройки Django по умолчанию: журнал отката, BEGIN DEFERRED, соединение на запрос
+DEFAULT_PROFILE = {
+    'PRAGMAS': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+    'OPTIONS': {},
+    'CONN_MAX_AGE': 0,
+}
+
+
+def tuned_profile(settings_dict):
+    from products.sqlite import get_pragmas
+
+    return {
+        'PRAGMAS': get_pragmas(settings_dict),
+        'OPTIONS': settings_dict.get('OPTIONS', {}),
+        'CONN_MAX_AGE': settings_dict.get('CONN_MAX_AGE', 0),
+    }
+
+
+class LockCounter:
+    """execute_wrapper: считает ошибки блокировки, в том числе перехваченные представлениями"""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as error:
+            if 'locked' in str(error) or 'busy' in str(error):
+                with self.lock:
+                    self.count += 1
+            raise
+
+
+class Command(BaseCommand):
+    help = (
+        "Смешанная нагрузка на SQLite через WSGI-обработчик: просмотр каталога, добавление "
+        "в корзину и оформление заказа. Сравнивает настройки Django по умолчанию с настройками проекта"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=16, help="Одновременных покупателей (потоков)")
+        parser.add_argument('--iterations', type=int, default=40, help="Итераций на покупателя")
+        parser.add_argument('--checkout-every', type=int, default=5, help="Оформлять заказ каждые N итераций")
+        parser.add_argument('--profile', nargs='+', choices=['default', 'tuned'], default=['default', 'tuned'])
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Замер рассчитан на SQLite")
+        settings_dict = connection.settings_dict
+        original = {key: settings_dict.get(key) for key in DEFAULT_PROFILE}
+        profiles = {'default': DEFAULT_PROFILE, 'tuned': tuned_profile(settings_dict)}
+
+        self.stdout.write(
+            f"{'профиль':>8} {'запросов':>9} {'запр/с':>8} {'заказов':>8} {'блокировок':>11} "
+            f"{'ошибок':>7} {'p50, мс':>8} {'p99, мс':>8}"
+        )
+        try:
+            for name in options['profile']:
+                connections.close_all()
+                settings_dict.update(profiles[name])
+                result = self.run(options)
+                self.stdout.write(
+                    f"{name:>8} {result['requests']:>9} {result['rps']:>8.0f} {result['orders']:>8} "
+                    f"{result['lock_errors']:>11} {result['errors']:>7} {result['p50']:>8.1f} {result['p99']:>8.1f}"
+                )
+        finally:
+            connections.close_all()
+            for key, value in original.items():
+                if value is None:
+                    settings_dict.pop(key, None)
+                else:
+                    settings_dict[key] = value
+
+    def setup_data(self, options):
+        category = Category.objects.create(name=f'{PREFIX} category')
+        manufacturer = Manufacturer.objects.create(name=f'{PREFIX} manufacturer', country='RU')
+        products = Product.objects.bulk_create(
+            Product(name=f'{PREFIX} product {index}', price=Decimal('100'),
+                    category=category, manufacturer=manufacturer)
+            for index in range(50)
+        )
+        users = User.objects.bulk_create(
+            User(username=f'{PREFIX}-{index}', password='!') for index in range(options['users'])
+        )
+        sessions = []
+        for user in users:
+            session = SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.create()
+            sessions.append(session.session_key)
+        return category, manufacturer, [product.pk for product in products], users, sessions
+
+    def cleanup(self, category, manufacturer, users, sessions):
+        order_ids = list(Order.objects.filter(user__in=users).values_list('id', flat=True))
+        Task.objects.filter(name=send_order_confirmation.task_name, payload__order_id__in=order_ids).delete()
+        Session.objects.filter(session_key__in=sessions).delete()
+        User.objects.filter(pk__in=[user.pk for user in users]).delete()
+        category.delete()
+        manufacturer.delete()
+
+    def run(self, options):
+        category, manufacturer, product_ids, users, sessions = self.setup_data(options)
+        connection.close()
+
+        handler = WSGIHandler()
+        counter = LockCounter()
+        browse_paths = [
+            (reverse('product_list'), {'sort': 'price'}),
+            (reverse('product_list'), {}),
+            (reverse('category_products', args=[category.pk]), {}),
+        ]
+        checkout_body = urlencode({
+            'first_name': 'Bench', 'last_name': 'User', 'email': 'bench@example.com',
+            'phone': '+70000000000', 'city': 'Москва', 'address': 'ул. Тестовая, 1',
+            'postal_code': '101000', 'payment_method': 'card',
+        })
+        timings = []
+        results = {'requests': 0, 'orders': 0, 'errors': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(options['users'])
+
+        def call(session_key, csrf, method, path, query=None, body='', headers=None):
+            environ = {
+                'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': urlencode(query or {}),
+                'SCRIPT_NAME': '', 'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'HTTP_HOST': HOST,
+                'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_COOKIE': f'sessionid={session_key}; csrftoken={csrf}',
+                'wsgi.input': BytesIO(body.encode()), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+                'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False, **(headers or {}),
+            }
+            if body:
+                environ['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+                environ['CONTENT_LENGTH'] = str(len(body.encode()))
+            status = []
+            started = time.perf_counter()
+            response = handler(environ, lambda code, response_headers, exc_info=None: status.append(code))
+            try:
+                b''.join(response)
+            finally:
+                # request_finished: закрытие или возврат соединения по CONN_MAX_AGE
+                response.close()
+            elapsed = (time.perf_counter() - started) * 1000
+            return int(status[0].split()[0]), elapsed
+
+        def worker(session_key, seed):
+            generator = random.Random(seed)
+            csrf = get_random_string(32)
+            local_timings = []
+            local = {'requests': 0, 'orders': 0, 'errors': 0}
+            connection.execute_wrappers.append(counter)
+            try:
+                barrier.wait()
+                for iteration in range(1, options['iterations'] + 1):
+                    path, query = generator.choice(browse_paths)
+                    calls = [
+                        ('GET', path, query, '', None),
+                        ('GET', reverse('add_to_cart', args=[generator.choice(product_ids)]), None, '',
+                         {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}),
+                    ]
+                    if iteration % options['checkout_every'] == 0:
+                        calls.append(('POST', reverse('checkout'), None,
+                                      f'{checkout_body}&csrfmiddlewaretoken={csrf}', None))
+                    for method, call_path, call_query, body, headers in calls:
+                        status, elapsed = call(session_key, csrf, method, call_path, call_query, body, headers)
+                        local_timings.append(elapsed)
+                        local['requests'] += 1
+                        if status >= 500:
+                            local['errors'] += 1
+                        elif method == 'POST' and status == 302:
+                            local['orders'] += 1
+            finally:
+                connection.execute_wrappers.remove(counter)
+                connection.close()
+                with lock:
+                    timings.extend(local_timings)
+                    for key, value in local.items():
+                        results[key] += value
+
+        threads = [
+            threading.Thread(target=worker, args=(session_key, index))
+            for index, session_key in enumerate(sessions)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.cleanup(category, manufacturer, users, sessions)
+        timings.sort()
+        return {
+            **results,
+            'lock_errors': counter.count,
+            'rps': results['requests'] / elapsed,
+            'p50': statistics.median(timings),
+            'p99': timings[int(len(timings) * 0.99) - 1],
+        }
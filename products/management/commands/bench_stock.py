@@ -0,0 +1,136 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+
+from products.models import Cart, CartItem, Category, Manufacturer, OrderItem, Product, Task
+from products.orders import CheckoutError, place_order
+from products.sqlite import get_pragmas
+from products.tasks import send_order_confirmation
+
+PREFIX = 'bench-stock'
+
+
+def set_journal_mode(mode):
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA journal_mode = {mode}')
+        return cursor.fetchone()[0]
+
+
+class Command(BaseCommand):
+    help = (
+        "Конкурентное оформление заказов на один товар: проверяет, что остаток "
+        "не уходит в минус, и замеряет пропускную способность (SQLite, режимы журнала)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=200, help="Сколько покупателей оформляют заказ")
+        parser.add_argument('--stock', type=int, default=50, help="Начальный остаток товара")
+        parser.add_argument('--quantity', type=int, default=1, help="Сколько штук в каждой корзине")
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--journal-mode', nargs='+', default=['delete', 'wal'], choices=['delete', 'wal'])
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            options['journal_mode'] = [None]
+        elif connection.settings_dict['NAME'] == ':memory:' or 'mode=memory' in str(connection.settings_dict['NAME']):
+            raise CommandError("Нужна файловая база: потоки работают через отдельные соединения")
+
+        original_mode = None
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                original_mode = cursor.fetchone()[0]
+
+        self.stdout.write(
+            f"{'журнал':>8} {'заказов':>8} {'отказов':>8} {'ошибок':>7} {'остаток':>8} "
+            f"{'продано':>8} {'попыток/с':>10} {'заказов/с':>10}"
+        )
+        settings_dict = connection.settings_dict
+        original_pragmas = settings_dict.get('PRAGMAS')
+        try:
+            for mode in options['journal_mode']:
+                if mode:
+                    # Новые соединения потоков применяют PRAGMA из настроек (products/sqlite.py)
+                    settings_dict['PRAGMAS'] = {**get_pragmas(settings_dict), 'journal_mode': mode}
+                    set_journal_mode(mode)
+                result = self.run(options)
+                self.stdout.write(
+                    f"{mode or connection.vendor:>8} {result['orders']:>8} {result['rejected']:>8} "
+                    f"{result['errors']:>7} {result['stock']:>8} {result['sold']:>8} "
+                    f"{result['attempts_rate']:>10.1f} {result['rate']:>10.1f}"
+                )
+                if result['sold'] > options['stock'] or result['sold'] + result['stock'] != options['stock']:
+                    raise CommandError(f"Перепродажа: продано {result['sold']} при остатке {options['stock']}")
+        finally:
+            if original_pragmas is None:
+                settings_dict.pop('PRAGMAS', None)
+            else:
+                settings_dict['PRAGMAS'] = original_pragmas
+            if original_mode:
+                set_journal_mode(original_mode)
+        self.stdout.write(self.style.SUCCESS("Перепродаж нет"))
+
+    def run(self, options):
+        category = Category.objects.create(name=f'{PREFIX} category')
+        manufacturer = Manufacturer.objects.create(name=f'{PREFIX} manufacturer', country='RU')
+        product = Product.objects.create(
+            name=f'{PREFIX} product', price=Decimal('100'), stock=options['stock'],
+            category=category, manufacturer=manufacturer,
+        )
+        users = User.objects.bulk_create(
+            User(username=f'{PREFIX}-{index}') for index in range(options['buyers'])
+        )
+        carts = Cart.objects.bulk_create(Cart(user=user) for user in users)
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=product, quantity=options['quantity']) for cart in carts
+        )
+        connection.close()
+
+        counts = {'orders': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(options['threads'])
+
+        def worker(batch):
+            try:
+                barrier.wait()
+                for user in batch:
+                    try:
+                        place_order(user)
+                        outcome = 'orders'
+                    except CheckoutError:
+                        outcome = 'rejected'
+                    except Exception:
+                        outcome = 'errors'
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(users[index::options['threads']],))
+            for index in range(options['threads'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        product.refresh_from_db()
+        items = OrderItem.objects.filter(product=product)
+        sold = items.aggregate(sold=Sum('quantity'))['sold'] or 0
+        order_ids = list(items.values_list('order_id', flat=True))
+        Task.objects.filter(name=send_order_confirmation.task_name, payload__order_id__in=order_ids).delete()
+        User.objects.filter(username__startswith=f'{PREFIX}-').delete()
+        category.delete()
+        manufacturer.delete()
+        return {
+            **counts, 'stock': product.stock, 'sold': sold,
+            'attempts_rate': sum(counts.values()) / elapsed, 'rate': counts['orders'] / elapsed,
+        }
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.query_plans import check_query_plans
+
+
+class Command(BaseCommand):
+    help = "Проверяет EXPLAIN QUERY PLAN запросов основных страниц на полное сканирование таблиц"
+
+    def handle(self, *args, **options):
+        problems = check_query_plans()
+        for page, table, sql in problems:
+            self.stderr.write(f"[{page}] {table}:\n    {sql}")
+        if problems:
+            raise CommandError(f"Найдено полных сканирований: {len(problems)}")
+        self.stdout.write(self.style.SUCCESS("Все запросы используют индексы"))
@@ -0,0 +1,109 @@
+import posixpath
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import Now
+
+from products import images, page_cache
+from products.caching import bump_version
+from products.models import OrderItem, Product, image_storage
+from products.storage import file_hash, hashed_name, is_hashed_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит изображения товаров в хранилище по хэшу содержимого: "
+        "копии схлопываются в один файл, ссылки в базе обновляются. Старые файлы "
+        "остаются, пока их удаление не запустят отдельно с --delete-old"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только показать, что будет сделано")
+        parser.add_argument(
+            '--delete-old', action='store_true',
+            help="Удалить старые файлы и их варианты, на которые больше нет ссылок. Запускать не раньше, "
+                 "чем истечёт кэш карточек (сутки): до этого страницы могут ссылаться на старые имена",
+        )
+
+    def referenced(self):
+        names = set(Product.objects.exclude(image='').exclude(image=None).values_list('image', flat=True))
+        names |= set(OrderItem.objects.exclude(product_image='').values_list('product_image', flat=True))
+        return names
+
+    def legacy(self, referenced):
+        """Старые файлы: всё, что лежит в каталоге загрузок не под хэшем, плюс ссылки из базы"""
+        upload_dir = Product._meta.get_field('image').upload_to.rstrip('/')
+        _dirs, files = image_storage.listdir(upload_dir)
+        legacy = {posixpath.join(upload_dir, name) for name in files}
+        return legacy | {name for name in referenced if not is_hashed_name(name)}
+
+    def handle(self, *args, **options):
+        if options['delete_old']:
+            self.delete_old(options['dry_run'])
+        else:
+            self.rename(options['dry_run'])
+
+    def rename(self, dry_run):
+        legacy = self.legacy(self.referenced())
+        renamed = {}
+        written = removed = 0
+        for name in sorted(legacy):
+            if not image_storage.exists(name):
+                self.stderr.write(f"{name}: файла нет, ссылка останется как есть")
+                continue
+            with image_storage.open(name) as source:
+                new_name = hashed_name(name, file_hash(File(source)))
+                if not image_storage.exists(new_name):
+                    written += image_storage.size(name)
+                    if not dry_run:
+                        image_storage.save(name, File(source, name))
+            removed += image_storage.size(name)
+            renamed[name] = new_name
+            self.stdout.write(f"{name} -> {new_name}")
+
+        unique = len(set(renamed.values()))
+        self.stdout.write(f"Файлов: {len(renamed)}, уникальных по содержимому: {unique}")
+        self.stdout.write(self.style.SUCCESS(f"Освободится после --delete-old: {(removed - written) / 1024:.0f} КБ"))
+        if dry_run or not renamed:
+            return
+
+        with transaction.atomic():
+            for old_name, new_name in renamed.items():
+                # updated_at входит в ключ кэша карточки: любой кэш перестанет
+                # отдавать карточку со старым именем
+                Product.objects.filter(image=old_name).update(image=new_name, updated_at=Now())
+                OrderItem.objects.filter(product_image=old_name).update(product_image=new_name)
+        for old_name, new_name in renamed.items():
+            if images.get_manifest(old_name) is not None:
+                images.generate(new_name)
+
+        # Ссылки обновлены через update() в обход сигналов
+        bump_version('product_cards')
+        page_cache.invalidate()
+        self.stdout.write(
+            "Старые файлы оставлены: закэшированные страницы ещё могут на них ссылаться. "
+            "Удалите их позже командой dedupe_media --delete-old"
+        )
+
+    def delete_old(self, dry_run):
+        referenced = self.referenced()
+        deleted = 0
+        for name in sorted(self.legacy(referenced) - referenced):
+            if not image_storage.exists(name):
+                continue
+            self.stdout.write(f"Удаляется {name}")
+            if not dry_run:
+                if image_storage.exists(images.derivatives_dir(name)):
+                    self._delete_tree(images.derivatives_dir(name))
+                image_storage.delete(name)
+            deleted += 1
+        self.stdout.write(self.style.SUCCESS(f"Удалено старых файлов: {deleted}"))
+
+    def _delete_tree(self, directory):
+        dirs, files = image_storage.listdir(directory)
+        for name in files:
+            image_storage.delete(posixpath.join(directory, name))
+        for name in dirs:
+            self._delete_tree(posixpath.join(directory, name))
+        image_storage.delete(directory)
@@ -0,0 +1,43 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products import exports
+from products.models import Order
+
+
+def _date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Неверная дата: {value} (ожидается ГГГГ-ММ-ДД)")
+
+
+class Command(BaseCommand):
+    help = "Потоковая выгрузка заказов с позициями в CSV или JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=exports.FORMATS, default='csv')
+        parser.add_argument('--from', dest='date_from', type=_date, help="Начальная дата (включительно)")
+        parser.add_argument('--to', dest='date_to', type=_date, help="Конечная дата (включительно)")
+        parser.add_argument(
+            '--status', action='append', default=[],
+            choices=[value for value, _ in Order.STATUS_CHOICES],
+            help="Статус заказа, можно указать несколько раз",
+        )
+        parser.add_argument('--output', '-o', help="Файл для выгрузки, по умолчанию stdout")
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        orders = exports.filter_orders(options['date_from'], options['date_to'], options['status'])
+        lines = exports.iter_export(orders, options['format'], options['chunk_size'])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+            self.stderr.write(self.style.SUCCESS(f"Выгрузка сохранена в {options['output']}"))
+        else:
+            # Строки уже заканчиваются переводом строки
+            for line in lines:
+                self.stdout.write(line, ending='')
+            self.stdout.flush()
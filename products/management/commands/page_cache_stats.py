@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from products import page_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Показывает попадания в кэш страниц каталога для анонимов по всем процессам "
+        "(каждый процесс сбрасывает счётчики в базу раз в STATS_FLUSH_INTERVAL секунд)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Обнулить счётчики после вывода")
+
+    def handle(self, *args, **options):
+        stats = page_cache.get_stats()
+        self.stdout.write(f"Попаданий в кэш:   {stats['hits']}")
+        self.stdout.write(f"Ответов 304:       {stats['not_modified']}")
+        self.stdout.write(f"Промахов:          {stats['misses']}")
+        self.stdout.write(f"Мимо кэша:         {stats['bypass']}")
+        self.stdout.write(self.style.SUCCESS(f"Доля попаданий:    {stats['hit_rate']:.1%}"))
+        if options['reset']:
+            page_cache.reset_stats()
+            self.stdout.write("Счётчики обнулены")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from products import facets
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики фасетов каталога"
+
+    def handle(self, *args, **options):
+        count = facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано значений фасетов: {count}"))
@@ -0,0 +1,50 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from products import images, page_cache
+from products.caching import bump_version
+from products.models import OrderItem, Product
+
+
+class Command(BaseCommand):
+    help = "Строит уменьшенные копии (JPEG и WebP) для всех изображений товаров"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Число процессов, по умолчанию по числу ядер")
+        parser.add_argument('--force', action='store_true', help="Перестроить и уже готовые варианты")
+
+    def handle(self, *args, **options):
+        names = set(Product.objects.exclude(image='').exclude(image=None).values_list('image', flat=True))
+        names |= set(OrderItem.objects.exclude(product_image='').values_list('product_image', flat=True))
+        names = sorted(names)
+        if not names:
+            self.stdout.write("Изображений нет")
+            return
+
+        variant_bytes = {fmt: 0 for fmt in images.FORMATS}
+        source_bytes = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=images.init_worker) as pool:
+            futures = {pool.submit(images.generate, name, force=options['force']): name for name in names}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    manifest = future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f"{name}: {error}")
+                    continue
+                source_bytes += manifest['source']
+                for fmt in images.FORMATS:
+                    variant_bytes[fmt] += manifest['card'][fmt]
+                self.stdout.write(f"{name}: готово")
+
+        # При общем кэше карточки и страницы перерисуются уже с вариантами
+        bump_version('product_cards')
+        page_cache.invalidate()
+        done = len(names) - failed
+        self.stdout.write(self.style.SUCCESS(f"Обработано изображений: {done}, с ошибкой: {failed}"))
+        if done:
+            self.stdout.write(f"Оригиналы: {source_bytes / 1024:.0f} КБ")
+            for fmt, size in variant_bytes.items():
+                self.stdout.write(f"Вариант card, {fmt}: {size / 1024:.0f} КБ")
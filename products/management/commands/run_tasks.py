@@ -0,0 +1,42 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from products import task_queue
+from products import tasks  # noqa: F401 - регистрирует задачи
+
+
+class Command(BaseCommand):
+    help = "Обработчик очереди фоновых задач (письма о заказах и т.п.)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="Размер пула потоков")
+        parser.add_argument('--batch', type=int, default=20, help="Сколько задач забирать за раз")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Пауза при пустой очереди, с")
+        parser.add_argument('--once', action='store_true', help="Выполнить готовые задачи и выйти")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            done, failed = task_queue.run_all(options['threads'], options['batch'])
+            self.stdout.write(self.style.SUCCESS(f"Выполнено: {done}, с ошибкой: {failed}"))
+            return
+
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self.stdout.write(f"Обработчик запущен, потоков: {options['threads']}")
+        with ThreadPoolExecutor(max_workers=options['threads'], thread_name_prefix='task') as executor:
+            while not stopping:
+                done, failed = task_queue.run_pending(executor, options['batch'])
+                if done or failed:
+                    self.stdout.write(f"Выполнено: {done}, с ошибкой: {failed}")
+                else:
+                    time.sleep(options['poll_interval'])
+        self.stdout.write("Обработчик остановлен")
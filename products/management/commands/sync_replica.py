@@ -0,0 +1,43 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Копирует основную базу SQLite в файлы реплик из DATABASE_REPLICAS (MYSHOP_REPLICA_DBS). "
+        "Заменяет потоковую репликацию при локальной проверке чтения с реплик"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Повторять каждые N секунд (имитация отставания реплики)")
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("Реплики не настроены: задайте MYSHOP_REPLICA_DBS")
+        primary = connections[DEFAULT_DB_ALIAS].settings_dict
+        aliases = [DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS]
+        if any(connections[alias].vendor != 'sqlite' for alias in aliases):
+            raise CommandError("Копирование файлом возможно только для SQLite")
+
+        while True:
+            for alias in settings.DATABASE_REPLICAS:
+                # Открытые соединения реплики увидят новую копию только после переподключения
+                connections[alias].close()
+                started = time.perf_counter()
+                source = sqlite3.connect(primary['NAME'])
+                target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                try:
+                    # backup API даёт согласованный снимок без остановки записи
+                    source.backup(target)
+                finally:
+                    target.close()
+                    source.close()
+                self.stdout.write(f"{alias}: {(time.perf_counter() - started) * 1000:.0f} мс")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,59 @@
+import posixpath
+import re
+import urllib.request
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+CSS_URL_RE = re.compile(r'url\(\s*["\']?([^"\')]+)["\']?\s*\)')
+
+# Карты исходников не скачиваются, а ManifestStaticFilesStorage требует их наличия
+SOURCE_MAP_RE = re.compile(rb'\n?/[*/]# sourceMappingURL=[^\n]*')
+
+
+def download(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.read()
+
+
+class Command(BaseCommand):
+    help = "Скачивает сторонние CSS/JS (Bootstrap, Font Awesome) в static/vendor/ вместо CDN"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Скачать заново уже имеющиеся файлы")
+
+    def handle(self, *args, **options):
+        root = Path(settings.STATICFILES_DIRS[0])
+        for name, url in settings.VENDOR_ASSETS.items():
+            files = [(name, url)]
+            while files:
+                name, url = files.pop()
+                target = root / name
+                if target.exists() and not options['force']:
+                    self.stdout.write(f"{name}: уже есть")
+                    continue
+                try:
+                    content = download(url)
+                except OSError as error:
+                    raise CommandError(f"Не удалось скачать {url}: {error}")
+                if name.endswith(('.css', '.js')):
+                    content = SOURCE_MAP_RE.sub(b'', content)
+                if name.endswith('.css'):
+                    files.extend(self.referenced_files(name, url, content))
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.write_bytes(content)
+                self.stdout.write(f"{name}: {len(content) / 1024:.0f} КБ")
+        self.stdout.write(self.style.SUCCESS("Готово. Закоммитьте static/vendor/ и запустите collectstatic"))
+
+    def referenced_files(self, name, url, content):
+        """Шрифты и картинки, на которые CSS ссылается относительными url()"""
+        found = {}
+        for reference in CSS_URL_RE.findall(content.decode('utf-8')):
+            if reference.startswith(('data:', 'http:', 'https:', '//', '#', '/')):
+                continue
+            path = urlsplit(reference).path
+            local = posixpath.normpath(posixpath.join(posixpath.dirname(name), path))
+            found[local] = urljoin(url, path)
+        return list(found.items())
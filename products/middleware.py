@@ -0,0 +1,186 @@
+import mimetypes
+import os
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from . import routers, staticfiles
+from .cart import COOKIE_MAX_AGE, COOKIE_NAME
+from .storage import IMMUTABLE_CACHE_CONTROL
+
+# Имя, которое дал ManifestStaticFilesStorage: css/site.0123456789ab.css
+HASHED_STATIC_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+
+STATIC_MAX_AGE = 60 * 60
+
+
+class CartCookieMiddleware:
+    """
+    Записывает изменённую cookie-корзину анонимного посетителя в ответ.
+    Работает и в синхронной, и в асинхронной цепочке без перехода в поток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        cart = getattr(request, '_cookie_cart', None)
+        if cart is not None and cart.modified:
+            if cart.quantities:
+                response.set_cookie(
+                    COOKIE_NAME, cart.dumps(), max_age=COOKIE_MAX_AGE,
+                    httponly=True, samesite='Lax',
+                )
+            else:
+                response.delete_cookie(COOKIE_NAME, samesite='Lax')
+        return response
+
+
+class StaticFilesMiddleware:
+    """
+    Отдаёт собранную статику из STATIC_ROOT без похода в представления.
+    Выбирает заранее сжатую копию (.br/.gz) по Accept-Encoding, файлам
+    с хэшем в имени ставит Cache-Control immutable на год, остальным -
+    короткий срок с проверкой по Last-Modified.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.prefix = settings.STATIC_URL if settings.STATIC_URL.startswith('/') else f'/{settings.STATIC_URL}'
+        self.root = str(settings.STATIC_ROOT) if settings.STATIC_ROOT else None
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.serve(request) or await self.get_response(request)
+
+    def serve(self, request):
+        if self.root is None or request.method not in ('GET', 'HEAD'):
+            return None
+        if not request.path_info.startswith(self.prefix):
+            return None
+        name = request.path_info[len(self.prefix):]
+        try:
+            path = safe_join(self.root, name)
+        except (SuspiciousFileOperation, ValueError):
+            return None
+        if not name or not os.path.isfile(path):
+            return None
+
+        stat = os.stat(path)
+        immutable = HASHED_STATIC_NAME_RE.search(name) is not None
+        if not immutable and not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+            return HttpResponseNotModified()
+
+        content_type, _encoding = mimetypes.guess_type(name)
+        accepted = {
+            token.split(';')[0].strip() for token in request.headers.get('Accept-Encoding', '').split(',')
+        }
+        encoding = None
+        for candidate, extension in staticfiles.ENCODINGS.items():
+            if candidate in accepted and os.path.isfile(path + extension):
+                encoding, path = candidate, path + extension
+                break
+
+        response = FileResponse(open(path, 'rb'), content_type=content_type or 'application/octet-stream')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Vary'] = 'Accept-Encoding'
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else f'public, max-age={STATIC_MAX_AGE}'
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Включает чтение каталога с реплик для представлений из REPLICA_VIEWS
+    и закрепляет посетителя за основной базой после его записи.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Django вызывает синхронный process_view из асинхронной цепочки через поток
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state, token = routers.start_request(self.is_pinned(request))
+        try:
+            return self.process_response(state, self.get_response(request))
+        finally:
+            routers.end_request(token)
+
+    async def __acall__(self, request):
+        state, token = routers.start_request(await self.ais_pinned(request))
+        try:
+            return self.process_response(state, await self.get_response(request))
+        finally:
+            routers.end_request(token)
+
+    def has_pin_cookie(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(routers.PIN_COOKIE_NAME, 0))
+        except ValueError:
+            pinned_until = 0
+        return pinned_until > time.time()
+
+    def is_pinned(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return False
+        return self.has_pin_cookie(request) or routers.catalog_recently_written()
+
+    async def ais_pinned(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return False
+        return self.has_pin_cookie(request) or await routers.acatalog_recently_written()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = routers.current_state()
+        if state is not None and request.resolver_match.url_name in settings.REPLICA_VIEWS:
+            state.use_replica = True
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        ReplicaRoutingMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+
+    def process_response(self, state, response):
+        if state.wrote and settings.DATABASE_REPLICAS:
+            pin_seconds = settings.REPLICA_PIN_SECONDS
+            response.set_cookie(
+                routers.PIN_COOKIE_NAME, str(time.time() + pin_seconds), max_age=pin_seconds,
+                httponly=True, samesite='Lax',
+            )
+        return response
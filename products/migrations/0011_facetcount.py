@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:31
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+PRICE_BUCKETS = [
+    ('0-500', Decimal('0'), Decimal('500')),
+    ('500-1000', Decimal('500'), Decimal('1000')),
+    ('1000-1500', Decimal('1000'), Decimal('1500')),
+    ('1500-2000', Decimal('1500'), Decimal('2000')),
+    ('2000+', Decimal('2000'), None),
+]
+
+
+def populate_facet_counts(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    FacetCount = apps.get_model('products', 'FacetCount')
+    counts = []
+    for facet, field in [('category', 'category_id'), ('manufacturer', 'manufacturer_id'),
+                         ('country', 'manufacturer__country')]:
+        for row in Product.objects.values(field, 'is_available').annotate(total=Count('id')).order_by():
+            counts.append(FacetCount(facet=facet, value=str(row[field]),
+                                     is_available=row['is_available'], count=row['total']))
+    for key, low, high in PRICE_BUCKETS:
+        products = Product.objects.filter(price__gte=low)
+        if high is not None:
+            products = products.filter(price__lt=high)
+        for row in products.values('is_available').annotate(total=Count('id')).order_by():
+            counts.append(FacetCount(facet='price', value=key,
+                                     is_available=row['is_available'], count=row['total']))
+    FacetCount.objects.bulk_create(counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=20, verbose_name='Фасет')),
+                ('value', models.CharField(max_length=100, verbose_name='Значение')),
+                ('is_available', models.BooleanField(verbose_name='Доступно для продажи')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество товаров')),
+            ],
+            options={
+                'verbose_name': 'Счётчик фасета',
+                'verbose_name_plural': 'Счётчики фасетов',
+                'unique_together': {('facet', 'value', 'is_available')},
+            },
+        ),
+        migrations.RunPython(populate_facet_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_snapshot(apps, schema_editor):
+    """Заполняет снимок товара у существующих позиций одним UPDATE"""
+    OrderItem = apps.get_model('products', 'OrderItem')
+    Product = apps.get_model('products', 'Product')
+
+    def product_field(name):
+        value = Product.objects.filter(pk=OuterRef('product_id')).values(name)[:1]
+        return Coalesce(Subquery(value), Value(''))
+
+    OrderItem.objects.filter(product__isnull=False).update(
+        product_name=product_field('name'),
+        manufacturer_name=product_field('manufacturer__name'),
+        product_image=product_field('image'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_catalog_and_order_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='manufacturer_name',
+            field=models.CharField(default='', max_length=100, verbose_name='Издатель'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_image',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Изображение'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(default='', max_length=200, verbose_name='Название товара'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='products.product'),
+        ),
+        migrations.RunPython(backfill_snapshot, migrations.RunPython.noop),
+    ]
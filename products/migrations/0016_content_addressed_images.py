@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:03
+
+import products.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_product_stock'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=products.storage.ContentAddressedStorage(), upload_to='products/', verbose_name='Изображение'),
+        ),
+    ]
@@ -1,6 +1,12 @@
 from django.db import models
+from django.core.files.storage import default_storage
 from django.contrib.auth.models import User
 from django.db.models import Sum
+from django.utils import timezone
+
+from .storage import ContentAddressedStorage
+
+image_storage = ContentAddressedStorage()
 
 class Category(models.Model):
     """Категории товаров"""
@@ -69,6 +75,7 @@ class Product(models.Model):
     )
     image = models.ImageField(
         upload_to="products/",
+        storage=image_storage,
         blank=True,
         null=True,
         verbose_name="Изображение"
@@ -85,14 +92,64 @@ class Product(models.Model):
         default=True,
         verbose_name="Доступно для продажи"
     )
+    # Пустое значение - остаток не учитывается, товар продаётся без ограничений
+    stock = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="Остаток на складе"
+    )
     class Meta:
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
         ordering =["-created_at"]
+        # Каталог показывает только доступные товары, поэтому индексы
+        # частичные и повторяют сортировки keyset-пагинации (поле, id)
+        indexes = [
+            models.Index(
+                fields=["-created_at", "-id"],
+                condition=models.Q(is_available=True),
+                name="product_available_new_idx",
+            ),
+            models.Index(
+                fields=["category", "-created_at", "-id"],
+                condition=models.Q(is_available=True),
+                name="product_category_new_idx",
+            ),
+            models.Index(
+                fields=["price", "id"],
+                condition=models.Q(is_available=True),
+                name="product_available_price_idx",
+            ),
+            models.Index(
+                fields=["name", "id"],
+                condition=models.Q(is_available=True),
+                name="product_available_name_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.price} руб."
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Остаток на момент чтения: по нему save() видит, что остаток изменился
+        instance._loaded_stock = instance.__dict__.get('stock')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Доступность меняется только вместе с остатком: закончился - снят
+        # с продажи, пополнили с нуля - снова в продаже. Флаг, снятый или
+        # выставленный вручную в админке, правка других полей не перетирает
+        loaded_stock = getattr(self, '_loaded_stock', None)
+        if self.stock is not None and self.stock != loaded_stock:
+            if self.stock == 0:
+                self.is_available = False
+            elif loaded_stock == 0:
+                self.is_available = True
+        super().save(*args, **kwargs)
+        self._loaded_stock = self.stock
+
 class Cart(models.Model):
     """Корзина пользователя"""
     user = models.OneToOneField(
@@ -119,17 +176,15 @@ class Cart(models.Model):
 
     def total_quantity(self):
         """Общее количество товаров в корзине"""
-        try:
-            return sum(item.quantity for item in self.items.all())
-        except:
-            return 0
+        return self.items.aggregate(total=Sum('quantity'))['total'] or 0
 
     def total_price(self):
         """Общая стоимость корзины"""
-        try:
-            return sum(item.product.price * item.quantity for item in self.items.all())
-        except:
-            return 0
+        total = self.items.aggregate(total=Sum(
+            models.F('quantity') * models.F('product__price'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ))['total']
+        return total or 0
         
 class CartItem(models.Model):
     """Элемент корзины"""
@@ -181,15 +236,87 @@ class Order(models.Model):
     phone_number = models.CharField(max_length=20, blank=True, null=True)
     email = models.EmailField(blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-id"], name="order_user_created_idx"),
+        ]
     
     def __str__(self):
         return f"Order {self.id} by {self.user}"
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Удаление товара из каталога не затрагивает историю заказов
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True)
     quantity = models.PositiveIntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Снимок товара на момент заказа: страницы заказов не обращаются к Product
+    product_name = models.CharField(max_length=200, default='', verbose_name="Название товара")
+    manufacturer_name = models.CharField(max_length=100, default='', verbose_name="Издатель")
+    product_image = models.CharField(max_length=100, blank=True, default='', verbose_name="Изображение")
+
+    @property
+    def image_url(self):
+        return default_storage.url(self.product_image) if self.product_image else ''
 
     def get_total(self):
         return self.price * self.quantity
+
+class FacetCount(models.Model):
+    """Предрассчитанное число товаров для значения фасета каталога"""
+    facet = models.CharField(max_length=20, verbose_name="Фасет")
+    value = models.CharField(max_length=100, verbose_name="Значение")
+    is_available = models.BooleanField(verbose_name="Доступно для продажи")
+    count = models.IntegerField(default=0, verbose_name="Количество товаров")
+
+    class Meta:
+        verbose_name = "Счётчик фасета"
+        verbose_name_plural = "Счётчики фасетов"
+        unique_together = ['facet', 'value', 'is_available']
+
+    def __str__(self):
+        return f"{self.facet}={self.value}: {self.count}"
+
+class Task(models.Model):
+    """Фоновая задача в очереди, которую выполняет ``manage.py run_tasks``"""
+    STATUS_CHOICES = (
+        ('pending', 'Ожидает'),
+        ('running', 'Выполняется'),
+        ('done', 'Выполнена'),
+        ('failed', 'Ошибка'),
+    )
+
+    name = models.CharField(max_length=100, verbose_name="Задача")
+    payload = models.JSONField(default=dict, verbose_name="Аргументы")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    max_attempts = models.PositiveIntegerField(default=5, verbose_name="Максимум попыток")
+    run_at = models.DateTimeField(default=timezone.now, verbose_name="Запустить не раньше")
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name="Взята в работу")
+    last_error = models.TextField(blank=True, default='', verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата завершения")
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        indexes = [
+            models.Index(fields=["status", "run_at"], name="task_status_run_at_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+
+class SharedCounter(models.Model):
+    """Счётчик, общий для всех процессов сервера (статистика кэша страниц и т. п.)"""
+    name = models.CharField(max_length=100, primary_key=True, verbose_name="Имя")
+    value = models.BigIntegerField(default=0, verbose_name="Значение")
+
+    class Meta:
+        verbose_name = "Общий счётчик"
+        verbose_name_plural = "Общие счётчики"
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
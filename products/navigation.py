@@ -0,0 +1,46 @@
+"""
+Данные навигации по каталогу.
+
+Список категорий с числом доступных товаров нужен почти каждой странице,
+а меняется редко, поэтому он хранится в кэше под версией, которую
+сигналы Category и Product увеличивают при любом изменении.
+"""
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from . import routers
+from .caching import bump_version, get_version
+
+VERSION_NAMESPACE = 'navigation'
+
+CACHE_TIMEOUT = 60 * 60
+
+
+def get_categories():
+    """Категории с числом доступных товаров: список словарей id/name/description/product_count"""
+    from .models import Category
+
+    key = f'navigation:categories:{get_version(VERSION_NAMESPACE)}'
+    categories = cache.get(key)
+    if categories is None:
+        categories = list(
+            Category.objects.annotate(
+                product_count=Count('products', filter=Q(products__is_available=True)),
+            ).order_by('name').values('id', 'name', 'description', 'product_count')
+        )
+        cache.set(key, categories, CACHE_TIMEOUT)
+    return categories
+
+
+def get_category(category_id):
+    """Категория из закэшированной навигации или None"""
+    for category in get_categories():
+        if category['id'] == category_id:
+            return category
+    return None
+
+
+def invalidate():
+    # Навигация заполнится заново: пока реплики догоняют, читаем с основной базы
+    routers.pin_catalog()
+    bump_version(VERSION_NAMESPACE)
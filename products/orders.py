@@ -0,0 +1,114 @@
+"""
+Оформление заказов и счётчик заказов пользователя.
+
+Заказ оформляется одной транзакцией: корзина блокируется на запись,
+цены перечитываются одним запросом, позиции заказа вставляются через
+bulk_create, остатки списываются одним условным UPDATE (см. inventory),
+а корзина очищается одним DELETE. Ошибка на любом шаге
+откатывает всё, и полузаписанных заказов не остаётся. Дальнейшая
+работа (письмо покупателю) ставится в очередь фоновых задач и
+выполняется после фиксации, не задерживая ответ.
+
+Число заказов показывается в шапке на каждой странице, поэтому оно
+хранится в кэше по пользователю: создание заказа увеличивает значение,
+любое другое изменение или удаление заказа сбрасывает его, и следующий
+запрос пересчитает COUNT(*) один раз.
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+ORDER_COUNT_KEY = 'order_count:%s'
+
+ORDER_COUNT_TIMEOUT = 60 * 60 * 24
+
+
+def get_order_count(user_id):
+    from .models import Order
+
+    key = ORDER_COUNT_KEY % user_id
+    count = cache.get(key)
+    if count is None:
+        count = Order.objects.filter(user_id=user_id).count()
+        cache.set(key, count, ORDER_COUNT_TIMEOUT)
+    return count
+
+
+def order_created(user_id):
+    try:
+        cache.incr(ORDER_COUNT_KEY % user_id)
+    except ValueError:
+        # Значения в кэше нет - посчитается при следующем обращении
+        pass
+
+
+def reset_order_count(user_id):
+    cache.delete(ORDER_COUNT_KEY % user_id)
+
+
+class CheckoutError(Exception):
+    """Заказ нельзя оформить: корзина пуста или товар недоступен"""
+
+
+def place_order(user, **fields):
+    """Создаёт заказ из корзины пользователя и очищает её, возвращает заказ"""
+    from .inventory import OutOfStock, reserve
+    from .models import Cart, CartItem, Order, OrderItem
+    from .tasks import send_order_confirmation
+
+    with transaction.atomic():
+        # Первая запись в транзакции берёт блокировку базы (в SQLite),
+        # select_for_update блокирует строки корзины на других СУБД
+        Cart.objects.filter(user=user).update(updated_at=timezone.now())
+        items = list(
+            CartItem.objects.filter(cart__user=user)
+            .select_for_update(of=('self',))
+            .values(
+                'product_id', 'quantity',
+                price=F('product__price'),
+                name=F('product__name'),
+                is_available=F('product__is_available'),
+                manufacturer_name=F('product__manufacturer__name'),
+                image=F('product__image'),
+                stock=F('product__stock'),
+            )
+        )
+        if not items:
+            raise CheckoutError('Ваша корзина пуста')
+        unavailable = [item['name'] for item in items if not item['is_available']]
+        if unavailable:
+            raise CheckoutError('Товары больше недоступны: ' + ', '.join(unavailable))
+        tracked = [item for item in items if item['stock'] is not None]
+        short = [f"{item['name']} (осталось {item['stock']})" for item in tracked if item['stock'] < item['quantity']]
+        if short:
+            raise CheckoutError('Недостаточно на складе: ' + ', '.join(short))
+
+        order = Order.objects.create(
+            user=user,
+            total_price=sum((item['price'] * item['quantity'] for item in items), Decimal('0')),
+            **fields,
+        )
+        # Снимок товара пишется той же вставкой, что и сами позиции
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=item['product_id'],
+                quantity=item['quantity'],
+                price=item['price'],
+                product_name=item['name'],
+                manufacturer_name=item['manufacturer_name'],
+                product_image=item['image'] or '',
+            )
+            for item in items
+        ])
+        try:
+            reserve({item['product_id']: item['quantity'] for item in tracked})
+        except OutOfStock:
+            raise CheckoutError('Товар закончился, пока оформлялся заказ. Обновите корзину')
+        CartItem.objects.filter(cart__user=user).delete()
+        # Письмо уходит из обработчика очереди уже после фиксации заказа
+        send_order_confirmation.enqueue(order_id=order.id)
+    return order
@@ -0,0 +1,241 @@
+"""
+Кэш страниц каталога для анонимных посетителей.
+
+Страница целиком хранится в кэше под ключом из пути и нормализованной
+строки запроса. Ключ включает версию каталога, которую сигналы Product,
+Category и Manufacturer увеличивают при любом изменении. Версия общая
+для всех процессов (products/caching.py) и служит временем изменения
+для Last-Modified, поэтому
+повторные визиты получают 304 по ETag/Last-Modified, а попадания в кэш
+не трогают ни ORM, ни шаблоны. Число попаданий и промахов копится в
+памяти процесса и раз в STATS_FLUSH_INTERVAL секунд прибавляется к
+общим счётчикам в базе (products/counters.py), откуда его читает
+команда ``manage.py page_cache_stats``.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from inspect import iscoroutinefunction
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from . import counters, routers
+from .caching import aget_version, bump_version, get_version
+from .cart import COOKIE_NAME as CART_COOKIE_NAME
+
+VERSION_NAMESPACE = 'catalog'
+
+PAGE_CACHE_TIMEOUT = 60 * 15
+
+STATS_KEYS = {
+    'hits': 'page_cache:hits',
+    'misses': 'page_cache:misses',
+    'not_modified': 'page_cache:not_modified',
+    'bypass': 'page_cache:bypass',
+}
+
+# Как часто процесс сбрасывает накопленные счётчики в базу, секунд
+STATS_FLUSH_INTERVAL = 2
+
+_pending = Counter()
+_pending_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+
+def invalidate():
+    """Каталог изменился: все закэшированные страницы устаревают"""
+    # Страницы заполнятся заново: пока реплики догоняют, читаем с основной базы
+    routers.pin_catalog()
+    bump_version(VERSION_NAMESPACE)
+
+
+def last_modified(version):
+    """Время изменения каталога: версия кэша страниц - время сброса в мс"""
+    return version / 1000
+
+
+def _count(name):
+    """Считает событие в памяти процесса; True, если пора сбросить счётчики в базу"""
+    with _pending_lock:
+        _pending[name] += 1
+        return time.monotonic() - _flushed_at >= STATS_FLUSH_INTERVAL
+
+
+def flush_stats():
+    """Прибавляет накопленные процессом счётчики к общим"""
+    global _pending, _flushed_at
+    with _pending_lock:
+        pending, _pending = _pending, Counter()
+        _flushed_at = time.monotonic()
+    counters.add({STATS_KEYS[name]: value for name, value in pending.items()})
+
+
+def _record(name):
+    if _count(name):
+        flush_stats()
+
+
+async def _arecord(name):
+    # В базу - только раз в STATS_FLUSH_INTERVAL, остальные вызовы без перехода в поток
+    if _count(name):
+        await sync_to_async(flush_stats)()
+
+
+def get_stats():
+    """Счётчики всех процессов (сброшенные в базу) плюс ещё не сброшенные этого"""
+    values = counters.get_many(list(STATS_KEYS.values()))
+    with _pending_lock:
+        pending = dict(_pending)
+    stats = {name: values[key] + pending.get(name, 0) for name, key in STATS_KEYS.items()}
+    served = stats['hits'] + stats['not_modified']
+    total = served + stats['misses']
+    stats['hit_rate'] = served / total if total else 0.0
+    return stats
+
+
+def reset_stats():
+    with _pending_lock:
+        _pending.clear()
+    counters.reset(list(STATS_KEYS.values()))
+
+
+def _cacheable_request(request):
+    """Проверки, которым не нужна сессия"""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    return 'messages' not in request.COOKIES and CART_COOKIE_NAME not in request.COOKIES
+
+
+def _may_be_logged_in(request):
+    return settings.SESSION_COOKIE_NAME in request.COOKIES
+
+
+def is_cacheable(request):
+    """Кэшируем только GET/HEAD анонимов без отложенных сообщений и без корзины"""
+    if not _cacheable_request(request):
+        return False
+    return not (_may_be_logged_in(request) and request.user.is_authenticated)
+
+
+def page_tag(request, version):
+    """Версия каталога и хэш пути с отсортированными непустыми параметрами"""
+    params = sorted(
+        (name, value)
+        for name, values in request.GET.lists()
+        for value in values if value
+    )
+    raw = f'{request.path}?{urlencode(params)}'
+    return f'{version}-{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def _not_modified(request, etag, modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return etag in tags or '*' in tags
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return if_modified_since is not None and int(modified) <= if_modified_since
+
+
+def _set_validators(response, etag, modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    response['Vary'] = 'Cookie'
+    return response
+
+
+def _validators(request, version):
+    """(ключ кэша, ETag, Last-Modified) страницы"""
+    tag = page_tag(request, version)
+    return f'page:{tag}', quote_etag(tag), last_modified(version)
+
+
+def _cached_response(request, cached, etag, modified):
+    """(ответ или None, событие для статистики) по содержимому кэша"""
+    if _not_modified(request, etag, modified):
+        return _set_validators(HttpResponseNotModified(), etag, modified), 'not_modified'
+    if cached is not None:
+        content, content_type = cached
+        return _set_validators(HttpResponse(content, content_type=content_type), etag, modified), 'hits'
+    return None, 'misses'
+
+
+def _lookup(request):
+    """(ответ из кэша или None, ключ, ETag, Last-Modified)"""
+    key, etag, modified = _validators(request, get_version(VERSION_NAMESPACE))
+    cached = None if _not_modified(request, etag, modified) else cache.get(key)
+    response, event = _cached_response(request, cached, etag, modified)
+    _record(event)
+    return response, key, etag, modified
+
+
+async def _alookup(request):
+    """Асинхронный вариант _lookup: кэш читается через aget без sync_to_async"""
+    key, etag, modified = _validators(request, await aget_version(VERSION_NAMESPACE))
+    cached = None if _not_modified(request, etag, modified) else await cache.aget(key)
+    response, event = _cached_response(request, cached, etag, modified)
+    await _arecord(event)
+    return response, key, etag, modified
+
+
+def _storable(response):
+    # Ответы с cookie (CSRF, сессия) относятся к конкретному посетителю
+    if response.status_code != 200 or response.cookies or response.streaming:
+        return False
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    return True
+
+
+def _store(response, key, etag, modified):
+    if _storable(response):
+        cache.set(key, (response.content, response['Content-Type']), PAGE_CACHE_TIMEOUT)
+        _set_validators(response, etag, modified)
+    return response
+
+
+async def _astore(response, key, etag, modified):
+    if _storable(response):
+        await cache.aset(key, (response.content, response['Content-Type']), PAGE_CACHE_TIMEOUT)
+        _set_validators(response, etag, modified)
+    return response
+
+
+def cache_anonymous_page(view):
+    """Декоратор представления: кэш страницы и условный GET для анонимов"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not _cacheable_request(request) or (
+                    _may_be_logged_in(request) and (await request.auser()).is_authenticated):
+                await _arecord('bypass')
+                return await view(request, *args, **kwargs)
+
+            cached, *validators = await _alookup(request)
+            if cached is not None:
+                return cached
+            response = await view(request, *args, **kwargs)
+            return await _astore(response, *validators)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable(request):
+            _record('bypass')
+            return view(request, *args, **kwargs)
+
+        cached, *validators = _lookup(request)
+        if cached is not None:
+            return cached
+        return _store(view(request, *args, **kwargs), *validators)
+
+    return wrapper
@@ -0,0 +1,187 @@
+"""
+Курсорная (keyset) пагинация.
+
+Вместо OFFSET и COUNT(*) страница выбирается условием по значению поля
+сортировки последней показанной строки с добором по id, поэтому время
+ответа не зависит от номера страницы и размера таблицы.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 96
+
+MAX_PK = 2 ** 63 - 1
+
+
+def get_page_size(request, default=DEFAULT_PAGE_SIZE):
+    """Размер страницы из параметра per_page, ограниченный MAX_PAGE_SIZE"""
+    try:
+        size = int(request.GET.get('per_page', default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def encode_cursor(values):
+    data = json.dumps(values, separators=(',', ':'), default=_json_default)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Разбирает курсор, при любой ошибке возвращает None"""
+    if not cursor:
+        return None
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Unsupported cursor value: {value!r}')
+
+
+class Page:
+    """Страница результатов с курсорами на соседние страницы"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Пагинация queryset по полю сортировки с добором по id.
+
+    ordering - имя поля, с минусом для убывания ('-created_at', 'price').
+    """
+
+    def __init__(self, queryset, ordering, per_page=DEFAULT_PAGE_SIZE):
+        self.queryset = queryset
+        self.descending = ordering.startswith('-')
+        self.field_name = ordering.lstrip('-')
+        self.field = queryset.model._meta.get_field(self.field_name)
+        self.per_page = per_page
+
+    def _order_by(self, reverse=False):
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        return [prefix + self.field_name, prefix + 'id']
+
+    def _seek(self, values, reverse=False):
+        """Условие 'строго после курсора' в направлении сортировки"""
+        if not values or len(values) != 2:
+            return None
+        try:
+            value = self.field.to_python(values[0])
+            pk = int(values[1])
+        except (ValidationError, TypeError, ValueError):
+            return None
+        # Подделанный курсор: NULL в сравнении или id вне диапазона первичного ключа
+        if value is None or not 0 < pk <= MAX_PK:
+            return None
+        lookup = 'lt' if self.descending != reverse else 'gt'
+        return (
+            Q(**{f'{self.field_name}__{lookup}': value})
+            | Q(**{self.field_name: value, f'id__{lookup}': pk})
+        )
+
+    def _cursor(self, obj):
+        return encode_cursor([getattr(obj, self.field_name), obj.pk])
+
+    def _prepare(self, after, before):
+        reverse = False
+        condition = self._seek(decode_cursor(after))
+        if condition is None:
+            condition = self._seek(decode_cursor(before), reverse=True)
+            reverse = condition is not None
+
+        queryset = self.queryset.order_by(*self._order_by(reverse))
+        if condition is not None:
+            queryset = queryset.filter(condition)
+        return queryset[:self.per_page + 1], condition is not None, reverse
+
+    def _page(self, rows, seeking, reverse):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            rows.reverse()
+            next_cursor = self._cursor(rows[-1]) if rows else None
+            previous_cursor = self._cursor(rows[0]) if rows and has_more else None
+        else:
+            next_cursor = self._cursor(rows[-1]) if rows and has_more else None
+            previous_cursor = self._cursor(rows[0]) if rows and seeking else None
+        return Page(rows, next_cursor, previous_cursor)
+
+    def page(self, after=None, before=None):
+        """Страница после курсора after или перед курсором before"""
+        queryset, seeking, reverse = self._prepare(after, before)
+        return self._page(list(queryset), seeking, reverse)
+
+    async def apage(self, after=None, before=None):
+        """Асинхронный вариант page()"""
+        queryset, seeking, reverse = self._prepare(after, before)
+        return self._page([row async for row in queryset], seeking, reverse)
+
+
+def paginate_sequence(items, per_page=DEFAULT_PAGE_SIZE, after=None, before=None):
+    """
+    Пагинация уже отсортированного списка (например, id по релевантности).
+    Курсор хранит позицию в списке.
+    """
+    start = 0
+    after_position = decode_cursor(after)
+    before_position = decode_cursor(before)
+    if after_position and isinstance(after_position[0], int):
+        start = max(after_position[0], 0)
+    elif before_position and isinstance(before_position[0], int):
+        start = max(before_position[0] - per_page, 0)
+    end = start + per_page
+    next_cursor = encode_cursor([end]) if end < len(items) else None
+    previous_cursor = encode_cursor([start]) if start > 0 else None
+    return Page(items[start:end], next_cursor, previous_cursor)
+
+
+def paginate(request, queryset, ordering, per_page=DEFAULT_PAGE_SIZE):
+    """Страница queryset по параметрам after/before/per_page запроса"""
+    paginator = KeysetPaginator(queryset, ordering, get_page_size(request, per_page))
+    return paginator.page(request.GET.get('after'), request.GET.get('before'))
+
+
+async def apaginate(request, queryset, ordering, per_page=DEFAULT_PAGE_SIZE):
+    """Асинхронный вариант paginate()"""
+    paginator = KeysetPaginator(queryset, ordering, get_page_size(request, per_page))
+    return await paginator.apage(request.GET.get('after'), request.GET.get('before'))
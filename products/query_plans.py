@@ -0,0 +1,152 @@
+"""
+Проверка планов запросов основных страниц.
+
+Страницы открываются тестовым клиентом, все выполненные SELECT
+прогоняются через EXPLAIN QUERY PLAN, и полное сканирование таблицы
+считается ошибкой. Используется тестами и командой
+``manage.py check_query_plans``.
+"""
+import re
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Cart, CartItem, Category, Manufacturer, Order, OrderItem, Product
+from .pagination import encode_cursor
+
+# Маленькие справочники, которые читаются целиком по смыслу запроса
+FULL_SCAN_ALLOWED = {
+    'products_category',
+    'products_manufacturer',
+    'products_facetcount',
+    # FTS5 сам выбирает совпадения по индексу и ранжирует их с LIMIT
+    'products_product_fts',
+}
+
+SCAN_RE = re.compile(r'^SCAN (?P<table>\w+)(?: AS \w+)?$')
+TABLE_RE = re.compile(r'^(?:SCAN|SEARCH) (?P<table>\w+)')
+
+
+class Rollback(Exception):
+    pass
+
+
+def full_scans(plan):
+    """
+    Таблицы, которые план читает полным сканированием. Сортировка во
+    временном B-дереве тоже считается сканированием: без подходящего
+    индекса LIMIT не спасает от чтения всех подходящих строк.
+    """
+    tables = []
+    for line in plan:
+        match = SCAN_RE.match(line.strip())
+        if match and match.group('table') not in FULL_SCAN_ALLOWED:
+            tables.append(match.group('table'))
+    if any(line.strip() == 'USE TEMP B-TREE FOR ORDER BY' for line in plan):
+        # Сортировку относим к ведущей таблице - первой в плане
+        for line in plan:
+            match = TABLE_RE.match(line.strip())
+            if match:
+                if match.group('table') not in FULL_SCAN_ALLOWED:
+                    tables.append(match.group('table') + ' (ORDER BY)')
+                break
+    return tables
+
+
+def create_fixture():
+    """Минимальный набор данных, чтобы каждая страница выполнила свои запросы"""
+    category = Category.objects.create(name='Query plan category')
+    manufacturer = Manufacturer.objects.create(name='Query plan manufacturer', country='RU')
+    product = Product.objects.create(
+        name='Query plan product', price=Decimal('100'),
+        category=category, manufacturer=manufacturer,
+    )
+    user = User.objects.create_user('query-plan-user', 'query-plan@example.com', 'query-plan-password')
+    cart = Cart.objects.create(user=user)
+    CartItem.objects.create(cart=cart, product=product, quantity=1)
+    order = Order.objects.create(user=user, total_price=Decimal('100'))
+    OrderItem.objects.create(
+        order=order, product=product, quantity=1, price=Decimal('100'),
+        product_name=product.name, manufacturer_name=manufacturer.name,
+    )
+    return {'category': category, 'product': product, 'user': user, 'order': order}
+
+
+def page_urls(fixture):
+    """Страницы для проверки: (название, url, нужен ли вход)"""
+    catalog = reverse('product_list')
+    product = fixture['product']
+    cursor = encode_cursor([product.created_at, product.pk])
+    return [
+        ('home', reverse('home'), False),
+        ('product_list', catalog, False),
+        ('product_list price', catalog + '?sort=price', False),
+        ('product_list -price', catalog + '?sort=-price', False),
+        ('product_list name', catalog + '?sort=name', False),
+        ('product_list search', catalog + '?q=query', False),
+        ('product_list next page', catalog + '?after=' + cursor, False),
+        ('product_list category', catalog + f'?category={fixture["category"].pk}', False),
+        ('category_products', reverse('category_products', args=[fixture['category'].pk]), False),
+        ('cart_view', reverse('cart_view'), True),
+        ('checkout', reverse('checkout'), True),
+        ('order_list', reverse('order_list'), True),
+        ('order_detail', reverse('order_detail', args=[fixture['order'].pk]), True),
+    ]
+
+
+def collect_problems(fixture):
+    """Список (страница, таблица, sql) для всех найденных полных сканирований"""
+    problems = []
+    # Вне тестового окружения testserver не входит в ALLOWED_HOSTS
+    host = next((host for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost').lstrip('.')
+    anonymous = Client(HTTP_HOST=host)
+    client = Client(HTTP_HOST=host)
+    client.force_login(fixture['user'])
+    for name, url, login_required in page_urls(fixture):
+        with CaptureQueriesContext(connection) as context:
+            response = (client if login_required else anonymous).get(url)
+        if response.status_code != 200:
+            problems.append((name, f'HTTP {response.status_code}', url))
+        problems.extend(_scan_queries(name, context.captured_queries))
+
+    # Проверка уникальности email при регистрации
+    from accounts.forms import CustomUserCreationForm
+
+    form = CustomUserCreationForm()
+    form.cleaned_data = {'email': 'someone@example.com'}
+    with CaptureQueriesContext(connection) as context:
+        form.clean_email()
+    problems.extend(_scan_queries('register clean_email', context.captured_queries))
+    return problems
+
+
+def _scan_queries(name, queries):
+    problems = []
+    with connection.cursor() as cursor:
+        for query in queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            # В captured_queries параметры уже подставлены в текст запроса
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql.replace('%', '%%'))
+            plan = [row[-1] for row in cursor.fetchall()]
+            for table in full_scans(plan):
+                problems.append((name, table, sql))
+    return problems
+
+
+def check_query_plans():
+    """Проверяет планы на тестовых данных и откатывает все изменения"""
+    problems = []
+    try:
+        with transaction.atomic():
+            problems = collect_problems(create_fixture())
+            raise Rollback
+    except Rollback:
+        pass
+    return problems
@@ -0,0 +1,147 @@
+"""
+Маршрутизация чтения каталога на реплики.
+
+Чтения Product, Category, Manufacturer и счётчиков фасетов из
+представлений каталога (REPLICA_VIEWS) уходят на одну из баз
+DATABASE_REPLICAS, всё остальное - запись, корзина, заказы, сессии - на
+основную базу. Решение принимается по состоянию текущего запроса,
+которое заводит ReplicaRoutingMiddleware; вне запросов (команды,
+фоновые задачи) реплики не используются.
+
+Чтобы покупатель видел собственные изменения, запрос, который что-то
+записал, дальше читает только с основной базы, а его cookie закрепляет
+посетителя за основной базой ещё на REPLICA_PIN_SECONDS - столько, на
+сколько реплика может отставать.
+
+Сброс кэшей каталога (page_cache.invalidate, navigation.invalidate) на
+то же время переводит на основную базу всех: иначе навигация, карточки
+и страницы заполнились бы заново устаревшими данными с реплики. Обычная запись в модели каталога,
+например списание остатка при заказе, кэши не сбрасывает и закрепляет
+только свой запрос. Срок закрепления хранится в общей таблице счётчиков
+(products/counters.py), чтобы его видели все процессы; процесс
+перечитывает его не чаще раза в CATALOG_PIN_CHECK_SECONDS.
+"""
+import random
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import counters
+
+PIN_COOKIE_NAME = 'primary_pin'
+
+# Счётчик с моментом (в мс), до которого каталог читается с основной базы
+CATALOG_PIN_COUNTER = 'replicas:catalog_pinned_until'
+
+CATALOG_PIN_CHECK_SECONDS = 1
+
+
+@dataclass
+class RoutingState:
+    use_replica: bool = False
+    pinned: bool = False
+    wrote: bool = False
+
+
+_state = ContextVar('replica_routing_state', default=None)
+
+# Срок закрепления каталога, прочитанный из общей таблицы, и время чтения
+_catalog_pin_lock = threading.Lock()
+_catalog_pinned_until = 0.0
+_catalog_pin_checked = None
+
+
+def start_request(pinned):
+    """Состояние маршрутизации для нового запроса, возвращает токен для end_request"""
+    state = RoutingState(pinned=pinned)
+    return state, _state.set(state)
+
+
+def current_state():
+    return _state.get()
+
+
+def end_request(token):
+    _state.reset(token)
+
+
+def mark_write():
+    """Отмечает запись в текущем запросе; нужна для SQL в обход ORM"""
+    state = _state.get()
+    if state is not None:
+        state.wrote = True
+
+
+def _remember_catalog_pin(pinned_until):
+    global _catalog_pinned_until, _catalog_pin_checked
+    with _catalog_pin_lock:
+        _catalog_pinned_until = pinned_until
+        _catalog_pin_checked = time.monotonic()
+
+
+def pin_catalog():
+    """Кэши каталога сброшены: все читают каталог с основной базы REPLICA_PIN_SECONDS"""
+    if not getattr(settings, 'DATABASE_REPLICAS', []):
+        return
+    pinned_until = time.time() + settings.REPLICA_PIN_SECONDS
+    counters.raise_to({CATALOG_PIN_COUNTER: int(pinned_until * 1000)})
+    _remember_catalog_pin(pinned_until)
+
+
+def _catalog_pin_is_stale():
+    return _catalog_pin_checked is None or time.monotonic() - _catalog_pin_checked >= CATALOG_PIN_CHECK_SECONDS
+
+
+def refresh_catalog_pin():
+    """Перечитывает срок закрепления, выставленный любым процессом"""
+    value = counters.get_many([CATALOG_PIN_COUNTER])[CATALOG_PIN_COUNTER]
+    _remember_catalog_pin(value / 1000)
+
+
+def catalog_recently_written():
+    if _catalog_pin_is_stale():
+        refresh_catalog_pin()
+    return _catalog_pinned_until > time.time()
+
+
+async def acatalog_recently_written():
+    """Асинхронный вариант catalog_recently_written: в поток только при перечитывании"""
+    if _catalog_pin_is_stale():
+        await sync_to_async(refresh_catalog_pin)()
+    return _catalog_pinned_until > time.time()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.pinned or state.wrote:
+            return None
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not replicas or model._meta.label not in settings.REPLICA_MODELS:
+            return None
+        # Внутри транзакции читаем то же, что пишем
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # Закрепляется только текущий запрос; всех закрепляет сброс кэшей каталога
+        mark_write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, 'DATABASE_REPLICAS', [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплики получают схему вместе с данными (manage.py sync_replica)
+        if db in getattr(settings, 'DATABASE_REPLICAS', []):
+            return False
+        return None
@@ -0,0 +1,199 @@
+"""
+Полнотекстовый поиск по каталогу.
+
+Индекс покрывает название, описание, категорию и издателя товара.
+На SQLite используется виртуальная таблица FTS5 с ранжированием bm25
+и префиксным поиском, на остальных СУБД - запасной вариант на icontains.
+Индекс обновляется инкрементально сигналами (см. products/signals.py),
+полная перестройка - командой ``manage.py rebuild_search_index``.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection, connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+FTS_TABLE = 'products_product_fts'
+
+# Вес колонок для bm25: совпадение в названии важнее, чем в описании
+FTS_WEIGHTS = (10.0, 1.0, 3.0, 5.0)
+
+# Сколько лучших совпадений отдаём при сортировке по релевантности;
+# фильтры каталога применяются до ограничения, в том же запросе
+SEARCH_RESULT_LIMIT = 1000
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Разбивает поисковую строку на слова"""
+    return TOKEN_RE.findall(query or '')
+
+
+class SearchBackend:
+    """Базовый класс поискового бэкенда"""
+
+    def filter(self, queryset, query):
+        """Ограничивает queryset товарами, подходящими под запрос"""
+        raise NotImplementedError
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT, queryset=None):
+        """
+        Список id товаров, отсортированный по релевантности. queryset
+        ограничивает выборку (фильтры каталога) до отсечения по limit.
+        """
+        raise NotImplementedError
+
+    def index_product(self, product):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+    def update_category(self, category):
+        pass
+
+    def update_manufacturer(self, manufacturer):
+        pass
+
+    def rebuild(self):
+        """Полная перестройка индекса, возвращает число товаров"""
+        return 0
+
+
+class SimpleSearchBackend(SearchBackend):
+    """Поиск без индекса через icontains - для СУБД без FTS5"""
+
+    def _condition(self, query):
+        condition = Q()
+        for token in tokenize(query):
+            condition &= (
+                Q(name__icontains=token)
+                | Q(description__icontains=token)
+                | Q(category__name__icontains=token)
+                | Q(manufacturer__name__icontains=token)
+            )
+        return condition
+
+    def filter(self, queryset, query):
+        if not tokenize(query):
+            return queryset.none()
+        return queryset.filter(self._condition(query))
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT, queryset=None):
+        from .models import Product
+
+        if not tokenize(query):
+            return []
+        products = (Product.objects.all() if queryset is None else queryset).filter(self._condition(query))
+        return list(products.order_by('name').values_list('id', flat=True)[:limit])
+
+
+class FTS5SearchBackend(SearchBackend):
+    """Поиск через виртуальную таблицу SQLite FTS5"""
+
+    def match_expression(self, query):
+        """
+        Строит выражение MATCH: каждое слово ищется по префиксу,
+        все слова должны встретиться (неявный AND).
+        """
+        tokens = tokenize(query)
+        return ' '.join('"%s"*' % token.replace('"', '') for token in tokens)
+
+    def filter(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [expression],
+        ))
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT, queryset=None):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        from .models import Product
+
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        condition, params = '', [expression]
+        # Та же база, что выбрал роутер для чтения каталога (реплика в представлениях)
+        alias = queryset.db if queryset is not None else router.db_for_read(Product)
+        if queryset is not None:
+            # Фильтры каталога - подзапрос в том же запросе, до LIMIT
+            subquery, subquery_params = (
+                queryset.order_by().values('id').query.get_compiler(using=alias).as_sql()
+            )
+            condition = f'AND rowid IN ({subquery}) '
+            params.extend(subquery_params)
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s {condition}'
+                f'ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s',
+                params + [limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index_product(self, product):
+        category = product.category.name if product.category_id else ''
+        manufacturer = product.manufacturer.name if product.manufacturer_id else ''
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description, category, manufacturer) '
+                f'VALUES (%s, %s, %s, %s, %s)',
+                [product.pk, product.name, product.description, category, manufacturer],
+            )
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+    def update_category(self, category):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {FTS_TABLE} SET category = %s WHERE rowid IN '
+                f'(SELECT id FROM products_product WHERE category_id = %s)',
+                [category.name, category.pk],
+            )
+
+    def update_manufacturer(self, manufacturer):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {FTS_TABLE} SET manufacturer = %s WHERE rowid IN '
+                f'(SELECT id FROM products_product WHERE manufacturer_id = %s)',
+                [manufacturer.name, manufacturer.pk],
+            )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description, category, manufacturer) '
+                f'SELECT p.id, p.name, p.description, c.name, m.name '
+                f'FROM products_product p '
+                f'JOIN products_category c ON c.id = p.category_id '
+                f'JOIN products_manufacturer m ON m.id = p.manufacturer_id'
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+            cursor.execute(f'SELECT count(*) FROM {FTS_TABLE}')
+            return cursor.fetchone()[0]
+
+
+_backend = None
+
+
+def get_search_backend():
+    """Возвращает поисковый бэкенд из настройки PRODUCT_SEARCH_BACKEND"""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == 'sqlite':
+            _backend = FTS5SearchBackend()
+        else:
+            _backend = SimpleSearchBackend()
+    return _backend
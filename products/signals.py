@@ -0,0 +1,188 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import facets, images, navigation, orders, page_cache, sqlite
+from .autocomplete import autocomplete
+from .caching import bump_version
+from .cart import merge_cookie_cart
+from .models import Category, Manufacturer, Order, Product
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    """Обновляет товар в поисковом индексе"""
+    if raw:
+        return
+    get_search_backend().index_product(instance)
+
+
+@receiver(post_save, sender=Product)
+def build_image_variants(sender, instance, raw=False, **kwargs):
+    """Новое изображение получает уменьшенные копии в фоне после коммита"""
+    if raw or not instance.image or images.get_manifest(instance.image.name) is not None:
+        return
+    name = instance.image.name
+    transaction.on_commit(lambda: images.schedule(name))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    """Удаляет товар из поискового индекса"""
+    get_search_backend().remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created=False, raw=False, **kwargs):
+    """Переименование категории меняет её название у всех товаров в индексе"""
+    if raw or created:
+        return
+    get_search_backend().update_category(instance)
+
+
+@receiver(post_save, sender=Manufacturer)
+def reindex_manufacturer(sender, instance, created=False, raw=False, **kwargs):
+    """Переименование издателя меняет его название у всех товаров в индексе"""
+    if raw or created:
+        return
+    get_search_backend().update_manufacturer(instance)
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_delete, sender=Product)
+def remember_product_facets(sender, instance, raw=False, **kwargs):
+    """Запоминает фасеты товара до изменения"""
+    if raw:
+        return
+    instance._facets_before = facets.stored_state(instance.pk) if instance.pk else None
+
+
+@receiver(post_save, sender=Product)
+def update_product_facets(sender, instance, raw=False, **kwargs):
+    """Переносит товар между счётчиками фасетов"""
+    if raw:
+        return
+    facets.apply_change(getattr(instance, '_facets_before', None), facets.instance_state(instance))
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_facets(sender, instance, **kwargs):
+    facets.apply_change(getattr(instance, '_facets_before', None), None)
+
+
+@receiver(pre_save, sender=Manufacturer)
+def remember_manufacturer_country(sender, instance, raw=False, **kwargs):
+    if raw or not instance.pk:
+        return
+    instance._country_before = (
+        Manufacturer.objects.filter(pk=instance.pk).values_list('country', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Manufacturer)
+def update_manufacturer_country(sender, instance, raw=False, **kwargs):
+    """Смена страны издателя переносит его товары в другой фасет страны"""
+    old_country = getattr(instance, '_country_before', None)
+    if raw or old_country is None or old_country == instance.country:
+        return
+    facets.move_country(instance.pk, old_country, instance.country)
+
+
+@receiver(post_save, sender=Manufacturer)
+@receiver(post_delete, sender=Manufacturer)
+def invalidate_manufacturer_names(sender, raw=False, **kwargs):
+    """Названия издателей в фасетах каталога"""
+    if raw:
+        return
+    facets.invalidate()
+
+
+@receiver(post_save, sender=Product)
+def update_product_autocomplete(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    autocomplete.product_changed(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_autocomplete(sender, instance, **kwargs):
+    autocomplete.product_removed(instance.pk)
+
+
+@receiver(post_save, sender=Manufacturer)
+def update_manufacturer_autocomplete(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    autocomplete.manufacturer_changed(instance)
+
+
+@receiver(post_delete, sender=Manufacturer)
+def remove_manufacturer_autocomplete(sender, instance, **kwargs):
+    autocomplete.manufacturer_removed(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_navigation(sender, raw=False, **kwargs):
+    """Названия категорий и число товаров в них меняются - сбрасываем навигацию"""
+    if raw:
+        return
+    navigation.invalidate()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Manufacturer)
+@receiver(post_delete, sender=Manufacturer)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_page_cache(sender, raw=False, **kwargs):
+    """Любое изменение каталога делает закэшированные страницы устаревшими"""
+    if raw:
+        return
+    page_cache.invalidate()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_product_cards(sender, raw=False, **kwargs):
+    """Название категории выводится в карточках товаров"""
+    if raw:
+        return
+    bump_version('product_cards')
+
+
+@receiver(post_save, sender=Order)
+def update_order_count(sender, instance, created=False, raw=False, **kwargs):
+    """Новый заказ увеличивает счётчик после коммита, изменение сбрасывает его"""
+    if raw:
+        return
+    user_id = instance.user_id
+    if created:
+        transaction.on_commit(lambda: orders.order_created(user_id))
+    else:
+        transaction.on_commit(lambda: orders.reset_order_count(user_id))
+
+
+@receiver(post_delete, sender=Order)
+def reset_order_count(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: orders.reset_order_count(user_id))
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """Переносит корзину, собранную до входа, в корзину пользователя"""
+    if request is not None:
+        merge_cookie_cart(request, user)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """PRAGMA для каждого нового соединения с SQLite"""
+    sqlite.configure(connection)
@@ -0,0 +1,46 @@
+"""
+Настройка соединений SQLite.
+
+Каждое новое соединение получает PRAGMA из SQLITE_PRAGMAS (или из ключа
+PRAGMAS в настройках конкретной базы): WAL, чтобы читатели не ждали
+писателя, synchronous=NORMAL, busy_timeout вместо мгновенного
+``database is locked``, mmap и увеличенный кэш страниц. Транзакции
+записи начинаются с BEGIN IMMEDIATE (OPTIONS.transaction_mode), поэтому
+блокировка берётся сразу и ожидание идёт через busy_timeout, а не
+обрывается ошибкой при повышении блокировки посреди транзакции.
+Соединения живут CONN_MAX_AGE секунд и проверяются перед запросом
+(CONN_HEALTH_CHECKS).
+"""
+import re
+
+from django.conf import settings
+
+PRAGMA_NAME_RE = re.compile(r'^[a-z_]+$')
+
+
+def get_pragmas(settings_dict):
+    return settings_dict.get('PRAGMAS', getattr(settings, 'SQLITE_PRAGMAS', {}))
+
+
+def configure(connection):
+    """Применяет PRAGMA к только что открытому соединению SQLite"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = get_pragmas(connection.settings_dict)
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            if not PRAGMA_NAME_RE.match(name):
+                raise ValueError(f'Недопустимое имя PRAGMA: {name}')
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def current_settings(connection):
+    """Фактические значения PRAGMA соединения (для отчётов и проверки)"""
+    values = {}
+    with connection.cursor() as cursor:
+        for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size'):
+            cursor.execute(f'PRAGMA {name}')
+            values[name] = cursor.fetchone()[0]
+    return values
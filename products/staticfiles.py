@@ -0,0 +1,95 @@
+"""
+Сборка статики: бандлы, хэши в именах и заранее сжатые копии.
+
+``collectstatic`` с хранилищем CompressedManifestStaticFilesStorage:
+
+1. склеивает бандлы из STATIC_BUNDLES (например, Bootstrap и стили
+   сайта в один CSS), чтобы страница грузила меньше файлов;
+2. даёт каждому файлу имя с хэшем содержимого (ManifestStaticFilesStorage),
+   поэтому его можно кэшировать навсегда;
+3. пишет рядом .gz и, если установлен пакет brotli, .br.
+
+StaticFilesMiddleware отдаёт эти файлы, выбирая сжатую копию по
+Accept-Encoding. Пока collectstatic не запускался (разработка, тесты),
+``{% static %}`` возвращает исходные имена без хэша.
+"""
+import gzip
+import logging
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.map', '.svg', '.json', '.txt', '.xml', '.html', '.ttf', '.eot', '.otf'}
+
+# Сжатая копия пишется, только если она заметно меньше оригинала
+MIN_COMPRESSION_RATIO = 0.95
+
+ENCODINGS = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+
+def compress(data):
+    """{расширение: сжатые байты} для всех доступных алгоритмов"""
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {
+        extension: content for extension, content in variants.items()
+        if len(content) < len(data) * MIN_COMPRESSION_RATIO
+    }
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def url(self, name, force=False):
+        # Манифеста ещё нет - отдаём файлы как есть, а не падаем на каждом {% static %}
+        if not self.hashed_files and not force:
+            return StaticFilesStorage.url(self, name)
+        return super().url(name, force)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            for name in self.build_bundles(paths):
+                paths[name] = (self, name)
+        yield from super().post_process(paths, dry_run, **options)
+        if not dry_run:
+            self.compress_files(list(paths) + list(self.hashed_files.values()))
+
+    def build_bundles(self, paths):
+        """Склеивает бандлы из уже собранных файлов, возвращает их имена"""
+        built = []
+        for name, members in getattr(settings, 'STATIC_BUNDLES', {}).items():
+            missing = [member for member in members if member not in paths]
+            if missing:
+                # Без vendor-файлов страницы подключают части бандла по отдельности
+                logger.warning('Бандл %s пропущен, нет файлов: %s', name, ', '.join(missing))
+                continue
+            parts = []
+            for member in members:
+                with self.open(member) as file:
+                    parts.append(file.read().rstrip() + b'\n')
+            if self.exists(name):
+                self.delete(name)
+            self._save(name, ContentFile(b''.join(parts)))
+            built.append(name)
+        return built
+
+    def compress_files(self, names):
+        for name in set(names):
+            if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS or not self.exists(name):
+                continue
+            with self.open(name) as file:
+                data = file.read()
+            for extension, content in compress(data).items():
+                with open(self.path(name + extension), 'wb') as file:
+                    file.write(content)
@@ -0,0 +1,78 @@
+"""
+Хранилище изображений товаров по хэшу содержимого.
+
+Файл сохраняется под именем ``<каталог>/<2 символа>/<sha256>.<расширение>``,
+поэтому одинаковые загрузки превращаются в один файл, а не в копии с
+суффиксами ``_XYuTYfg``. Содержимое файла под таким именем никогда не
+меняется, и его можно отдавать с Cache-Control immutable на год:
+в разработке это делает ``serve_media``, в nginx - location по шаблону
+``^/media/(?!derivatives/).+/[0-9a-f]{2}/[0-9a-f]{64}\\.\\w+$``.
+Уменьшенные копии под ``derivatives/<имя оригинала>/`` (products/images.py)
+под правило не попадают: ``rebuild_thumbnails --force`` перезаписывает их
+на месте, поэтому они отдаются с обычной проверкой Last-Modified.
+Существующие файлы переносит ``manage.py dedupe_media``.
+"""
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.views.static import serve
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Производные файлы (derivatives/...) перестраиваются на месте и под правило не попадают
+HASHED_NAME_RE = re.compile(r'^(?!derivatives/)(.*/)?([0-9a-f]{2})/\2[0-9a-f]{62}\.\w+$')
+
+
+def file_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hashed_name(name, digest):
+    """products/cover.JPG -> products/ab/ab12...ef.jpg"""
+    directory, basename = posixpath.split(name)
+    extension = os.path.splitext(basename)[1].lower()
+    return posixpath.join(directory, digest[:2], f'{digest}{extension}')
+
+
+def is_hashed_name(name):
+    return HASHED_NAME_RE.search(name) is not None
+
+
+@deconstructible(path='products.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, который называет файлы по хэшу содержимого и не хранит копий"""
+
+    def __init__(self, **kwargs):
+        # Совпадение имён означает совпадение содержимого: суффиксы не нужны,
+        # а одновременная запись одного файла пишет те же байты
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return super().save(hashed_name(name, file_hash(content)), content, max_length)
+
+    def _save(self, name, content):
+        # Такой файл уже есть: содержимое совпадает по определению имени
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """django.views.static.serve с вечным кэшем для файлов с хэшем в имени"""
+    response = serve(request, path, document_root, show_indexes)
+    if response.status_code == 200 and is_hashed_name(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
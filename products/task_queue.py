@@ -0,0 +1,150 @@
+"""
+Очередь фоновых задач в базе данных без внешнего брокера.
+
+Задача - строка таблицы Task с именем зарегистрированной функции и
+JSON-аргументами. ``enqueue`` ставит её через ``transaction.on_commit``,
+поэтому задача появляется только после фиксации заказа и не выполнится
+для отменённой транзакции. Команда ``manage.py run_tasks`` забирает
+готовые задачи одним ``UPDATE ... RETURNING`` (два обработчика не получат
+одну задачу), выполняет их в пуле потоков и при ошибке откладывает
+следующую попытку с экспоненциальной задержкой.
+"""
+import json
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+RETRY_DELAY = 10
+
+MAX_RETRY_DELAY = 60 * 60
+
+# Задача, которая выполняется дольше, считается брошенной упавшим обработчиком
+LEASE_TIMEOUT = 60 * 10
+
+_registry = {}
+
+
+def task(func=None, *, max_attempts=MAX_ATTEMPTS):
+    """Регистрирует функцию как фоновую задачу и добавляет ей метод enqueue"""
+    def register(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        _registry[name] = func
+        func.task_name = name
+        func.max_attempts = max_attempts
+        func.enqueue = lambda **kwargs: enqueue(name, kwargs, max_attempts=max_attempts)
+        return func
+
+    return register(func) if func is not None else register
+
+
+def enqueue(name, payload=None, *, delay=0, max_attempts=MAX_ATTEMPTS):
+    """Ставит задачу в очередь после фиксации текущей транзакции"""
+    if name not in _registry:
+        raise KeyError(f'Неизвестная задача: {name}')
+
+    def create():
+        Task.objects.create(
+            name=name,
+            payload=payload or {},
+            max_attempts=max_attempts,
+            run_at=timezone.now() + timedelta(seconds=delay),
+        )
+
+    transaction.on_commit(create)
+
+
+def retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def claim(limit, lease_timeout=LEASE_TIMEOUT):
+    """Забирает до limit готовых задач, возвращает [(id, name, payload, attempts, max_attempts)]"""
+    table = Task._meta.db_table
+    now = timezone.now()
+    stale = connection.ops.adapt_datetimefield_value(now - timedelta(seconds=lease_timeout))
+    with transaction.atomic():
+        # Брошенные задачи, у которых кончились попытки, дальше не берутся
+        Task.objects.filter(
+            status='running', locked_at__lt=now - timedelta(seconds=lease_timeout),
+            attempts__gte=F('max_attempts'),
+        ).update(status='failed', finished_at=now, last_error='Истекло время выполнения')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table}
+                SET status = 'running', attempts = attempts + 1, locked_at = %s
+                WHERE id IN (
+                    SELECT id FROM {table}
+                    WHERE (status = 'pending' AND run_at <= %s)
+                       OR (status = 'running' AND locked_at < %s)
+                    ORDER BY run_at, id
+                    LIMIT %s
+                )
+                RETURNING id, name, payload, attempts, max_attempts
+                """,
+                [connection.ops.adapt_datetimefield_value(now),
+                 connection.ops.adapt_datetimefield_value(now), stale, limit],
+            )
+            rows = cursor.fetchall()
+    return [
+        (pk, name, json.loads(payload) if isinstance(payload, str) else payload, attempts, max_attempts)
+        for pk, name, payload, attempts, max_attempts in sorted(rows)
+    ]
+
+
+def execute(pk, name, payload, attempts, max_attempts):
+    """Выполняет задачу и записывает результат; возвращает True при успехе"""
+    try:
+        func = _registry.get(name)
+        if func is None:
+            raise LookupError(f'Неизвестная задача: {name}')
+        func(**payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Задача %s #%s завершилась ошибкой (попытка %s/%s)', name, pk, attempts, max_attempts)
+        now = timezone.now()
+        if attempts >= max_attempts:
+            Task.objects.filter(pk=pk).update(status='failed', last_error=error, finished_at=now)
+        else:
+            Task.objects.filter(pk=pk).update(
+                status='pending', last_error=error, locked_at=None,
+                run_at=now + timedelta(seconds=retry_delay(attempts)),
+            )
+        return False
+    else:
+        Task.objects.filter(pk=pk).update(status='done', last_error='', finished_at=timezone.now())
+        return True
+    finally:
+        # Соединение принадлежит потоку пула и закрывается вместе с задачей
+        connections.close_all()
+
+
+def run_pending(executor, limit):
+    """Один проход обработчика: забрать задачи, выполнить в пуле, вернуть (успешных, ошибок)"""
+    close_old_connections()
+    claimed = claim(limit)
+    results = list(executor.map(lambda row: execute(*row), claimed))
+    return results.count(True), results.count(False)
+
+
+def run_all(threads=4, limit=50):
+    """Выполняет все готовые задачи и возвращается (для тестов и cron)"""
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='task') as executor:
+        while True:
+            succeeded, errors = run_pending(executor, limit)
+            if not succeeded and not errors:
+                return done, failed
+            done += succeeded
+            failed += errors
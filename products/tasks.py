@@ -0,0 +1,23 @@
+"""Фоновые задачи магазина, выполняемые ``manage.py run_tasks``"""
+from django.conf import settings
+from django.core.mail import send_mail
+from django.template.loader import render_to_string
+
+from .models import Order
+from .task_queue import task
+
+
+@task
+def send_order_confirmation(order_id):
+    """Письмо с составом заказа на адрес из формы оформления"""
+    order = Order.objects.select_related('user').filter(pk=order_id).first()
+    if order is None:
+        return
+    recipient = order.email or order.user.email
+    if not recipient:
+        return
+    body = render_to_string('emails/order_confirmation.txt', {
+        'order': order,
+        'items': order.items.all(),
+    })
+    send_mail(f'Заказ #{order.id} принят', body, settings.DEFAULT_FROM_EMAIL, [recipient])
@@ -0,0 +1,48 @@
+"""
+Тег ``{% asset %}``: подключение CSS/JS из конвейера статики.
+
+Для бандла из STATIC_BUNDLES выводится один файл, если collectstatic
+его собрал, иначе - его части по отдельности. Часть, которой нет
+локально (vendor-файлы ещё не скачаны ``manage.py vendor_assets``),
+подключается с CDN из VENDOR_ASSETS.
+"""
+from functools import lru_cache
+
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html_join
+
+register = template.Library()
+
+
+def _collected(name):
+    return name in getattr(staticfiles_storage, 'hashed_files', {})
+
+
+@lru_cache(maxsize=None)
+def _found(name):
+    return finders.find(name) is not None
+
+
+def asset_urls(name):
+    """Адреса, которыми подключается файл или бандл name"""
+    if _collected(name):
+        return [static(name)]
+    bundles = getattr(settings, 'STATIC_BUNDLES', {})
+    if name in bundles:
+        return [url for member in bundles[name] for url in asset_urls(member)]
+    if _found(name):
+        return [static(name)]
+    cdn_url = getattr(settings, 'VENDOR_ASSETS', {}).get(name)
+    return [cdn_url] if cdn_url else []
+
+
+@register.simple_tag
+def asset(name):
+    urls = asset_urls(name)
+    if name.endswith('.js'):
+        return format_html_join('\n    ', '<script src="{}"></script>', ((url,) for url in urls))
+    return format_html_join('\n    ', '<link rel="stylesheet" href="{}">', ((url,) for url in urls))
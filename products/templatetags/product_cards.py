@@ -0,0 +1,46 @@
+"""
+Кэш разметки карточек товаров.
+
+Карточка хранится под ключом из id товара и его updated_at, поэтому
+изменённый товар сразу получает новый ключ, а неизменные карточки
+берутся из кэша одним get_many на страницу. Версия 'product_cards'
+учитывает то, что выводится в карточке из связанных моделей
+(название категории), и увеличивается сигналами Category.
+"""
+from django import template
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from products.caching import get_version
+
+VERSION_NAMESPACE = 'product_cards'
+
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+register = template.Library()
+
+
+def card_key(template_name, version, product):
+    return f'card:{version}:{template_name}:{product.pk}:{product.updated_at.timestamp()}'
+
+
+@register.simple_tag
+def product_cards(products, template_name):
+    """Выводит карточки товаров шаблоном template_name, недостающие рендерит и кэширует"""
+    products = list(products)
+    if not products:
+        return ''
+    version = get_version(VERSION_NAMESPACE)
+    keys = [card_key(template_name, version, product) for product in products]
+    cards = cache.get_many(keys)
+    missing = {}
+    card_template = None
+    for key, product in zip(keys, products):
+        if key not in cards:
+            if card_template is None:
+                card_template = get_template(template_name)
+            cards[key] = missing[key] = card_template.render({'product': product})
+    if missing:
+        cache.set_many(missing, CARD_CACHE_TIMEOUT)
+    return mark_safe(''.join(cards[key] for key in keys))
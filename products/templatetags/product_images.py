@@ -0,0 +1,49 @@
+"""
+Тег ``{% product_image %}``: изображение товара с srcset по вариантам.
+
+Выводит <picture> с источником WebP и запасным JPEG, шириной и высотой
+(браузер не перестраивает страницу при загрузке) и ленивой загрузкой.
+Пока варианты не построены, выводится оригинал.
+"""
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from products import images
+
+register = template.Library()
+
+
+def _srcset(name, manifest, fmt):
+    return ', '.join(
+        f"{default_storage.url(images.derivative_name(name, variant, fmt))} {manifest[variant]['width']}w"
+        for variant in images.VARIANTS
+    )
+
+
+@register.simple_tag
+def product_image(image, variant='card', sizes=None, alt='', css_class='', style='', lazy=True):
+    """image - поле изображения товара или имя файла в хранилище"""
+    name = getattr(image, 'name', image)
+    if not name:
+        return ''
+    attrs = [('alt', alt), ('class', css_class), ('style', style)]
+    if lazy:
+        attrs += [('loading', 'lazy'), ('decoding', 'async')]
+    manifest = images.get_manifest(name)
+    if manifest is None:
+        return format_html(
+            '<img src="{}"{}>', default_storage.url(name),
+            format_html_join('', ' {}="{}"', [attr for attr in attrs if attr[1]]),
+        )
+
+    sizes = sizes or f"{images.VARIANTS[variant] // 2}px"
+    attrs += [('width', manifest[variant]['width']), ('height', manifest[variant]['height'])]
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        _srcset(name, manifest, 'webp'), sizes,
+        default_storage.url(images.derivative_name(name, variant, 'jpeg')),
+        _srcset(name, manifest, 'jpeg'), sizes,
+        format_html_join('', ' {}="{}"', [attr for attr in attrs if attr[1]]),
+    )
@@ -1,3 +1,1199 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.template import Context, Template, loader
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import async_views, caching, counters, facets, images, page_cache, routers, task_queue
+from .autocomplete import CHANGE_KEY, CHANGE_WAIT, SEQUENCE_COUNTER, VERSION_COUNTER, Autocomplete, autocomplete
+from .cart import MAX_QUANTITY, _upsert_item, add_item
+from .context_processors import categories, order_count
+from .exports import filter_orders, iter_csv
+from .inventory import reserve
+from .middleware import ReplicaRoutingMiddleware
+from .pagination import KeysetPaginator, encode_cursor, paginate_sequence
+from .models import (
+    Cart, CartItem, Category, FacetCount, Manufacturer, Order, OrderItem, Product, SharedCounter, Task, image_storage,
+)
+from .orders import CheckoutError, place_order
+from .query_plans import collect_problems, create_fixture
+from .search import FTS_TABLE, get_search_backend
+from .sqlite import current_settings
+from .staticfiles import compress
+from .storage import IMMUTABLE_CACHE_CONTROL, is_hashed_name, serve_media
+from .task_queue import task
+
+
+class QueryPlanTests(TestCase):
+    def test_pages_do_not_scan_full_tables(self):
+        problems = collect_problems(create_fixture())
+        self.assertEqual(problems, [])
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Версии кэша перечитываются из базы только там, где тест просит об этом
+        # явно: иначе число запросов зависело бы от скорости прогона
+        caching._versions.clear()
+        patcher = mock.patch('products.caching.VERSION_CHECK_SECONDS', 60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.category = Category.objects.create(name='Fantasy')
+        self.manufacturer = Manufacturer.objects.create(name='Эксмо', country='RU')
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.client.force_login(self.user)
+
+    def create_products(self, count, price=Decimal('100')):
+        return [
+            Product.objects.create(
+                name=f'Книга {index}', price=price,
+                category=self.category, manufacturer=self.manufacturer,
+            )
+            for index in range(count)
+        ]
+
+    def fill_cart(self, count):
+        cart, _created = Cart.objects.get_or_create(user=self.user)
+        for quantity, product in enumerate(self.create_products(count), start=1):
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        return cart
+
+
+class SearchTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = get_search_backend()
+        self.other_category = Category.objects.create(name='Science')
+
+    def create_product(self, name, category=None):
+        return Product.objects.create(
+            name=name, price=Decimal('100'), category=category or self.category, manufacturer=self.manufacturer,
+        )
+
+    def test_saved_product_is_found_by_prefix(self):
+        messiah = self.create_product('Dune Messiah')
+        dune = self.create_product('Dune')
+        self.assertCountEqual(self.backend.search('dun'), [messiah.pk, dune.pk])
+        self.assertEqual(self.backend.search('dune mess'), [messiah.pk])
+        # Издатель тоже в индексе
+        self.assertCountEqual(self.backend.search('эксмо'), [messiah.pk, dune.pk])
+        self.assertEqual(self.backend.search('   '), [])
+
+    def test_filters_are_applied_before_limit(self):
+        for index in range(3):
+            self.create_product(f'Dune {index}')
+        wanted = [self.create_product(f'Dune science {index}', self.other_category).pk for index in range(2)]
+        queryset = Product.objects.filter(category=self.other_category)
+        self.assertCountEqual(self.backend.search('dune', limit=2, queryset=queryset), wanted)
+
+        response = self.client.get(reverse('product_list'), {'q': 'dune', 'category': self.other_category.pk})
+        self.assertCountEqual([product.pk for product in response.context['products']], wanted)
+
+    def test_search_runs_on_the_database_chosen_by_router(self):
+        dune = self.create_product('Dune')
+        with mock.patch('products.search.router.db_for_read', return_value='replica_1'), \
+                mock.patch('products.search.connections', {'replica_1': connection}):
+            self.assertEqual(self.backend.search('dune'), [dune.pk])
+
+    def test_signals_keep_index_in_sync(self):
+        product = self.create_product('Dune')
+        self.category.name = 'Classics'
+        self.category.save()
+        self.assertEqual(self.backend.search('classic'), [product.pk])
+        product.name = 'Solaris'
+        product.save()
+        self.assertEqual(self.backend.search('dune'), [])
+        self.assertEqual(self.backend.search('solaris'), [product.pk])
+        product.delete()
+        self.assertEqual(self.backend.search('solaris'), [])
+
+    def test_rebuild_command_restores_index(self):
+        product = self.create_product('Dune')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        self.assertEqual(self.backend.search('dune'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.backend.search('dune'), [product.pk])
+
+
+class KeysetPaginationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        # Одинаковая цена у всех: порядок держится на добавочном ключе id
+        self.products = self.create_products(5)
+        self.paginator = KeysetPaginator(Product.objects.all(), 'price', per_page=2)
+
+    def test_next_and_previous_cursors_walk_all_rows_with_ties(self):
+        page = self.paginator.page()
+        self.assertFalse(page.has_previous)
+        seen, pages = [], [page]
+        while True:
+            seen.extend(product.pk for product in page)
+            if not page.has_next:
+                break
+            page = self.paginator.page(after=page.next_cursor)
+            pages.append(page)
+        self.assertEqual(seen, [product.pk for product in self.products])
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+
+        previous = self.paginator.page(before=pages[-1].previous_cursor)
+        self.assertEqual(list(previous), list(pages[1]))
+        first = self.paginator.page(before=previous.previous_cursor)
+        self.assertEqual(list(first), list(pages[0]))
+        self.assertFalse(first.has_previous)
+
+    def test_descending_order(self):
+        paginator = KeysetPaginator(Product.objects.all(), '-price', per_page=3)
+        first = paginator.page()
+        second = paginator.page(after=first.next_cursor)
+        self.assertEqual(
+            [product.pk for product in list(first) + list(second)],
+            [product.pk for product in reversed(self.products)],
+        )
+
+    def test_invalid_or_tampered_cursor_falls_back_to_first_page(self):
+        first = [product.pk for product in self.paginator.page()]
+        for cursor in ['garbage', '!!!', encode_cursor({'a': 1}), encode_cursor(['abc', 1]),
+                       encode_cursor(['100', 'x']), encode_cursor([None, 1]), encode_cursor([[1], 1]),
+                       encode_cursor(['100', 2 ** 70]), encode_cursor([1])]:
+            with self.subTest(cursor=cursor):
+                self.assertEqual([product.pk for product in self.paginator.page(after=cursor)], first)
+                self.assertEqual([product.pk for product in self.paginator.page(before=cursor)], first)
+        response = self.client.get(reverse('product_list'), {'sort': 'price', 'after': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_sequence_cursors(self):
+        page = paginate_sequence(list(range(5)), 2)
+        page = paginate_sequence(list(range(5)), 2, after=page.next_cursor)
+        self.assertEqual(page.object_list, [2, 3])
+        self.assertEqual(paginate_sequence(list(range(5)), 2, before=page.previous_cursor).object_list, [0, 1])
+        self.assertEqual(paginate_sequence(list(range(5)), 2, after='garbage').object_list, [0, 1])
+
+
+class FacetCountTests(CatalogTestCase):
+    def stored_counts(self):
+        return {
+            (facet, value, is_available): count
+            for facet, value, is_available, count in FacetCount.objects.filter(count__gt=0).values_list(
+                'facet', 'value', 'is_available', 'count')
+        }
+
+    def assertCountsMatchRebuild(self):
+        incremental = self.stored_counts()
+        facets.rebuild()
+        self.assertEqual(incremental, self.stored_counts())
+
+    def test_counts_follow_create_edit_delete_and_sell_out(self):
+        first, second, third = self.create_products(3)
+        self.assertEqual(self.stored_counts()[('category', str(self.category.pk), True)], 3)
+        self.assertCountsMatchRebuild()
+
+        other = Manufacturer.objects.create(name='АСТ', country='BY')
+        first.price = Decimal('1200')
+        first.manufacturer = other
+        first.save()
+        second.is_available = False
+        second.save()
+        self.assertCountsMatchRebuild()
+
+        third.delete()
+        self.assertCountsMatchRebuild()
+
+        first.stock = 1
+        first.save()
+        add_item(self.user, first.pk)
+        place_order(self.user)
+        counts = self.stored_counts()
+        self.assertNotIn(('country', 'BY', True), counts)
+        self.assertEqual(counts[('country', 'BY', False)], 1)
+        self.assertCountsMatchRebuild()
+
+    def test_first_increment_creates_counter(self):
+        facets.adjust([('country', 'KZ'), ('price', '2000+')], True, 2)
+        facets.adjust([('country', 'KZ')], True, 1)
+        counts = self.stored_counts()
+        self.assertEqual((counts[('country', 'KZ', True)], counts[('price', '2000+', True)]), (3, 2))
+
+    def test_manufacturer_names_are_cached_until_manufacturer_changes(self):
+        self.create_products(1)
+        selected = facets.selected_filters(RequestFactory().get('/').GET)
+        facets.get_facets(selected)
+        with self.assertNumQueries(1):
+            options = facets.get_facets(selected)['manufacturer']
+        self.assertEqual([option['label'] for option in options], ['Эксмо'])
+
+        self.manufacturer.name = 'Эксмо-Пресс'
+        self.manufacturer.save()
+        options = facets.get_facets(selected)['manufacturer']
+        self.assertEqual([option['label'] for option in options], ['Эксмо-Пресс'])
+
+
+class AutocompleteTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dune = self.create_product('Дюна')
+        autocomplete.build()
+
+    def create_product(self, name):
+        return Product.objects.create(
+            name=name, price=Decimal('100'), category=self.category, manufacturer=self.manufacturer,
+        )
+
+    def names(self, prefix, index=autocomplete):
+        return [row['name'] for row in index.search(prefix)['products']]
+
+    def test_prefix_search_matches_any_word(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_product('Песнь Сорокопута')
+        self.assertEqual(self.names('пес'), ['Песнь Сорокопута'])
+        self.assertEqual(self.names('СОРОК'), ['Песнь Сорокопута'])
+        self.assertEqual(self.names('дю'), ['Дюна'])
+        self.assertEqual(self.names('x'), [])
+        self.assertEqual(autocomplete.search('эксм')['manufacturers'], [{'id': self.manufacturer.pk, 'name': 'Эксмо'}])
+
+    def test_changes_are_applied_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product('Гиперион')
+            self.assertEqual(self.names('гипер'), [])
+        self.assertEqual(self.names('гипер'), ['Гиперион'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.is_available = False
+            product.save()
+        self.assertEqual(self.names('гипер'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dune.delete()
+        self.assertEqual(self.names('дю'), [])
+
+    def test_rolled_back_save_is_not_indexed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.create_product('Гиперион')
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(self.names('гипер'), [])
+
+    def test_other_process_applies_changes_without_rebuild(self):
+        other = Autocomplete()
+        other.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_product('Гиперион')
+            self.dune.delete()
+        other.checked_at = 0
+        with mock.patch.object(other, 'schedule_rebuild') as schedule_rebuild:
+            self.assertEqual(self.names('гипер', other), ['Гиперион'])
+            self.assertEqual(self.names('дю', other), [])
+        schedule_rebuild.assert_not_called()
+
+        # Пропущенное изменение вытеснено из кэша: сначала ждём, потом перестройка в фоне
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_product('Солярис')
+        cache.delete(CHANGE_KEY % autocomplete.version)
+        with mock.patch.object(other, 'schedule_rebuild') as schedule_rebuild:
+            other.checked_at = 0
+            other.search('сол')
+            schedule_rebuild.assert_not_called()
+            other.checked_at = 0
+            other.missing_since -= CHANGE_WAIT
+            other.search('сол')
+        schedule_rebuild.assert_called_once()
+
+    def test_version_published_before_change_is_visible_waits(self):
+        other = Autocomplete()
+        other.build()
+        # Другой процесс взял номер и поднял версию, а изменение ещё не записал
+        number = counters.advance(SEQUENCE_COUNTER)
+        counters.raise_to({VERSION_COUNTER: number})
+        other.checked_at = 0
+        with mock.patch.object(other, 'schedule_rebuild') as schedule_rebuild:
+            self.assertEqual(self.names('гипер', other), [])
+            cache.set(CHANGE_KEY % number, ('products', 999, 'Гиперион'))
+            other.checked_at = 0
+            self.assertEqual(self.names('гипер', other), ['Гиперион'])
+        schedule_rebuild.assert_not_called()
+        self.assertEqual(other.version, number)
+
+
+class NavigationCacheTests(CatalogTestCase):
+    def navigation(self):
+        return list(categories(RequestFactory().get('/'))['categories'])
+
+    def test_category_and_product_edits_invalidate_navigation(self):
+        self.assertEqual(self.navigation(), [{
+            'id': self.category.pk, 'name': 'Fantasy', 'description': self.category.description, 'product_count': 0,
+        }])
+        with self.assertNumQueries(0):
+            self.navigation()
+
+        self.category.name = 'Фэнтези'
+        self.category.save()
+        self.assertEqual(self.navigation()[0]['name'], 'Фэнтези')
+
+        product = self.create_products(1)[0]
+        self.assertEqual(self.navigation()[0]['product_count'], 1)
+
+        product.is_available = False
+        product.save()
+        self.assertEqual(self.navigation()[0]['product_count'], 0)
+
+        Category.objects.create(name='Science')
+        self.assertEqual([category['name'] for category in self.navigation()], ['Science', 'Фэнтези'])
+
+        response = self.client.get(reverse('about'))
+        self.assertContains(response, 'Science')
+
+
+class PageCacheTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.logout()
+        self.product = self.create_products(1)[0]
+        page_cache.reset_stats()
+
+    def test_second_request_is_a_cache_hit(self):
+        first = self.client.get(reverse('product_list'))
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('product_list'))
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        stats = page_cache.get_stats()
+        self.assertEqual((stats['misses'], stats['hits']), (1, 1))
+
+    def test_conditional_get_returns_304(self):
+        first = self.client.get(reverse('product_list'))
+        response = self.client.get(reverse('product_list'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('product_list'), HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(page_cache.get_stats()['not_modified'], 2)
+
+    def test_product_edit_invalidates_cached_page(self):
+        first = self.client.get(reverse('product_list'))
+        self.product.name = 'Новое название'
+        self.product.save()
+        response = self.client.get(reverse('product_list'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertContains(response, 'Новое название')
+
+    def test_invalidation_by_other_process_is_seen(self):
+        first = self.client.get(reverse('product_list'))
+        # Другой воркер или команда manage.py сбросили версию в общей таблице
+        key = caching.VERSION_KEY % page_cache.VERSION_NAMESPACE
+        counters.advance(key, caching.get_version(page_cache.VERSION_NAMESPACE) + 1)
+        response = self.client.get(reverse('product_list'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        with mock.patch('products.caching.VERSION_CHECK_SECONDS', 0):
+            response = self.client.get(reverse('product_list'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+    def test_stats_command_reports_counts_flushed_by_other_processes(self):
+        self.client.get(reverse('product_list'))
+        self.client.get(reverse('product_list'))
+        page_cache.flush_stats()
+        self.assertEqual(
+            SharedCounter.objects.get(name=page_cache.STATS_KEYS['hits']).value, 1,
+        )
+        output = StringIO()
+        call_command('page_cache_stats', '--reset', stdout=output)
+        self.assertIn('50.0%', output.getvalue())
+        self.assertEqual(page_cache.get_stats()['hits'], 0)
+
+
+class AsyncCatalogUrls:
+    """Маршруты как при MYSHOP_ASYNC_VIEWS=1: каталог и корзина из async_views"""
+    urlpatterns = [
+        path('', async_views.home, name='home'),
+        path('products/', async_views.product_list, name='product_list'),
+        path('category/<int:category_id>/', async_views.category_products, name='category_products'),
+        path('cart/add/<int:product_id>/', async_views.add_to_cart, name='add_to_cart'),
+        path('', include('myshop.urls')),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncCatalogUrls)
+class AsyncViewsTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = self.create_products(3)
+        self.client.logout()
+        page_cache.reset_stats()
+
+    async def test_catalog_pages_list_available_products(self):
+        expected = {product.name for product in self.products}
+        for url in (reverse('home'), reverse('product_list') + '?sort=price',
+                    reverse('category_products', args=[self.category.id])):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            products = response.context['popular_products' if url == '/' else 'products']
+            self.assertEqual({product.name for product in products}, expected)
+
+    async def test_search_is_ranked(self):
+        response = await self.async_client.get(reverse('product_list'), {'q': 'Книга 2'})
+        self.assertEqual([product.name for product in response.context['products']][:1], ['Книга 2'])
+
+    async def test_page_cache_hit_and_304(self):
+        first = await self.async_client.get(reverse('product_list'))
+        second = await self.async_client.get(reverse('product_list'))
+        self.assertEqual(second.content, first.content)
+        response = await self.async_client.get(reverse('product_list'), headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, 304)
+        stats = await sync_to_async(page_cache.get_stats)()
+        self.assertEqual((stats['misses'], stats['hits'], stats['not_modified']), (1, 1, 1))
+
+    async def test_add_to_cart_json(self):
+        await sync_to_async(self.client.force_login)(self.user)
+        self.async_client.cookies = self.client.cookies
+        url = reverse('add_to_cart', args=[self.products[0].id])
+        for expected in (1, 2):
+            response = await self.async_client.get(url, headers={'X-Requested-With': 'XMLHttpRequest'})
+            self.assertEqual(response.json()['cart_total_quantity'], expected)
+
+
+class ProductCardCacheTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = self.create_products(3)
+
+    def rendered_cards(self, *requests):
+        """Названия товаров, карточки которых пришлось отрендерить заново"""
+        rendered = []
+
+        def get_template(name):
+            template = loader.get_template(name)
+            original = template.render
+
+            def render(context=None, request=None):
+                rendered.append(context['product'].name)
+                return original(context, request)
+
+            template.render = render
+            return template
+
+        with mock.patch('products.templatetags.product_cards.get_template', get_template):
+            for path, params in requests:
+                self.assertEqual(self.client.get(path, params).status_code, 200)
+        return sorted(rendered)
+
+    def test_cards_are_reused_across_pages_and_refreshed_after_edit(self):
+        list_page = (reverse('product_list'), {})
+        sorted_page = (reverse('product_list'), {'sort': 'price'})
+        self.assertEqual(len(self.rendered_cards(list_page)), 3)
+        self.assertEqual(self.rendered_cards(sorted_page, list_page), [])
+
+        self.products[0].name = 'Книга 0, новое издание'
+        self.products[0].save()
+        self.assertEqual(self.rendered_cards(sorted_page), ['Книга 0, новое издание'])
+
+        # Название категории выводится в карточке: меняется у всех
+        self.category.name = 'Фэнтези'
+        self.category.save()
+        self.assertEqual(len(self.rendered_cards(list_page)), 3)
+
+
+class CartBatchUpdateTests(CatalogTestCase):
+    def post(self, payload):
+        return self.client.post(
+            reverse('update_cart_items'), json.dumps(payload) if not isinstance(payload, str) else payload,
+            content_type='application/json',
+        )
+
+    def test_batch_update_changes_and_removes_items(self):
+        first, second, third = self.fill_cart(3).items.order_by('id')
+        response = self.post({'changes': {str(first.pk): 5, str(second.pk): 0, '999999': 1}})
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual([(item['id'], item['quantity']) for item in data['items']], [(first.pk, 5), (third.pk, 3)])
+        self.assertEqual((data['cart_total_quantity'], data['cart_total_price']), (8, '800.00'))
+        self.assertEqual(data['not_found'], [999999])
+
+        # Список словарей тоже принимается, количество ограничено сверху
+        data = self.post({'changes': [{str(third.pk): MAX_QUANTITY + 1}]}).json()
+        self.assertEqual(CartItem.objects.get(pk=third.pk).quantity, MAX_QUANTITY)
+
+    def test_invalid_input_is_rejected(self):
+        item = self.fill_cart(1).items.get()
+        for payload in ['not json', '[1, 2]', {'changes': {str(item.pk): 'many'}}, {'changes': {'x': 1}},
+                        '{"changes": {"%s": Infinity}}' % item.pk, '{"changes": {"%s": 1e999}}' % item.pk,
+                        {'changes': [1]}]:
+            with self.subTest(payload=payload):
+                self.assertEqual(self.post(payload).status_code, 400)
+        too_many = {'changes': {str(pk): 1 for pk in range(1, 200)}}
+        self.assertEqual(self.post(too_many).status_code, 400)
+        self.assertEqual(CartItem.objects.get().quantity, 1)
+
+    def test_query_count_does_not_depend_on_number_of_changes(self):
+        items = list(self.fill_cart(10).items.all())
+        # Сессия, пользователь, позиции до изменения, bulk_update и DELETE
+        # (в SAVEPOINT внутри транзакции теста), позиции после изменения
+        with self.assertNumQueries(8):
+            self.post({'changes': {str(item.pk): 2 for item in items[:2]} | {str(items[2].pk): 0}})
+        with self.assertNumQueries(8):
+            self.post({'changes': {str(item.pk): 3 for item in items[3:]} | {str(items[0].pk): 0}})
+
+
+class CartSummaryQueryTests(CatalogTestCase):
+    # Сессия, пользователь, позиции корзины с товарами
+    PAGE_QUERIES = 3
+
+    def assertPageQueries(self, url, items):
+        self.fill_cart(items)
+        self.client.get(url)
+        with self.assertNumQueries(self.PAGE_QUERIES):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_cart_page_queries_do_not_grow_with_items(self):
+        response = self.assertPageQueries(reverse('cart_view'), items=10)
+        self.assertEqual(response.context['total_quantity'], 55)
+        self.assertEqual(response.context['total_price'], Decimal('5500'))
+
+    def test_checkout_page_queries_do_not_grow_with_items(self):
+        self.assertPageQueries(reverse('checkout'), items=10)
+
+    def test_header_counts_cart_with_one_aggregate(self):
+        self.fill_cart(3)
+        self.client.get(reverse('about'))
+        # Сессия, пользователь, агрегат корзины
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('about'))
+        self.assertContains(response, 'товаров в корзине')
+        self.assertEqual(response.context['cart_summary'].total_quantity, 6)
+
+
+class OrderCountTests(CatalogTestCase):
+    def test_order_count_is_cached_and_follows_new_orders(self):
+        self.client.get(reverse('about'))
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('about'))
+        self.assertEqual(response.context['order_count'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(user=self.user, total_price=Decimal('100'))
+        response = self.client.get(reverse('about'))
+        self.assertEqual(response.context['order_count'], 1)
+
+    def test_order_count_is_lazy(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            context = order_count(request)
+        with self.assertNumQueries(1):
+            self.assertEqual(context['order_count'], 0)
+
+
+class OrderHistoryQueryTests(CatalogTestCase):
+    def create_orders(self, count, lines):
+        products = self.create_products(lines)
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, total_price=Decimal('100') * lines)
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, quantity=2, price=product.price, product_name=product.name)
+                for product in products
+            )
+            orders.append(order)
+        return orders
+
+    def count_queries(self, url):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_order_list_queries_do_not_grow_with_history(self):
+        self.create_orders(1, lines=1)
+        small, _response = self.count_queries(reverse('order_list'))
+        self.create_orders(9, lines=5)
+        large, response = self.count_queries(reverse('order_list'))
+        self.assertEqual(small, large)
+        self.assertEqual(response.context['orders'][0].item_count, 5)
+        self.assertEqual(response.context['orders'][0].item_quantity, 10)
+
+    def test_order_detail_queries_do_not_grow_with_lines(self):
+        small_order = self.create_orders(1, lines=1)[0]
+        large_order = self.create_orders(1, lines=20)[0]
+        small, _response = self.count_queries(reverse('order_detail', args=[small_order.pk]))
+        large, response = self.count_queries(reverse('order_detail', args=[large_order.pk]))
+        self.assertEqual(small, large)
+        self.assertContains(response, 'Книга 19')
+
+    def test_order_history_survives_product_deletion(self):
+        order = self.create_orders(1, lines=1)[0]
+        Product.objects.all().delete()
+        response = self.client.get(reverse('order_detail', args=[order.pk]))
+        self.assertContains(response, 'Книга 0')
+
+
+class OrderExportTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        products = self.create_products(3)
+        for status in ('pending', 'completed'):
+            order = Order.objects.create(user=self.user, total_price=Decimal('300'), status=status)
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, quantity=1, price=product.price, product_name=product.name)
+                for product in products
+            )
+
+    def test_export_is_one_streamed_query(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        url = reverse('admin:products_order_export')
+        response = self.client.get(url, {'format': 'jsonl', 'status': 'completed'})
+        self.assertTrue(response.streaming)
+        with CaptureQueriesContext(connection) as context:
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(len(json.loads(lines[0])['items']), 3)
+
+    def test_csv_has_row_per_item(self):
+        lines = ''.join(iter_csv(filter_orders(), chunk_size=2)).splitlines()
+        self.assertEqual(len(lines), 1 + 6)
+
+    def test_command_streams_to_stdout(self):
+        output = StringIO()
+        call_command('export_orders', '--format', 'jsonl', '--status', 'pending', stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['status'], 'pending')
+
+    def test_csv_escapes_formulas(self):
+        Order.objects.update(
+            shipping_address='=HYPERLINK("http://evil.example")', phone_number='+79990000000',
+            email='@SUM(1)',
+        )
+        OrderItem.objects.update(product_name='-1+2')
+        rows = list(csv.DictReader(''.join(iter_csv(filter_orders())).splitlines()))
+        self.assertEqual(rows[0]['shipping_address'], '\'=HYPERLINK("http://evil.example")')
+        self.assertEqual(rows[0]['phone_number'], "'+79990000000")
+        self.assertEqual(rows[0]['email'], "'@SUM(1)")
+        self.assertEqual(rows[0]['product_name'], "'-1+2")
+        self.assertEqual(rows[0]['order_total'], '300.00')
+
+
+class AddToCartTests(CatalogTestCase):
+    def test_add_is_one_upsert_and_one_total_query(self):
+        product = self.create_products(1)[0]
+        add_item(self.user, product.pk)
+        # Upsert и итог корзины; SAVEPOINT/RELEASE появляются только
+        # внутри транзакции теста, вне её atomic не выполняет запросов
+        with self.assertNumQueries(4):
+            name, total_quantity = add_item(self.user, product.pk)
+        self.assertEqual((name, total_quantity), (product.name, 2))
+
+    def test_cart_created_by_parallel_request_is_used(self):
+        product = self.create_products(1)[0]
+        Cart.objects.create(user=self.user)
+        results = [None]
+
+        def upsert(*args):
+            # Первый upsert не нашёл корзину: её создал параллельный запрос
+            return results.pop() if results else _upsert_item(*args)
+
+        with mock.patch('products.cart._upsert_item', upsert):
+            self.assertEqual(add_item(self.user, product.pk), (product.name, 1))
+
+    def test_quantity_is_capped(self):
+        product = self.create_products(1)[0]
+        add_item(self.user, product.pk, MAX_QUANTITY + 100)
+        self.assertEqual(CartItem.objects.get().quantity, MAX_QUANTITY)
+        CartItem.objects.update(quantity=MAX_QUANTITY - 1)
+        self.assertEqual(add_item(self.user, product.pk, 5), (product.name, MAX_QUANTITY))
+
+    def test_unavailable_product_is_not_added(self):
+        product = self.create_products(1)[0]
+        product.is_available = False
+        product.save()
+        response = self.client.get(reverse('add_to_cart', args=[product.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class AnonymousCartTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.logout()
+
+    def test_anonymous_cart_does_not_write_to_database(self):
+        products = self.create_products(2)
+        with CaptureQueriesContext(connection) as context:
+            for product in products + products[:1]:
+                self.client.get(reverse('add_to_cart', args=[product.pk]))
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in context.captured_queries))
+        response = self.client.get(reverse('cart_view'))
+        self.assertEqual(response.context['total_quantity'], 3)
+        self.assertEqual(response.context['total_price'], Decimal('300'))
+
+    def test_cookie_cart_is_merged_on_login(self):
+        first, second = self.create_products(2)
+        add_item(self.user, first.pk)
+        self.client.get(reverse('add_to_cart', args=[first.pk]))
+        self.client.get(reverse('add_to_cart', args=[second.pk]))
+        self.client.post(reverse('login'), {'username': 'reader', 'password': 'password'})
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity')),
+            {first.pk: 2, second.pk: 1},
+        )
+        self.assertEqual(self.client.cookies['cart'].value, '')
+
+
+class StockReservationTests(CatalogTestCase):
+    def test_checkout_decrements_stock(self):
+        product = self.create_products(1)[0]
+        product.stock = 5
+        product.save()
+        add_item(self.user, product.pk, 2)
+        place_order(self.user)
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.is_available), (3, True))
+
+    def test_selling_last_copy_takes_product_off_sale(self):
+        product = self.create_products(1)[0]
+        product.stock = 2
+        product.save()
+        add_item(self.user, product.pk, 2)
+        place_order(self.user)
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.is_available), (0, False))
+        self.assertEqual(
+            FacetCount.objects.get(facet='category', value=str(self.category.pk), is_available=False).count, 1,
+        )
+
+    def test_manual_availability_survives_edits_without_stock_change(self):
+        product = self.create_products(1)[0]
+        product.stock = 5
+        product.save()
+        product = Product.objects.get(pk=product.pk)
+        product.is_available = False
+        product.save()
+        product = Product.objects.get(pk=product.pk)
+        product.price = Decimal('150')
+        product.save()
+        self.assertFalse(Product.objects.get(pk=product.pk).is_available)
+
+        product.stock = 0
+        product.save()
+        product = Product.objects.get(pk=product.pk)
+        product.stock = 3
+        product.save()
+        self.assertTrue(Product.objects.get(pk=product.pk).is_available)
+
+    def test_sold_out_is_read_after_decrement(self):
+        sold_out, remaining = self.create_products(2)
+        Product.objects.filter(pk__in=[sold_out.pk, remaining.pk]).update(stock=2)
+        with transaction.atomic():
+            self.assertEqual(reserve({sold_out.pk: 2, remaining.pk: 1}), [sold_out.pk])
+        self.assertEqual(
+            dict(Product.objects.values_list('pk', 'is_available')), {sold_out.pk: False, remaining.pk: True},
+        )
+
+    def test_insufficient_stock_rejects_whole_order(self):
+        in_stock, short = self.create_products(2)
+        short.stock = 1
+        short.save()
+        add_item(self.user, in_stock.pk, 1)
+        add_item(self.user, short.pk, 2)
+        with self.assertRaisesMessage(CheckoutError, 'Недостаточно на складе'):
+            place_order(self.user)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=short.pk).stock, 1)
+
+
+def use_temp_media(test):
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root)
+    settings_override = override_settings(MEDIA_ROOT=media_root)
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        use_temp_media(self)
+
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        buffer = BytesIO()
+        Image.new('RGBA', (1200, 1500), (200, 10, 10, 128)).save(buffer, 'PNG', exif=exif)
+        self.name = default_storage.save('products/cover.png', ContentFile(buffer.getvalue()))
+
+    def test_variants_are_resized_without_metadata(self):
+        manifest = images.generate(self.name)
+        self.assertEqual((manifest['thumb']['width'], manifest['thumb']['height']), (160, 200))
+        self.assertEqual(manifest['full']['width'], 1000)
+        for fmt in images.FORMATS:
+            with default_storage.open(images.derivative_name(self.name, 'card', fmt)) as file:
+                variant = Image.open(file)
+                self.assertEqual(variant.width, 500)
+                self.assertEqual(len(variant.getexif()), 0)
+
+    def test_tag_falls_back_to_original_then_uses_srcset(self):
+        template = Template('{% load product_images %}{% product_image name "thumb" sizes="80px" alt="Обложка" %}')
+        html = template.render(Context({'name': self.name}))
+        self.assertIn(f'src="/media/{self.name}"', html)
+        self.assertNotIn('srcset', html)
+
+        images.generate(self.name)
+        html = template.render(Context({'name': self.name}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('thumb.webp 160w', html)
+        self.assertIn('src="/media/derivatives/products/cover.png/thumb.jpg"', html)
+        self.assertIn('width="160" height="200"', html)
+
+
+class ContentAddressedStorageTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        use_temp_media(self)
+
+    def test_identical_uploads_share_one_file(self):
+        first, second = self.create_products(2)
+        first.image.save('cover.JPG', ContentFile(b'same bytes'))
+        second.image.save('other.jpg', ContentFile(b'same bytes'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(is_hashed_name(first.image.name))
+        self.assertTrue(first.image.name.endswith('.jpg'))
+        _dirs, files = image_storage.listdir(posixpath.dirname(first.image.name))
+        self.assertEqual(len(files), 1)
+
+    def test_dedupe_keeps_old_files_until_delete_old(self):
+        product = self.create_products(1)[0]
+        legacy = default_storage.save('products/legacy.jpg', ContentFile(b'bytes'))
+        Product.objects.filter(pk=product.pk).update(image=legacy, updated_at=timezone.now() - timedelta(days=1))
+        before = Product.objects.get(pk=product.pk).updated_at
+
+        call_command('dedupe_media', stdout=StringIO())
+        product.refresh_from_db()
+        self.assertTrue(is_hashed_name(product.image.name))
+        # Новый updated_at меняет ключ кэша карточки в любом процессе
+        self.assertGreater(product.updated_at, before)
+        self.assertTrue(default_storage.exists(legacy))
+
+        call_command('dedupe_media', '--delete-old', stdout=StringIO())
+        self.assertFalse(default_storage.exists(legacy))
+        self.assertTrue(image_storage.exists(product.image.name))
+
+    def test_hashed_media_is_served_immutable(self):
+        name = image_storage.save('products/cover.jpg', ContentFile(b'bytes'))
+        legacy = default_storage.save('products/legacy.jpg', ContentFile(b'bytes'))
+        request = RequestFactory().get('/')
+        response = serve_media(request, name, document_root=settings.MEDIA_ROOT)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+        response = serve_media(request, legacy, document_root=settings.MEDIA_ROOT)
+        self.assertNotIn('Cache-Control', response)
+
+    def test_derivatives_are_not_served_immutable(self):
+        name = image_storage.save('products/cover.jpg', ContentFile(b'bytes'))
+        # Имя варианта, в котором тоже встречается хэш оригинала
+        derivative = images.derivatives_dir(name) + '/9f/9f' + '0' * 62 + '.jpg'
+        default_storage.save(derivative, ContentFile(b'variant'))
+        response = serve_media(RequestFactory().get('/'), derivative, document_root=settings.MEDIA_ROOT)
+        self.assertNotIn('Cache-Control', response)
+        self.assertFalse(is_hashed_name(images.derivative_name(name, 'card', 'jpeg')))
+
+
+class StaticPipelineTests(TestCase):
+    def test_missing_vendor_files_fall_back_to_cdn(self):
+        cache.clear()
+        with mock.patch('products.templatetags.assets._found', lambda name: name == 'css/site.css'):
+            html = self.client.get(reverse('about')).content.decode()
+        self.assertIn(settings.VENDOR_ASSETS['vendor/bootstrap/css/bootstrap.min.css'], html)
+        self.assertIn('href="/static/css/site.css"', html)
+        self.assertNotIn('<style>', html)
+
+    def test_precompressed_hashed_file_is_served_immutable(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        os.makedirs(os.path.join(static_root, 'css'))
+        name = os.path.join(static_root, 'css', 'site.0123456789ab.css')
+        with open(name, 'wb') as file:
+            file.write(b'body { color: black; }' * 100)
+        for extension, content in compress(b'body { color: black; }' * 100).items():
+            with open(name + extension, 'wb') as file:
+                file.write(content)
+
+        with self.settings(STATIC_ROOT=static_root):
+            response = self.client.get('/static/css/site.0123456789ab.css', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'body { color: black; }' * 100)
+
+            response = self.client.get('/static/css/site.0123456789ab.css')
+            self.assertNotIn('Content-Encoding', response)
+
+
+class SQLiteSettingsTests(TestCase):
+    def test_connection_gets_configured_pragmas(self):
+        values = current_settings(connection)
+        self.assertEqual(values['journal_mode'], settings.SQLITE_PRAGMAS['journal_mode'].lower())
+        self.assertEqual(values['busy_timeout'], settings.SQLITE_PRAGMAS['busy_timeout'])
+        self.assertEqual(values['synchronous'], 1)  # NORMAL
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+
+    def route(self, model, pinned=False, catalog=True, write=False):
+        state, token = routers.start_request(pinned)
+        try:
+            state.use_replica = catalog
+            if write:
+                self.router.db_for_write(Cart)
+            return self.router.db_for_read(model)
+        finally:
+            routers.end_request(token)
+
+    def test_catalog_reads_go_to_replica(self):
+        self.assertEqual(self.route(Product), 'replica_1')
+        self.assertEqual(self.route(Category), 'replica_1')
+        self.assertIsNone(self.route(Cart))
+        self.assertIsNone(self.route(Product, catalog=False))
+        # Вне запроса (команды, задачи) - основная база
+        self.assertIsNone(self.router.db_for_read(Product))
+
+    def test_reads_after_write_go_to_primary(self):
+        self.assertIsNone(self.route(Product, write=True))
+        self.assertIsNone(self.route(Product, pinned=True))
+
+    def test_catalog_write_pins_only_its_request(self):
+        state, token = routers.start_request(False)
+        try:
+            self.router.db_for_write(Product)
+            self.assertTrue(state.wrote)
+        finally:
+            routers.end_request(token)
+        self.assertEqual(self.route(Product), 'replica_1')
+
+
+# Реплика - та же база, чтобы представления работали в тесте
+@override_settings(DATABASE_REPLICAS=['default'])
+class ReplicaPinningTests(CatalogTestCase):
+    def unpin_catalog(self):
+        SharedCounter.objects.filter(name=routers.CATALOG_PIN_COUNTER).delete()
+        routers.refresh_catalog_pin()
+
+    def test_write_pins_visitor_to_primary(self):
+        product = self.create_products(1)[0]
+        response = self.client.get(reverse('product_list'))
+        self.assertNotIn(routers.PIN_COOKIE_NAME, response.cookies)
+
+        response = self.client.get(reverse('add_to_cart', args=[product.pk]))
+        self.assertIn(routers.PIN_COOKIE_NAME, response.cookies)
+        self.assertEqual(response.cookies[routers.PIN_COOKIE_NAME]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+        self.unpin_catalog()
+        cookie = response.cookies[routers.PIN_COOKIE_NAME].value
+        request = RequestFactory().get('/', HTTP_COOKIE=f'{routers.PIN_COOKIE_NAME}={cookie}')
+        self.assertTrue(ReplicaRoutingMiddleware(lambda request: None).is_pinned(request))
+        self.assertFalse(ReplicaRoutingMiddleware(lambda request: None).is_pinned(RequestFactory().get('/')))
+
+    def test_stock_decrement_does_not_pin_everyone(self):
+        product = self.create_products(1)[0]
+        product.stock = 5
+        product.save()
+        self.unpin_catalog()
+        add_item(self.user, product.pk, 2)
+        place_order(self.user)
+        self.assertFalse(routers.catalog_recently_written())
+
+    def test_only_catalog_invalidation_pins_everyone(self):
+        self.unpin_catalog()
+        caching.bump_version('facets')
+        self.assertFalse(routers.catalog_recently_written())
+        page_cache.invalidate()
+        self.assertTrue(routers.catalog_recently_written())
+
+    def test_image_callback_closes_its_connection(self):
+        future = mock.Mock()
+        with mock.patch.object(connection, 'close') as close:
+            images._generated(future)
+        close.assert_called_once()
+
+    def test_cache_invalidation_pins_all_processes(self):
+        self.unpin_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_products(1)
+        self.assertTrue(routers.catalog_recently_written())
+        # Другой процесс видит срок в общей таблице, а не в своём кэше
+        pinned_until = SharedCounter.objects.get(name=routers.CATALOG_PIN_COUNTER).value / 1000
+        self.assertAlmostEqual(pinned_until, time.time() + settings.REPLICA_PIN_SECONDS, delta=2)
+        routers._remember_catalog_pin(0)
+        with mock.patch('products.routers._catalog_pin_is_stale', return_value=True):
+            self.assertTrue(ReplicaRoutingMiddleware(lambda request: None).is_pinned(RequestFactory().get('/')))
+
+
+class ConcurrentAddToCartTests(TransactionTestCase):
+    THREADS = 8
+    ADDS_PER_THREAD = 10
+
+    def test_concurrent_adds_do_not_lose_updates(self):
+        category = Category.objects.create(name='Fantasy')
+        manufacturer = Manufacturer.objects.create(name='Эксмо', country='RU')
+        product = Product.objects.create(
+            name='Книга', price=Decimal('100'), category=category, manufacturer=manufacturer,
+        )
+        user = User.objects.create_user('reader', 'reader@example.com', 'password')
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(self.ADDS_PER_THREAD):
+                    add_item(user, product.pk)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            CartItem.objects.get(cart__user=user, product=product).quantity,
+            self.THREADS * self.ADDS_PER_THREAD,
+        )
+
+
+FLAKY_CALLS = []
+
+
+@task(max_attempts=2)
+def flaky_task(calls):
+    """Падает при первом вызове"""
+    FLAKY_CALLS.append(calls)
+    if len(FLAKY_CALLS) == 1:
+        raise RuntimeError('сбой')
+
+
+class TaskQueueTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        FLAKY_CALLS.clear()
+        category = Category.objects.create(name='Fantasy')
+        manufacturer = Manufacturer.objects.create(name='Эксмо', country='RU')
+        self.product = Product.objects.create(
+            name='Книга', price=Decimal('100'), category=category, manufacturer=manufacturer,
+        )
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'password')
+
+    def test_checkout_sends_confirmation_from_worker(self):
+        add_item(self.user, self.product.pk, 2)
+        order = place_order(self.user, email='buyer@example.com')
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Task.objects.get().payload, {'order_id': order.id})
+
+        self.assertEqual(task_queue.run_all(threads=2), (1, 0))
+        self.assertEqual(Task.objects.get().status, 'done')
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertIn('Книга (Эксмо) x 2', mail.outbox[0].body)
+
+    def test_confirmation_is_plain_text(self):
+        Product.objects.filter(pk=self.product.pk).update(name="Rock'n'Roll & <Blues>")
+        add_item(self.user, self.product.pk)
+        place_order(self.user, shipping_address='ул. "Ленина", 1', email='buyer@example.com')
+        task_queue.run_all()
+        self.assertIn("Rock'n'Roll & <Blues> (Эксмо) x 1", mail.outbox[0].body)
+        self.assertIn('Адрес доставки: ул. "Ленина", 1', mail.outbox[0].body)
+
+    def test_rolled_back_transaction_enqueues_nothing(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                flaky_task.enqueue(calls=1)
+                raise RuntimeError
+        self.assertFalse(Task.objects.exists())
+
+    def test_failed_task_is_retried_then_succeeds(self):
+        flaky_task.enqueue(calls=1)
+        with self.assertLogs('products.task_queue', 'WARNING'):
+            self.assertEqual(task_queue.run_all(), (0, 1))
+        task_row = Task.objects.get()
+        self.assertEqual(task_row.status, 'pending')
+        self.assertIn('сбой', task_row.last_error)
+
+        Task.objects.update(run_at=timezone.now())
+        self.assertEqual(task_queue.run_all(), (1, 0))
+        self.assertEqual(Task.objects.get().attempts, 2)
+        self.assertEqual(FLAKY_CALLS, [1, 1])
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    BUYERS = 12
+    STOCK = 5
+
+    def test_concurrent_checkouts_do_not_oversell(self):
+        category = Category.objects.create(name='Fantasy')
+        manufacturer = Manufacturer.objects.create(name='Эксмо', country='RU')
+        product = Product.objects.create(
+            name='Книга', price=Decimal('100'), stock=self.STOCK, category=category, manufacturer=manufacturer,
+        )
+        users = [User.objects.create_user(f'reader{index}') for index in range(self.BUYERS)]
+        for user in users:
+            add_item(user, product.pk)
+        barrier = threading.Barrier(self.BUYERS)
+        results = []
+
+        def worker(user):
+            try:
+                barrier.wait()
+                place_order(user)
+                results.append('ok')
+            except CheckoutError:
+                results.append('rejected')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(results.count('ok'), self.STOCK)
+        self.assertEqual(results.count('rejected'), self.BUYERS - self.STOCK)
+        self.assertEqual((product.stock, product.is_available), (0, False))
+        self.assertEqual(OrderItem.objects.filter(product=product).count(), self.STOCK)
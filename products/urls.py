@@ -1,17 +1,23 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Под ASGI каталог и JSON-ответы корзины обслуживают асинхронные представления
+catalog_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
-    path('', views.home, name='home'),
-    path('products/', views.product_list, name='product_list'),
-    path('category/<int:category_id>/', views.category_products, name='category_products'),
+    path('', catalog_views.home, name='home'),
+    path('products/', catalog_views.product_list, name='product_list'),
+    path('products/autocomplete/', views.product_autocomplete, name='product_autocomplete'),
+    path('category/<int:category_id>/', catalog_views.category_products, name='category_products'),
     path('about/', views.about, name='about'),
     
     # Корзина
     path('cart/', views.cart_view, name='cart_view'),
-    path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
+    path('cart/add/<int:product_id>/', catalog_views.add_to_cart, name='add_to_cart'),
+    path('cart/update/', views.update_cart_items, name='update_cart_items'),
     path('cart/update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
-    path('cart/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/remove/<int:item_id>/', catalog_views.remove_from_cart, name='remove_from_cart'),
     path('cart/clear/', views.clear_cart, name='clear_cart'),
     
     # Заказы
@@ -1,12 +1,21 @@
+import json
+
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
 from django.contrib import messages
-from django.db.models import Sum
+from django.db.models import Count, OuterRef, Subquery, Sum
 from .models import Category, Product, Cart, CartItem, Order, OrderItem
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm
 from .forms import UserProfileForm, CustomPasswordChangeForm
+from . import catalog, facets, navigation
+from .autocomplete import DEFAULT_LIMIT, MAX_LIMIT, autocomplete
+from .cart import MAX_QUANTITY, get_cart
+from .orders import CheckoutError, place_order
+from .page_cache import cache_anonymous_page
+from .pagination import paginate
 from django.contrib.auth import authenticate, login, logout
 from django.shortcuts import render, redirect
 
@@ -27,148 +36,157 @@ def custom_400(request, exception):
     """Браузер отправил неверный запрос 400"""
     return render(request, 'errors/400.html', status=400)
 
+@cache_anonymous_page
 def home(request):
-    popular_products = Product.objects.filter(is_available=True)[:4]
-    
     context = {
-        'popular_products': popular_products,
-        'categories': Category.objects.all(),
+        'popular_products': catalog.popular_products(),
     }
     return render(request, 'home.html', context)
 
+@cache_anonymous_page
 def product_list(request):
     """Список всех товаров с шаблоном"""
-    products = Product.objects.filter(is_available=True)
-    categories = Category.objects.all()
-
-    # Поиск товаров
-    search_query = request.GET.get('q', '')
-    if search_query:
-        products = products.filter(name__icontains=search_query)
+    query = catalog.product_list_query(request)
+    if query.ranked:
+        page = query.ranked_page(request, query.search())
+        query.fill_page(page, query.lookup.in_bulk(page.object_list))
+    else:
+        page = paginate(request, query.products, query.sort, query.per_page)
 
-    # Сортировка товаров
-    sort = request.GET.get("sort", "-created_at")
-    if sort in ['name', 'price', '-price', '-created_at']:
-        products = products.order_by(sort)
-    
-    context = {
-        'products': products,
-        'search_query': search_query,
-        'categories': categories,
-    }
+    context = query.context(page, facets.get_facets(query.selected))
     return render(request, 'products/product_list.html', context)
 
+def product_autocomplete(request):
+    """Подсказки для строки поиска из индекса в памяти"""
+    try:
+        limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        limit = DEFAULT_LIMIT
+    return JsonResponse(autocomplete.search(request.GET.get('q', ''), max(limit, 1)))
+
+@cache_anonymous_page
 def category_products(request, category_id):
     """Товары категории с шаблоном"""
-    category = get_object_or_404(Category, id=category_id)
-    products = Product.objects.filter(category=category, is_available=True)
-    categories = Category.objects.all()
+    # Категория берётся из закэшированной навигации, без запроса к базе
+    category = navigation.get_category(category_id)
+    if category is None:
+        raise Http404("Категория не найдена")
+    page = paginate(request, catalog.category_products(category_id), catalog.CATEGORY_ORDERING)
 
-    context = {
-        'category': category,
-        'products': products,
-        'categories': categories,
-    }
+    context = catalog.category_context(category, page)
     return render(request, 'products/category_products.html', context)
 
+@cache_anonymous_page
 def about(request):
     """Страница о магазине"""
-    categories = Category.objects.all()
-    context = {
-        'categories': categories,
-    }
-    return render(request, 'about.html', context)
+    return render(request, 'about.html')
 
-@login_required
 def cart_view(request):
     """Просмотр корзины"""
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.select_related('product').all()
-    
-    # Расчёт общей стоимости
-    total_price = sum(item.product.price * item.quantity for item in cart_items)
-    total_quantity = sum(item.quantity for item in cart_items)
+    cart = get_cart(request)
     
     context = {
         'cart': cart,
-        'cart_items': cart_items,
-        'total_price': total_price,
-        'total_quantity': total_quantity,
-        'categories': Category.objects.all(),
+        'cart_items': cart.items,
+        'total_price': cart.total_price,
+        'total_quantity': cart.total_quantity,
     }
     return render(request, 'cart.html', context) 
 
-@login_required
 def add_to_cart(request, product_id):
     """Добавление товара в корзину"""
-    product = get_object_or_404(Product, id=product_id, is_available=True)
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': 1}
-    )
-    
-    if not created:
-        cart_item.quantity += 1
-        cart_item.save()
-    
-    # Счёт общего количества
-    total_quantity = cart.total_quantity()
+    added = get_cart(request).add(product_id)
+    if added is None:
+        raise Http404("Товар не найден")
+    product_name, total_quantity = added
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
             'success': True,
             'cart_total_quantity': total_quantity,
-            'message': f'Товар "{product.name}" добавлен в корзину'
+            'message': f'Товар "{product_name}" добавлен в корзину'
         })
     
-    messages.success(request, f'Товар "{product.name}" добавлен в корзину')
+    messages.success(request, f'Товар "{product_name}" добавлен в корзину')
     return redirect(request.META.get('HTTP_REFERER', 'product_list'))
 
-@login_required
 def update_cart_item(request, item_id):
     """Обновление количества товара в корзине"""
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-    
     if request.method == 'POST':
-        quantity = int(request.POST.get('quantity', 1))
+        try:
+            quantity = int(request.POST.get('quantity', 1))
+        except ValueError:
+            quantity = 1
         
+        if not get_cart(request).set_quantity(item_id, quantity):
+            raise Http404("Товар не найден в корзине")
         if quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
             messages.success(request, 'Количество товара обновлено')
         else:
-            cart_item.delete()
             messages.success(request, 'Товар удален из корзины')
     
     return redirect('cart_view')
 
-@login_required
+# Сколько позиций можно изменить одним запросом
+MAX_CART_CHANGES = 100
+
+@require_POST
+def update_cart_items(request):
+    """
+    Пакетное изменение количеств в корзине (JSON).
+    Принимает {"changes": {"<id позиции>": количество, ...}} или список
+    таких словарей; 0 удаляет позицию. Возвращает пересчитанную корзину.
+    """
+    try:
+        payload = json.loads(request.body or b'{}')
+        raw_changes = payload.get('changes', {})
+        if isinstance(raw_changes, list):
+            raw_changes = {key: value for change in raw_changes for key, value in change.items()}
+        changes = {
+            int(item_id): min(max(int(quantity), 0), MAX_QUANTITY)
+            for item_id, quantity in raw_changes.items()
+        }
+    except (AttributeError, TypeError, ValueError, OverflowError):
+        # OverflowError: int() от Infinity или 1e999 из JSON
+        return JsonResponse({'success': False, 'message': 'Некорректный формат изменений'}, status=400)
+    if len(changes) > MAX_CART_CHANGES:
+        return JsonResponse({'success': False, 'message': 'Слишком много изменений'}, status=400)
+
+    cart = get_cart(request)
+    missing = cart.update_many(changes) if changes else []
+    # Позиции загружаются одним запросом, итоги считаются из них
+    items = cart.items
+    return JsonResponse({
+        'success': True,
+        'cart_total_quantity': cart.total_quantity,
+        'cart_total_price': f'{cart.total_price:.2f}',
+        'items': [
+            {'id': item.id, 'quantity': item.quantity, 'total_price': f'{item.total_price():.2f}'}
+            for item in items
+        ],
+        'not_found': missing,
+    })
+
 def remove_from_cart(request, item_id):
     """Удаление товара из корзины"""
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-    product_name = cart_item.product.name
-    cart_item.delete()
+    cart = get_cart(request)
+    product_name = cart.remove(item_id)
+    if product_name is None:
+        raise Http404("Товар не найден в корзине")
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        cart = Cart.objects.get(user=request.user)
-        total_quantity = cart.total_quantity()
         return JsonResponse({
             'success': True,
-            'cart_total_quantity': total_quantity,
+            'cart_total_quantity': cart.total_quantity,
             'message': 'Товар удален из корзины'
         })
     
     messages.success(request, f'Товар "{product_name}" удален из корзины')
     return redirect('cart_view')
 
-@login_required
 def clear_cart(request):
     """Очистка корзины"""
-    cart = get_object_or_404(Cart, user=request.user)
-    cart.items.all().delete()
+    get_cart(request).clear()
     
     messages.success(request, 'Корзина очищена')
     return redirect('cart_view')
@@ -177,54 +195,36 @@ def clear_cart(request):
 @login_required
 def checkout(request):
     """Оформление заказа"""
-    try:
-        cart = Cart.objects.get(user=request.user)
-        cart_items = cart.items.select_related('product').all()
-    except Cart.DoesNotExist:
-        cart_items = []
-    
-    if not cart_items:
-        messages.warning(request, 'Ваша корзина пуста')
-        return redirect('cart_view')
-    
-    # Расчёт общей стоимости
-    total_price = sum(item.product.price * item.quantity for item in cart_items)
-    total_quantity = sum(item.quantity for item in cart_items)
-    
     if request.method == 'POST':
         try:
-            order = Order.objects.create(
-                user=request.user,
-                total_price=total_price,
+            order = place_order(
+                request.user,
                 shipping_address=f"{request.POST.get('city')}, {request.POST.get('address')}",
                 phone_number=request.POST.get('phone'),
                 email=request.POST.get('email'),
                 notes=f"Способ оплаты: {request.POST.get('payment_method')}\nПолучатель: {request.POST.get('first_name')} {request.POST.get('last_name')}\nИндекс: {request.POST.get('postal_code')}"
             )
             
-            # Создание элементов заказа
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product.price
-                )
-            
-            cart.items.all().delete()
-            
             messages.success(request, f'Заказ #{order.id} успешно оформлен!')
             return redirect('checkout_success', order_id=order.id)
             
+        except CheckoutError as e:
+            messages.error(request, str(e))
         except Exception as e:
             messages.error(request, f'Ошибка при оформлении заказа: {str(e)}')
     
+    cart = get_cart(request)
+    cart_items = cart.items
+    
+    if not cart_items:
+        messages.warning(request, 'Ваша корзина пуста')
+        return redirect('cart_view')
+    
     context = {
         'cart': cart,
         'cart_items': cart_items,
-        'total_price': total_price,
-        'total_quantity': total_quantity,
-        'categories': Category.objects.all(),
+        'total_price': cart.total_price,
+        'total_quantity': cart.total_quantity,
     }
     return render(request, 'checkout.html', context)
 
@@ -232,25 +232,35 @@ def checkout(request):
 def checkout_success(request, order_id):
     """Страница успешного оформления заказа"""
     order = get_object_or_404(Order, id=order_id, user=request.user)
-    order_items = order.items.select_related('product').all()
+    order_items = order.items.all()
     
     context = {
         'order': order,
         'order_items': order_items,
-        'categories': Category.objects.all(),
     }
     return render(request, 'checkout_success.html', context)
 
 @login_required
 def order_list(request):
     """Список заказов пользователя"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'orders/order_list.html', {'orders': orders})
+    # Коррелированные подзапросы вместо JOIN + GROUP BY: сортировка
+    # по created_at остаётся на индексе order_user_created_idx
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    orders = Order.objects.filter(user=request.user).annotate(
+        item_count=Subquery(items.annotate(total=Count('id')).values('total')),
+        item_quantity=Subquery(items.annotate(total=Sum('quantity')).values('total')),
+    )
+    page = paginate(request, orders, '-created_at', per_page=10)
+    return render(request, 'orders/order_list.html', {'orders': page.object_list, 'page': page})
 
 @login_required
 def order_detail(request, order_id):
     """Детали заказа"""
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    # Название товара хранится в позиции заказа, Product не читается
+    order = get_object_or_404(
+        Order.objects.prefetch_related('items'),
+        id=order_id, user=request.user,
+    )
     return render(request, 'orders/order_detail.html', {'order': order})
 
 @login_required
@@ -281,7 +291,6 @@ def edit_profile(request):
     
     context = {
         'form': form,
-        'categories': Category.objects.all(),
     }
     return render(request, 'accounts/edit_profile.html', context)
 
@@ -300,7 +309,6 @@ def change_password(request):
     
     context = {
         'form': form,
-        'categories': Category.objects.all(),
     }
     return render(request, 'accounts/change_password.html', context)
 